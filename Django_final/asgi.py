@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Django_final.settings")
 
 application = get_asgi_application()
+
+from books.suggest import preload_suggestions  # noqa: E402
+
+preload_suggestions()
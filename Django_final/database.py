@@ -0,0 +1,76 @@
+"""
+Environment-driven DATABASES entries.
+
+Every setting is read from `<PREFIX>_*` variables (`DB_*` for the default
+database), so one codebase runs on a dev box with SQLite and on a
+multi-worker deployment with PostgreSQL:
+
+* `DB_ENGINE`: `sqlite` (default) or `postgresql`;
+* `DB_NAME`, `DB_USER`, `DB_PASSWORD`, `DB_HOST`, `DB_PORT`;
+* `DB_CONN_MAX_AGE`: seconds a connection is kept open between requests,
+  0 closes it after every request, `none` keeps it forever;
+* `DB_CONN_HEALTH_CHECKS`: ping persistent connections before reusing them;
+* `DB_POOL`: `pgbouncer` when connecting through a transaction-pooling
+  PgBouncer, `psycopg` for the driver-side pool (Django 5.1+), or empty;
+* `DB_POOL_MIN_SIZE` / `DB_POOL_MAX_SIZE` for the `psycopg` pool.
+
+SQLite connections are tuned with the pragmas in `SQLITE_PRAGMAS`, applied
+when each connection is created (see `books.signals.configure_sqlite`).
+`SQLITE_JOURNAL_MODE` (e.g. `wal`) switches the journal mode as well; it
+persists in the database file, so it is left alone unless set.
+"""
+import django
+from decouple import config
+from django.core.exceptions import ImproperlyConfigured
+
+ENGINES = {
+    'sqlite': 'django.db.backends.sqlite3',
+    'postgresql': 'django.db.backends.postgresql',
+}
+
+
+def conn_max_age(value):
+    return None if str(value).lower() == 'none' else int(value)
+
+
+def database_config(base_dir, prefix='DB'):
+    def setting(name, default=None, cast=str):
+        return config(f'{prefix}_{name}', default=default, cast=cast)
+
+    engine = setting('ENGINE', 'sqlite')
+    if engine not in ENGINES:
+        raise ImproperlyConfigured(f'{prefix}_ENGINE must be one of {", ".join(ENGINES)}, not "{engine}"')
+
+    database = {
+        'ENGINE': ENGINES[engine],
+        'CONN_MAX_AGE': setting('CONN_MAX_AGE', 60, cast=conn_max_age),
+        'CONN_HEALTH_CHECKS': setting('CONN_HEALTH_CHECKS', True, cast=bool),
+        'OPTIONS': {},
+    }
+    if engine == 'sqlite':
+        database['NAME'] = setting('NAME', str(base_dir / 'db.sqlite3'))
+        return database
+
+    database.update({
+        'NAME': setting('NAME', 'library'),
+        'USER': setting('USER', 'library'),
+        'PASSWORD': setting('PASSWORD', ''),
+        'HOST': setting('HOST', 'localhost'),
+        'PORT': setting('PORT', '5432'),
+    })
+    pool = setting('POOL', '')
+    if pool == 'pgbouncer':
+        # Server-side cursors (QuerySet.iterator()) do not survive transaction pooling.
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+    elif pool == 'psycopg':
+        if django.VERSION < (5, 1):
+            raise ImproperlyConfigured(f'{prefix}_POOL=psycopg needs Django 5.1 or later, use pgbouncer instead')
+        # The pool owns the connections, Django must not keep its own persistent ones.
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': setting('POOL_MIN_SIZE', 2, cast=int),
+            'max_size': setting('POOL_MAX_SIZE', 10, cast=int),
+        }
+    elif pool:
+        raise ImproperlyConfigured(f'{prefix}_POOL must be "pgbouncer", "psycopg" or empty, not "{pool}"')
+    return database
@@ -1,4 +1,6 @@
-from django.core.mail import send_mail
+import smtplib
+
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.conf import settings
 
 
@@ -10,20 +12,54 @@ def email(request):
     send_mail(subject, message, email_from, recipient_list)
 
 
-def email_borrow(request, email, name, due_date, book_title):
+def borrow_message(email, name, due_date, book_title):
     message = (f'dear {name}, \n'
                f'You have borrowed a book from our library, for which the due borrow time is due at {due_date} \n'
                f'Please return the book "{book_title}" at your earliest convenience \n')
     subject = ' You have unriturned book from our library '
     email_from = settings.EMAIL_HOST_USER
     recipient_list = [email]
-    send_mail(subject, message, email_from, recipient_list)
+    return subject, message, email_from, recipient_list
 
-def email_reserve(request, email, name, pk, book_title):
+
+def reserve_message(email, name, pk, book_title):
     message = (f'dear {name}, \n'
                f'Your reservation time is over for {book_title} \n'
                f'if you wish to reserve the book again follow the link http://localhost:8000/{pk}/ \n')
     subject = ' You have unriturned book from our library '
     email_from = settings.EMAIL_HOST_USER
     recipient_list = [email]
-    send_mail(subject, message, email_from, recipient_list)
\ No newline at end of file
+    return subject, message, email_from, recipient_list
+
+
+def email_borrow(request, email, name, due_date, book_title):
+    send_mail(*borrow_message(email, name, due_date, book_title))
+
+
+def email_reserve(request, email, name, pk, book_title):
+    send_mail(*reserve_message(email, name, pk, book_title))
+
+
+def send_messages(datatuples):
+    """
+    Sends (subject, message, from_email, recipient_list) tuples over a single
+    connection, like send_mass_mail, but reports each message separately:
+    returns a list with None for every sent message and the error otherwise.
+    """
+    connection = get_connection()
+    try:
+        connection.open()
+    except (smtplib.SMTPException, OSError) as e:
+        return [str(e)] * len(datatuples)
+
+    results = []
+    try:
+        for subject, message, email_from, recipient_list in datatuples:
+            try:
+                connection.send_messages([EmailMessage(subject, message, email_from, recipient_list)])
+                results.append(None)
+            except (smtplib.SMTPException, OSError) as e:
+                results.append(str(e))
+    finally:
+        connection.close()
+    return results
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Read replica routing.
+
+Replicas are listed in `DATABASE_REPLICAS`. Nothing is sent to them unless a
+view opts in with `replica_reads()` (see `books.views.api_views.ReplicaReadMixin`),
+so every write, transaction and background job keeps using the primary.
+
+Replicas lag behind the primary, so a user who just borrowed or reserved a
+book is pinned to the primary for `DATABASE_REPLICA_PIN_SECONDS` and reads
+their own writes. Pins live in the `REPLICA_PIN_CACHE` cache, which has to be
+shared by every worker; `check_pin_cache()` refuses per-process backends.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+_read_alias = ContextVar('read_alias', default=None)
+
+# Backends whose entries other worker processes never see.
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def check_pin_cache():
+    """
+    Raises ImproperlyConfigured when replicas are configured but pins would be
+    kept per process, where a user's next request may not see their pin.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return
+    alias = settings.REPLICA_PIN_CACHE
+    if alias not in settings.CACHES:
+        raise ImproperlyConfigured(f'REPLICA_PIN_CACHE "{alias}" is not in CACHES')
+    backend = settings.CACHES[alias]['BACKEND']
+    if backend in LOCAL_CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f'DB_REPLICAS needs a cache shared by every worker for REPLICA_PIN_CACHE, "{alias}" uses {backend}')
+
+
+def pin_cache():
+    return caches[settings.REPLICA_PIN_CACHE]
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(*user_ids):
+    if settings.DATABASE_REPLICAS:
+        pin_cache().set_many({pin_key(user_id): True for user_id in user_ids if user_id is not None},
+                             timeout=settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return user_id is not None and pin_cache().get(pin_key(user_id), False)
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """
+    Routes the reads made inside the block to one replica, picked once so every
+    query of a request sees the same snapshot. Does nothing without replicas or
+    when `user_id` is pinned to the primary.
+    """
+    if not settings.DATABASE_REPLICAS or is_pinned(user_id):
+        yield DEFAULT_DB_ALIAS
+        return
+    alias = random.choice(settings.DATABASE_REPLICAS)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication.
+        return db not in settings.DATABASE_REPLICAS
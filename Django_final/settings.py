@@ -13,7 +13,9 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 import os
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
+
+from Django_final.database import database_config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "books.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -80,12 +83,46 @@ WSGI_APPLICATION = "Django_final.wsgi.application"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
 DATABASES = {
+    "default": database_config(BASE_DIR),
+}
+
+# Read replicas, e.g. DB_REPLICAS=replica1 configured by REPLICA1_DB_* variables.
+# List and statistics GETs read from them, see Django_final/routers.py.
+DATABASE_REPLICAS = config('DB_REPLICAS', default='', cast=Csv())
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = database_config(BASE_DIR, prefix=f'{alias.upper()}_DB')
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['Django_final.routers.ReplicaRouter']
+# Seconds a user reads from the primary after their own borrow or reserve, covers replication lag.
+DATABASE_REPLICA_PIN_SECONDS = config('DB_REPLICA_PIN_SECONDS', default=5, cast=int)
+# Cache alias holding those pins. Every worker must see them, so with replicas it
+# cannot be a per-process backend such as LocMemCache (checked at startup).
+REPLICA_PIN_CACHE = config('REPLICA_PIN_CACHE', default='default')
+
+# Applied to every new SQLite connection.
+SQLITE_PRAGMAS = {
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='normal'),
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-20000, cast=int),
+    'temp_store': 'memory',
+}
+# journal_mode is stored in the database file itself, so it is only switched when
+# asked for, e.g. SQLITE_JOURNAL_MODE=wal on a deployment where readers should
+# run alongside the writer. Empty keeps whatever mode the file already has.
+SQLITE_JOURNAL_MODE = config('SQLITE_JOURNAL_MODE', default='')
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": config('CACHE_LOCATION', default='library-cache'),
     }
 }
 
+STATISTICS_CACHE_ALIAS = 'default'
+STATISTICS_CACHE_TIMEOUT = config('STATISTICS_CACHE_TIMEOUT', default=300, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -147,8 +184,23 @@ RESERVE_TIME_LIMIT = timedelta(days=1)
 DEFAULT_PAGE_SIZE = 25
 MAX_PAGE_SIZE = 100
 PAGE_PAGINATION_VIEW_COUNT = 5
+FAST_LIST_SERIALIZATION = True
+SEARCH_RESULTS_LIMIT = 1000
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+EXPORT_CHUNK_SIZE = 2000
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_FEED_MAX_PAGE_SIZE = 5000
+# Limits of the `?filters=` list filters, see books/filters.py for how conditions are priced.
+FILTER_MAX_CONDITIONS = 8
+FILTER_MAX_COST = 16
+FILTER_MAX_IN_VALUES = 100
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'books.profiling.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     'DEFAULT_PERMISSION_CLASSES': [
@@ -175,3 +227,56 @@ EMAIL_USE_SSL = False
 EMAIL_PORT = 587
 EMAIL_HOST_USER = 'kandelakiger@gmail.com'
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
+
+# Outbox delivered by `manage.py run_mail_worker`.
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_BASE = timedelta(seconds=30)
+EMAIL_OUTBOX_RETRY_MAX = timedelta(hours=1)
+EMAIL_OUTBOX_LEASE = timedelta(minutes=5)
+
+# Set to a file path to record the filters clients send to the list endpoints,
+# `manage.py advise_indexes` replays them against the query planner.
+FILTER_USAGE_LOG = config('FILTER_USAGE_LOG', default=None)
+
+# Request profiling, see books/profiling.py. Requests slower than SLOW_REQUEST_MS are
+# written to SLOW_REQUEST_LOG (NDJSON), a SLOW_REQUEST_SAMPLE_RATE fraction of them.
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=DEBUG, cast=bool)
+PROFILING_SLOW_QUERIES = 5
+PROFILING_SAMPLES_PER_ROUTE = 1000
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=500, cast=int)
+SLOW_REQUEST_SAMPLE_RATE = config('SLOW_REQUEST_SAMPLE_RATE', default=1.0, cast=float)
+SLOW_REQUEST_LOG = config('SLOW_REQUEST_LOG', default=None)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {},
+    'loggers': {},
+}
+
+if FILTER_USAGE_LOG:
+    LOGGING['handlers']['filter_usage'] = {
+        'class': 'logging.FileHandler',
+        'filename': FILTER_USAGE_LOG,
+        'formatter': 'message',
+    }
+    LOGGING['loggers']['books.filter_usage'] = {
+        'handlers': ['filter_usage'],
+        'level': 'INFO',
+        'propagate': False,
+    }
+
+if SLOW_REQUEST_LOG:
+    LOGGING['handlers']['slow_requests'] = {
+        'class': 'logging.FileHandler',
+        'filename': SLOW_REQUEST_LOG,
+        'formatter': 'message',
+    }
+    LOGGING['loggers']['books.slow_requests'] = {
+        'handlers': ['slow_requests'],
+        'level': 'INFO',
+        'propagate': False,
+    }
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Django_final.settings")
 
 application = get_wsgi_application()
+
+from books.suggest import preload_suggestions  # noqa: E402
+
+preload_suggestions()
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .forms import BorrowAdminForm, ReserveAdminForm
-from .models import Author, Genre, Book, Borrow, Reserve
+from .models import Author, Genre, Book, Borrow, Reserve, EmailOutbox
 
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
@@ -35,4 +35,10 @@ class ReserveAdmin(admin.ModelAdmin):
     list_display = ['user', 'book', 'borrowed_at', 'status']
     list_filter = ['status']
     search_fields = ['user__email', 'book__title']
-    autocomplete_fields = ['user', 'book']
\ No newline at end of file
+    autocomplete_fields = ['user', 'book']
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['dedup_key', 'subject']
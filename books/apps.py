@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BooksConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "books"
+
+    def ready(self):
+        from Django_final.routers import check_pin_cache
+        from books import signals  # noqa: F401
+
+        check_pin_cache()
@@ -0,0 +1,322 @@
+"""
+Load test harness for the REST API.
+
+`SCENARIOS` describes one request per endpoint in books/urls.py, parametrized
+with ids sampled from the database so every run touches a spread of rows.
+A driver sends them either in-process through the Django test client or to a
+running server over HTTP, and `Benchmark` times repeated calls the way
+pytest-benchmark does (warmup rounds, then measured rounds).
+
+Query counts come from the `Server-Timing` header of ProfilingMiddleware, so
+they are available in both modes. `manage.py benchmark_api` runs the suite
+and writes the results as JSON, which `compare()` diffs against a previous run.
+"""
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from datetime import timedelta
+from typing import Callable, NamedTuple
+from urllib.parse import urlencode
+
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from books.models import Author, Book, Borrow, Genre, Reserve
+from books.profiling import summarize
+from books.seeding import ACTOR_EMAIL, ACTOR_PASSWORD, LibrarySeeder
+from users.choices import UserTypeChoices
+from users.models import CustomUser
+
+
+class Response(NamedTuple):
+    status: int
+    queries: int
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    params: dict = {}
+    data: object = None
+
+
+class Scenario(NamedTuple):
+    name: str
+    build: Callable
+    # HTML views authenticate with the session cookie, only the test client driver logs in.
+    session: bool = False
+
+
+def server_timing_queries(header):
+    for metric in (header or '').split(','):
+        name, _, rest = metric.strip().partition(';')
+        if name == 'db' and 'desc="' in rest:
+            return int(rest.split('desc="', 1)[1].split()[0])
+    return None
+
+
+class Fixture:
+    """
+    Ids the scenarios draw from: a random sample of each table, found by
+    probing the id range so that it stays cheap on tables with millions of rows.
+    """
+    sample_size = 500
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.actor = LibrarySeeder.seed_actor()
+        self.book_ids = self.sample(Book)
+        self.author_ids = self.sample(Author)
+        self.genre_ids = self.sample(Genre)
+        self.borrow_ids = self.sample(Borrow)
+        self.reserve_ids = self.sample(Reserve)
+        self.student_ids = self.sample(CustomUser, user_type=UserTypeChoices.STUDENT)
+        self.due_borrows = list(Borrow.objects.filter(returned=False).select_related('user', 'book')[:20])
+        self.refresh_token = str(RefreshToken.for_user(self.actor))
+        self.access_token = str(RefreshToken.for_user(self.actor).access_token)
+
+    def sample(self, model, **filters):
+        queryset = model.objects.filter(**filters)
+        ids = queryset.order_by('id').values_list('id', flat=True)
+        first, last = ids.first(), ids.last()
+        if first is None:
+            return []
+        candidates = {self.rng.randint(first, last) for _ in range(self.sample_size * 2)}
+        found = list(queryset.filter(id__in=candidates).values_list('id', flat=True)[:self.sample_size])
+        return sorted(found) or [first]
+
+    def pick(self, ids):
+        return self.rng.choice(ids) if ids else 0
+
+
+def due_window(fixture):
+    now = timezone.now()
+    return {'start_time': now.isoformat(), 'end_time': (now + timedelta(days=1)).isoformat()}
+
+
+def borrow_due_items(fixture):
+    return [{'id': borrow.id, 'user_email': borrow.user.email, 'user_name': borrow.user.first_name,
+             'book_title': borrow.book.title, 'due_date': borrow.due_date.isoformat()}
+            for borrow in fixture.due_borrows[:5]]
+
+
+def book_filter(fixture):
+    return json.dumps([{'field': 'title', 'condition': 'istartswith', 'value': 'the'},
+                       {'field': 'stock', 'condition': 'gte', 'value': 1}])
+
+
+def loan_filter(fixture):
+    return json.dumps([{'field': 'book', 'condition': 'in', 'value': fixture.book_ids[:20] or [0]}])
+
+
+def get(name, params=None, **kwargs):
+    def build(fixture):
+        url_kwargs = {key: value(fixture) for key, value in kwargs.items()}
+        if callable(params):
+            query = params(fixture)
+        else:
+            query = {key: value(fixture) if callable(value) else value for key, value in (params or {}).items()}
+        return Request('GET', reverse(f'books:{name}', kwargs=url_kwargs), query)
+    return build
+
+
+def post(name, data):
+    def build(fixture):
+        return Request('POST', reverse(f'books:{name}'), data=data(fixture))
+    return build
+
+
+def new_book(fixture):
+    return {'title': f'Benchmark {fixture.rng.randint(0, 10 ** 9)}', 'stock': 3,
+            'authors': [fixture.pick(fixture.author_ids)], 'genres': [fixture.pick(fixture.genre_ids)]}
+
+
+def loan(fixture):
+    return {'user': fixture.pick(fixture.student_ids), 'book': fixture.pick(fixture.book_ids)}
+
+
+SCENARIOS = [
+    Scenario('home', get('home'), session=True),
+    Scenario('search page', get('search', {'query': 'the'}), session=True),
+    Scenario('book page', get('book_detail', pk=lambda f: f.pick(f.book_ids)), session=True),
+    Scenario('genres page', get('genres'), session=True),
+    Scenario('borrow page', get('borrow'), session=True),
+    Scenario('reserve page', get('reserve'), session=True),
+
+    Scenario('token', post('token_obtain_pair', lambda f: {'email': ACTOR_EMAIL, 'password': ACTOR_PASSWORD})),
+    Scenario('token refresh', post('token_refresh', lambda f: {'refresh': f.refresh_token})),
+
+    Scenario('book list', get('book-list')),
+    Scenario('book list filtered', get('book-list', {'filters': book_filter})),
+    Scenario('book list deep page', get('book-list', {'page': 20, 'page_size': 50})),
+    Scenario('book suggest', get('book-suggest', {'query': 'gar'})),
+    Scenario('book search', get('book-search', {'query': 'river'})),
+    Scenario('author list', get('author-list')),
+    Scenario('genre list', get('genre-list')),
+    Scenario('borrow list', get('borrow-list')),
+    Scenario('reserve list', get('reserve-list')),
+    Scenario('borrow export', get('borrow-export', {'filters': loan_filter})),
+    Scenario('reserve export', get('reserve-export', {'filters': loan_filter, 'export_format': 'csv'})),
+
+    Scenario('book detail', get('book-detail', pk=lambda f: f.pick(f.book_ids))),
+    Scenario('author detail', get('author-detail', pk=lambda f: f.pick(f.author_ids))),
+    Scenario('genre detail', get('genre-detail', pk=lambda f: f.pick(f.genre_ids))),
+    Scenario('reserve detail', get('reserve-detail', pk=lambda f: f.pick(f.reserve_ids))),
+    Scenario('borrow detail', get('borrow-detail', pk=lambda f: f.pick(f.borrow_ids))),
+
+    Scenario('author create', post('author-create', lambda f: {'name': 'Bench', 'surname': 'Mark'})),
+    Scenario('genre create', post('genre-create', lambda f: {'name': f'Bench {f.rng.randint(0, 10 ** 9)}'})),
+    Scenario('book create', post('book-create', new_book)),
+    Scenario('borrow create', post('borrow-create', loan)),
+    Scenario('reserve create', post('reserve-create', loan)),
+    Scenario('author batch', post('author-create-batch', lambda f: [{'name': 'Bench', 'surname': str(i)}
+                                                                    for i in range(10)])),
+    Scenario('genre batch', post('genre-create-batch', lambda f: [{'name': f'Bench {f.rng.randint(0, 10 ** 9)}'}
+                                                                  for _ in range(10)])),
+    Scenario('book batch', post('book-create-batch', lambda f: [new_book(f) for _ in range(10)])),
+
+    Scenario('top books', get('top-books')),
+    Scenario('top worst users', get('top-worst-users')),
+    Scenario('books borrows', get('top-books-borrows')),
+    Scenario('late returns', get('late-returns')),
+    Scenario('statistics cache', get('statistics-cache')),
+    Scenario('profiling stats', get('profiling-stats')),
+
+    Scenario('borrow due', get('borrow-due', due_window)),
+    Scenario('reserve due', get('reserve-due', due_window)),
+    Scenario('borrow due notify', post('borrow-due', borrow_due_items)),
+    Scenario('borrow changes', get('borrow-changes', {'limit': 100})),
+    Scenario('reserve changes', get('reserve-changes', {'limit': 100})),
+
+    Scenario('async book list', get('async-book-list')),
+    Scenario('async book search', get('async-book-search', {'query': 'river'})),
+    Scenario('async borrow due', get('async-borrow-due', due_window)),
+]
+
+
+class ClientDriver:
+    """
+    Sends requests in-process through the Django test client.
+    """
+    supports_session = True
+
+    def __init__(self, fixture):
+        # Server errors are reported as 500 responses, not raised, so one broken view does not stop the run.
+        self.client = APIClient(raise_request_exception=False, HTTP_HOST='localhost')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {fixture.access_token}')
+        self.client.force_login(fixture.actor)
+
+    def send(self, request):
+        if request.method == 'GET':
+            response = self.client.get(request.path, request.params)
+        else:
+            response = self.client.generic(request.method, request.path, json.dumps(request.data),
+                                           content_type='application/json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return Response(response.status_code, server_timing_queries(response.get('Server-Timing')))
+
+
+class HttpDriver:
+    """
+    Sends requests to a running server, e.g. `runserver` or gunicorn.
+    """
+    supports_session = False
+
+    def __init__(self, fixture, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Authorization': f'Bearer {fixture.access_token}', 'Content-Type': 'application/json'}
+
+    def send(self, request):
+        url = self.base_url + request.path
+        if request.params:
+            url = f'{url}?{urlencode(request.params)}'
+        body = json.dumps(request.data).encode() if request.data is not None else None
+        http_request = urllib.request.Request(url, data=body, headers=self.headers, method=request.method)
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                response.read()
+                return Response(response.status, server_timing_queries(response.headers.get('Server-Timing')))
+        except urllib.error.HTTPError as e:
+            e.read()
+            return Response(e.code, server_timing_queries(e.headers.get('Server-Timing')))
+
+
+class Benchmark:
+    """
+    Calls `function` `warmup` times unmeasured, then `rounds` times measured,
+    like pytest-benchmark's `benchmark` fixture. The latencies in ms and the
+    return values of the measured calls are kept in `samples` and `results`.
+    """
+
+    def __init__(self, rounds=50, warmup=3):
+        self.rounds = rounds
+        self.warmup = warmup
+        self.samples = []
+        self.results = []
+        self.elapsed = 0.0
+
+    def __call__(self, function, *args, **kwargs):
+        for _ in range(self.warmup):
+            function(*args, **kwargs)
+        started = time.perf_counter()
+        for _ in range(self.rounds):
+            call_started = time.perf_counter()
+            self.results.append(function(*args, **kwargs))
+            self.samples.append((time.perf_counter() - call_started) * 1000)
+        self.elapsed = time.perf_counter() - started
+        return self.results[-1] if self.results else None
+
+    @property
+    def stats(self):
+        return summarize(self.samples) if self.samples else {}
+
+
+def run_suite(driver, fixture, rounds=50, warmup=3, names=None, log=None):
+    """
+    Runs every scenario (or those in `names`) and returns one result dict per
+    scenario: throughput, latency percentiles in ms, query counts and errors.
+    """
+    results = []
+    for scenario in SCENARIOS:
+        if names and scenario.name not in names:
+            continue
+        if scenario.session and not driver.supports_session:
+            continue
+
+        benchmark = Benchmark(rounds, warmup)
+        benchmark(lambda: driver.send(scenario.build(fixture)))
+        statuses = [response.status for response in benchmark.results]
+        queries = [response.queries for response in benchmark.results if response.queries is not None]
+        result = {
+            'name': scenario.name,
+            'requests': rounds,
+            'throughput': rounds / benchmark.elapsed if benchmark.elapsed else 0.0,
+            'latency_ms': benchmark.stats,
+            'queries': {'mean': statistics.fmean(queries), 'max': max(queries)} if queries else None,
+            'errors': sum(1 for status in statuses if status >= 400),
+            'statuses': sorted(set(statuses)),
+        }
+        results.append(result)
+        if log:
+            log(result)
+    return results
+
+
+def compare(baseline, results, metric='p95'):
+    """
+    (name, baseline ms, current ms, relative change) for scenarios present in both runs.
+    """
+    previous = {result['name']: result for result in baseline['results']}
+    changes = []
+    for result in results:
+        before = previous.get(result['name'])
+        if not before or not before['latency_ms'] or not result['latency_ms']:
+            continue
+        old, new = before['latency_ms'][metric], result['latency_ms'][metric]
+        changes.append((result['name'], old, new, (new - old) / old if old else 0.0))
+    return changes
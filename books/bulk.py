@@ -0,0 +1,25 @@
+from books.models import Book
+from books.signals import post_bulk_create
+
+
+def bulk_create_books(items, batch_size=1000):
+    """
+    Inserts books with their authors/genres using one bulk_create per table.
+
+    `items` are dicts of Book fields plus `authors` and `genres` lists of ids.
+    """
+    relations = [{field: list(dict.fromkeys(item.pop(field, []))) for field in ('authors', 'genres')}
+                 for item in items]
+    books = Book.objects.bulk_create([Book(**item) for item in items], batch_size=batch_size)
+
+    Book.authors.through.objects.bulk_create([
+        Book.authors.through(book_id=book.id, author_id=author_id)
+        for book, related in zip(books, relations) for author_id in related['authors']
+    ], batch_size=batch_size)
+    Book.genres.through.objects.bulk_create([
+        Book.genres.through(book_id=book.id, genre_id=genre_id)
+        for book, related in zip(books, relations) for genre_id in related['genres']
+    ], batch_size=batch_size)
+
+    post_bulk_create.send(sender=Book, instances=books)
+    return books
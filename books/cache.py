@@ -0,0 +1,74 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.renderers import JSONRenderer
+
+
+class StatisticsCache:
+    """
+    Cache for computed statistics responses.
+
+    Every key is namespaced by a generation number. Writes that change the
+    underlying borrow history bump the generation, which invalidates every
+    cached ranking at once without having to know the keys. Works with any
+    Django cache backend (locmem, file based, redis, memcached).
+    """
+    prefix = 'statistics'
+
+    @property
+    def cache(self):
+        return caches[settings.STATISTICS_CACHE_ALIAS]
+
+    def _incr(self, key):
+        if self.cache.add(key, 1, timeout=None):
+            return 1
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, timeout=None)
+            return 1
+
+    def generation(self):
+        # Seeded from the clock so an evicted generation never resurrects stale keys.
+        return self.cache.get_or_set(f'{self.prefix}:generation', time.time_ns, timeout=None)
+
+    def make_key(self, name, path):
+        digest = hashlib.md5(path.encode('utf-8')).hexdigest()
+        return f'{self.prefix}:{self.generation()}:{name}:{digest}'
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self._incr(f'{self.prefix}:misses' if data is None else f'{self.prefix}:hits')
+        return data
+
+    def set(self, key, data):
+        # Store plain JSON types only, DRF's ReturnList/ReturnDict keep a reference to the serializer.
+        data = json.loads(JSONRenderer().render(data))
+        self.cache.set(key, data, timeout=settings.STATISTICS_CACHE_TIMEOUT)
+        return data
+
+    def invalidate(self):
+        key = f'{self.prefix}:generation'
+        if self.cache.add(key, time.time_ns(), timeout=None):
+            return
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), timeout=None)
+
+    def stats(self):
+        hits = self.cache.get(f'{self.prefix}:hits', 0)
+        misses = self.cache.get(f'{self.prefix}:misses', 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else None,
+            'generation': self.generation(),
+        }
+
+
+statistics_cache = StatisticsCache()
@@ -1,3 +1,6 @@
+from django.db import models
+
+
 filter_conditions = {
     'exact': '__exact',
     'iexact': '__iexact',
@@ -59,4 +62,9 @@ filter_conditions = {
     'second__gte': '__second__gte',
     'second__lt': '__second__lt',
     'second__lte': '__second__lte',
-}
\ No newline at end of file
+}
+
+class EmailStatusChoices(models.IntegerChoices):
+    PENDING = 1, "pending"
+    SENT = 2, "sent"
+    FAILED = 3, "failed"
@@ -0,0 +1,58 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def serialized_chunks(fast_serializer, queryset, chunk_size):
+    """
+    Streams `queryset` through `fast_serializer` in chunks of `chunk_size` rows,
+    using a server-side cursor so only one chunk is held in memory.
+    """
+    chunk = []
+    for row in fast_serializer.values(queryset).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield fast_serializer.serialize(chunk)
+            chunk = []
+    if chunk:
+        yield fast_serializer.serialize(chunk)
+
+
+def flatten(item, prefix=''):
+    """
+    {'user': {'id': 1}, 'book': {'authors': [...]}} -> {'user.id': 1, 'book.authors': 'A B; C D'}
+    """
+    flat = {}
+    for key, value in item.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, list):
+            flat[f'{prefix}{key}'] = '; '.join(
+                ' '.join(str(part) for part in (entry.get('name'), entry.get('surname')) if part)
+                for entry in value
+            )
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+class Echo:
+    """
+    File-like object whose write() returns the line, so csv.writer can feed a generator.
+    """
+
+    def write(self, value):
+        return value
+
+
+def ndjson_stream(chunks):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for chunk in chunks:
+        yield ''.join(encoder.encode(item) + '\n' for item in chunk)
+
+
+def csv_stream(chunks, columns):
+    writer = csv.DictWriter(Echo(), fieldnames=columns, extrasaction='ignore')
+    yield writer.writeheader()
+    for chunk in chunks:
+        yield ''.join(writer.writerow(flatten(item)) for item in chunk)
@@ -0,0 +1,166 @@
+from collections import defaultdict
+
+from rest_framework import serializers
+
+from books.models import Book
+
+# DRF fields are only used for their to_representation, so the output matches the
+# ModelSerializers exactly (timezone conversion, ISO formats).
+date_field = serializers.DateField()
+datetime_field = serializers.DateTimeField()
+
+
+def represent(field, value):
+    return None if value is None else field.to_representation(value)
+
+
+def relation_rows(book_ids):
+    """
+    Author and genre rows of `book_ids`, ordered like the Author/Genre default
+    ordering used by the nested serializers.
+    """
+    authors = Book.authors.through.objects.filter(book_id__in=book_ids).order_by('author__name').values_list(
+        'book_id', 'author_id', 'author__name', 'author__surname', 'author__birth_date'
+    )
+    genres = Book.genres.through.objects.filter(book_id__in=book_ids).order_by('genre__name').values_list(
+        'book_id', 'genre_id', 'genre__name'
+    )
+    return authors, genres
+
+
+def group_relations(author_rows, genre_rows):
+    authors = defaultdict(list)
+    genres = defaultdict(list)
+    for book_id, author_id, name, surname, birth_date in author_rows:
+        authors[book_id].append({
+            'id': author_id,
+            'name': name,
+            'surname': surname,
+            'birth_date': represent(date_field, birth_date),
+        })
+    for book_id, genre_id, name in genre_rows:
+        genres[book_id].append({'id': genre_id, 'name': name})
+    return authors, genres
+
+
+def book_relations(book_ids):
+    """
+    Authors and genres of `book_ids` as {book_id: [dict, ...]}, one query per relation.
+    """
+    if not book_ids:
+        return group_relations([], [])
+    author_rows, genre_rows = relation_rows(book_ids)
+    return group_relations(author_rows, genre_rows)
+
+
+async def abook_relations(book_ids):
+    """
+    Async version of book_relations.
+    """
+    if not book_ids:
+        return group_relations([], [])
+    author_rows, genre_rows = relation_rows(book_ids)
+    return group_relations([row async for row in author_rows], [row async for row in genre_rows])
+
+
+class FastBookSerializer:
+    """
+    Read-only equivalent of BookSerializer working on `.values()` rows.
+    """
+    columns = ('id', 'title', 'release_date', 'stock', 'active_borrows', 'active_reserves')
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.prefetch_related(None).values(*cls.columns)
+
+    @classmethod
+    def book_ids(cls, rows):
+        return [row['id'] for row in rows]
+
+    @classmethod
+    async def aserialize(cls, rows):
+        return cls.serialize(rows, await abook_relations(cls.book_ids(rows)))
+
+    @classmethod
+    def serialize(cls, rows, relations=None):
+        authors, genres = relations or book_relations(cls.book_ids(rows))
+        data = []
+        for row in rows:
+            stock = row['stock']
+            data.append({
+                'authors': authors.get(row['id'], []),
+                'genres': genres.get(row['id'], []),
+                'id': row['id'],
+                'title': row['title'],
+                'release_date': represent(date_field, row['release_date']),
+                'stock': stock,
+                'available_to_borrow': stock > row['active_borrows'] + row['active_reserves'] if stock > 0 else False,
+            })
+        return data
+
+
+class FastLoanSerializer:
+    """
+    Shared implementation for the Borrow/Reserve list serializers, which nest
+    the user and a BookSerializerSimple.
+    """
+    own_columns = ()
+    datetime_columns = ('borrowed_at', 'due_date', 'returned_at')
+    columns = ('user_id', 'user__email', 'user__first_name', 'user__last_name',
+               'book_id', 'book__title', 'book__release_date', 'book__stock')
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.prefetch_related(None).values(*cls.own_columns, *cls.columns)
+
+    @classmethod
+    def serialize_own(cls, row):
+        return {column: represent(datetime_field, row[column]) if column in cls.datetime_columns else row[column]
+                for column in cls.own_columns}
+
+    @classmethod
+    def book_ids(cls, rows):
+        return list({row['book_id'] for row in rows})
+
+    @classmethod
+    async def aserialize(cls, rows):
+        return cls.serialize(rows, await abook_relations(cls.book_ids(rows)))
+
+    @classmethod
+    def serialize(cls, rows, relations=None):
+        authors, genres = relations or book_relations(cls.book_ids(rows))
+        data = []
+        for row in rows:
+            item = cls.serialize_own(row)
+            item['user'] = {
+                'id': row['user_id'],
+                'email': row['user__email'],
+                'first_name': row['user__first_name'],
+                'last_name': row['user__last_name'],
+            }
+            item['book'] = {
+                'authors': authors.get(row['book_id'], []),
+                'genres': genres.get(row['book_id'], []),
+                'id': row['book_id'],
+                'title': row['book__title'],
+                'release_date': represent(date_field, row['book__release_date']),
+                'stock': row['book__stock'],
+            }
+            data.append({key: item[key] for key in cls.field_order})
+        return data
+
+
+class FastBorrowSerializer(FastLoanSerializer):
+    """
+    Read-only equivalent of BorrowSerializer working on `.values()` rows.
+    """
+    own_columns = ('id', 'borrowed_at', 'due_date', 'returned_at', 'returned')
+    field_order = ('id', 'user', 'book', 'borrowed_at', 'due_date', 'returned_at', 'returned')
+
+
+class FastReserveSerializer(FastLoanSerializer):
+    """
+    Read-only equivalent of ReserveSerializer working on `.values()` rows.
+    """
+    own_columns = ('id', 'borrowed_at', 'due_date', 'status')
+    field_order = ('id', 'user', 'book', 'borrowed_at', 'due_date', 'status')
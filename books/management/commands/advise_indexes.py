@@ -0,0 +1,112 @@
+import json
+import re
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from books.views import api_views
+from books.views.api_views import AuthListAPIView
+from users.choices import UserTypeChoices
+from users.models import CustomUser
+
+FULL_SCAN_RE = re.compile(r'\bSCAN \S+$')
+
+
+def filter_shape(entry):
+    """
+    Normalized form of a recorded request, values are ignored so that every
+    use of the same fields and conditions is counted together.
+    """
+    filters = entry.get('filters') or []
+    if not isinstance(filters, list):
+        filters = []
+    fields = tuple(sorted(
+        (str(item.get('field')), str(item.get('sub_field', '')), str(item.get('condition', 'exact')))
+        for item in filters if isinstance(item, dict)
+    ))
+    return entry.get('view'), fields, bool(entry.get('late'))
+
+
+def is_full_scan(plan_line):
+    # SQLite reports "SCAN <table>" for a table scan. "SCAN <table> USING INDEX ..." walks an
+    # index in order, which the paginated list views stop early, so it is not reported.
+    return FULL_SCAN_RE.search(plan_line) is not None
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded list filters through EXPLAIN QUERY PLAN and report the ones that scan whole tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.FILTER_USAGE_LOG,
+                            help='NDJSON file written by the books.filter_usage logger (FILTER_USAGE_LOG)')
+        parser.add_argument('--top', type=int, default=50, help='Number of most used filter shapes to check')
+        parser.add_argument('--all', action='store_true', help='Also print plans that use indexes')
+
+    def read_log(self, path):
+        usage = Counter()
+        samples = {}
+        with open(path, encoding='utf-8') as log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                shape = filter_shape(entry)
+                usage[shape] += 1
+                samples.setdefault(shape, entry)
+        return usage, samples
+
+    def explain(self, entry):
+        view_class = getattr(api_views, entry.get('view') or '', None)
+        if not isinstance(view_class, type) or not issubclass(view_class, AuthListAPIView):
+            return None
+
+        params = {'filters': json.dumps(entry.get('filters') or [])}
+        if entry.get('late'):
+            params['late'] = entry['late']
+        django_request = APIRequestFactory().get(f'/?{urlencode(params)}')
+        request = Request(django_request)
+        request.user = CustomUser(user_type=UserTypeChoices.LIBRARIAN)
+
+        view = view_class()
+        view.setup(django_request)
+        view.request = request
+        view.format_kwarg = None
+        return view.get_queryset().explain()
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('advise_indexes reads SQLite EXPLAIN QUERY PLAN output')
+        if not options['log']:
+            raise CommandError('Pass --log or set FILTER_USAGE_LOG')
+
+        usage, samples = self.read_log(options['log'])
+        full_scans = 0
+        for shape, count in usage.most_common(options['top']):
+            view_name, fields, late = shape
+            try:
+                plan = self.explain(samples[shape])
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{view_name} {fields}: cannot replay ({e})'))
+                continue
+            if plan is None:
+                continue
+
+            scans = [line.strip() for line in plan.splitlines() if is_full_scan(line)]
+            label = f'{view_name} x{count} filters={list(fields)} late={late}'
+            if scans:
+                full_scans += 1
+                self.stdout.write(self.style.WARNING(f'FULL SCAN {label}'))
+                for line in scans:
+                    self.stdout.write(f'    {line}')
+            elif options['all']:
+                self.stdout.write(f'OK {label}')
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line.strip()}')
+
+        self.stdout.write(f'{full_scans} of {min(len(usage), options["top"])} filter shapes scan whole tables')
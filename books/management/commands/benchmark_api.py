@@ -0,0 +1,123 @@
+import json
+import platform
+import random
+import subprocess
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from books.benchmarks import SCENARIOS, ClientDriver, Fixture, HttpDriver, compare, run_suite
+from books.models import Book, Borrow, Reserve
+from books.seeding import LibrarySeeder
+from users.models import CustomUser
+
+
+class Rollback(Exception):
+    pass
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Drive every API endpoint with synthetic traffic and report throughput, latency percentiles '
+            'and query counts as JSON, optionally seeding a synthetic library first')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=0, help='Synthetic books to seed before the run')
+        parser.add_argument('--users', type=int, default=0, help='Synthetic students to seed')
+        parser.add_argument('--borrows', type=int, default=0, help='Synthetic borrows to seed')
+        parser.add_argument('--reserves', type=int, default=0, help='Synthetic reserves to seed')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for data and request parameters')
+        parser.add_argument('--rounds', type=int, default=50, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per scenario')
+        parser.add_argument('--only', help='Comma separated scenario names')
+        parser.add_argument('--url', help='Base URL of a running server, the test client is used otherwise')
+        parser.add_argument('--keep', action='store_true',
+                            help='Commit seeded rows and writes made by the run (always the case with --url)')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Results of an earlier run to compare p95 latency with')
+        parser.add_argument('--max-regression', type=float, default=None,
+                            help='Fail when a scenario p95 is slower than the baseline by more than this fraction')
+
+    def report(self, result):
+        latency = result['latency_ms']
+        queries = result['queries']
+        self.stdout.write(
+            f"{result['name']:20} {result['throughput']:8.1f} req/s  p50 {latency['p50']:8.2f}  "
+            f"p95 {latency['p95']:8.2f}  p99 {latency['p99']:8.2f} ms  "
+            f"queries {queries['max'] if queries else '-':>4}"
+            + (f"  {result['errors']} errors {result['statuses']}" if result['errors'] else '')
+        )
+
+    def run(self, options):
+        sizes = {name: options[name] for name in ('books', 'users', 'borrows', 'reserves')}
+        if any(sizes.values()):
+            LibrarySeeder(seed=options['seed'], log=self.stdout.write).seed(**sizes)
+
+        fixture = Fixture(random.Random(options['seed']))
+        driver = HttpDriver(fixture, options['url']) if options['url'] else ClientDriver(fixture)
+        names = set(options['only'].split(',')) if options['only'] else None
+        results = run_suite(driver, fixture, options['rounds'], options['warmup'], names, log=self.report)
+        return {
+            'created': timezone.now().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'target': options['url'] or 'test client',
+            'rows': {'books': Book.objects.count(), 'users': CustomUser.objects.count(),
+                     'borrows': Borrow.objects.count(), 'reserves': Reserve.objects.count()},
+            'rounds': options['rounds'],
+            'results': results,
+        }
+
+    def handle(self, *args, **options):
+        if options['only']:
+            unknown = set(options['only'].split(',')) - {scenario.name for scenario in SCENARIOS}
+            if unknown:
+                raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        if options['rounds'] < 1:
+            raise CommandError('--rounds must be positive')
+
+        if options['url']:
+            report = self.run(options)
+        else:
+            # Query counts come from the Server-Timing header, profile in-process requests even when it is off.
+            with override_settings(PROFILING_ENABLED=True):
+                if options['keep']:
+                    report = self.run(options)
+                else:
+                    try:
+                        with transaction.atomic():
+                            report = self.run(options)
+                            raise Rollback
+                    except Rollback:
+                        pass
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = []
+            for name, old, new, change in compare(baseline, report['results']):
+                line = f'{name:20} p95 {old:8.2f} -> {new:8.2f} ms  {change:+.1%}'
+                if options['max_regression'] is not None and change > options['max_regression']:
+                    regressions.append(name)
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+            if regressions:
+                raise CommandError(f'p95 regressed by more than {options["max_regression"]:.0%}: '
+                                   f'{", ".join(regressions)}')
@@ -0,0 +1,117 @@
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from books.profiling import summarize
+from books.seeding import LibrarySeeder
+from users.models import CustomUser
+
+# (name, sync path, async path, query string); borrow_due needs a systems user.
+ENDPOINTS = [
+    ('book list', '/api/books/', '/api/async/books/', 'page_size=25'),
+    ('search', '/api/books/search/', '/api/async/books/search/', 'query=the'),
+    ('borrow due', '/api/borrow_due', '/api/async/borrow_due',
+     'start_time=2000-01-01T00:00:00%2B00:00&end_time=2000-01-02T00:00:00%2B00:00'),
+]
+
+
+class Command(BaseCommand):
+    help = ('Compare throughput of the sync views under WSGI and the sync and async views under ASGI, '
+            'driving the Django handlers in-process at a given concurrency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--user', help='Email of the user to authenticate as (the benchmark systems user '
+                                           'by default)')
+
+    def get_token(self, email):
+        if email:
+            user = CustomUser.objects.filter(is_active=True, email=email).first()
+            if user is None:
+                raise CommandError(f'No active user {email}')
+        else:
+            user = LibrarySeeder.seed_actor()
+        return str(RefreshToken.for_user(user).access_token)
+
+    def run_wsgi(self, path, query, token, total, concurrency):
+        handler = WSGIHandler()
+
+        def request(_):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '8000', 'HTTP_HOST': 'localhost',
+                'HTTP_AUTHORIZATION': f'Bearer {token}', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+            }
+            statuses = []
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers: statuses.append(status))
+            b''.join(response)
+            response.close()
+            return time.perf_counter() - started, int(statuses[0].split()[0])
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(request, range(total)))
+
+    async def run_asgi(self, path, query, token, total, concurrency):
+        handler = ASGIHandler()
+        semaphore = asyncio.Semaphore(concurrency)
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+            'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+            'server': ('localhost', 8000), 'client': ('127.0.0.1', 0),
+        }
+
+        async def request():
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            disconnected = asyncio.Event()
+            status = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(dict(scope), receive, send)
+                elapsed = time.perf_counter() - started
+            disconnected.set()
+            return elapsed, status[0]
+
+        return await asyncio.gather(*(request() for _ in range(total)))
+
+    def report(self, name, mode, results, elapsed):
+        latency = summarize([latency * 1000 for latency, _ in results])
+        errors = sum(1 for _, status in results if status >= 400)
+        self.stdout.write(
+            f'{name:11} {mode:12} {len(results) / elapsed:8.1f} req/s  '
+            f"p50 {latency['p50']:7.1f} ms  p99 {latency['p99']:7.1f} ms"
+            + (f'  {errors} errors' if errors else '')
+        )
+
+    def handle(self, *args, **options):
+        total, concurrency = options['requests'], options['concurrency']
+        token = self.get_token(options['user'])
+        self.stdout.write(f'{total} requests per run, concurrency {concurrency}')
+
+        for name, sync_path, async_path, query in ENDPOINTS:
+            started = time.perf_counter()
+            results = self.run_wsgi(sync_path, query, token, total, concurrency)
+            self.report(name, 'wsgi sync', results, time.perf_counter() - started)
+
+            for mode, path in [('asgi sync', sync_path), ('asgi async', async_path)]:
+                started = time.perf_counter()
+                results = asyncio.run(self.run_asgi(path, query, token, total, concurrency))
+                self.report(name, mode, results, time.perf_counter() - started)
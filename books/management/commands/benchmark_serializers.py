@@ -0,0 +1,59 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from books.fast_serializers import FastBookSerializer, FastBorrowSerializer
+from books.models import Book, Borrow
+from books.seeding import LibrarySeeder
+from books.serializers import BookSerializer, BorrowSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF ModelSerializer and the .values() fast path on list pages of several sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Synthetic books (and borrows) to create')
+        parser.add_argument('--page-sizes', default='10,25,100')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def measure(self, render, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            content = render()
+        return (time.perf_counter() - started) / repeat * 1000, content
+
+    def handle(self, *args, **options):
+        page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        repeat = options['repeat']
+        renderer = JSONRenderer()
+        cases = [
+            ('books', Book.objects.order_by('id'), BookSerializer, FastBookSerializer),
+            ('borrows', Borrow.objects.order_by('due_date', 'id'), BorrowSerializer, FastBorrowSerializer),
+        ]
+
+        try:
+            with transaction.atomic():
+                LibrarySeeder(seed=options['seed']).seed(books=options['rows'], authors=50, genres=20, users=1,
+                                                         borrows=options['rows'], reserves=0, rollups=False)
+                for name, queryset, serializer_class, fast_serializer in cases:
+                    for page_size in page_sizes:
+                        drf_ms, drf_content = self.measure(lambda: renderer.render(serializer_class(
+                            list(serializer_class.setup_eager_loading(queryset)[:page_size]), many=True
+                        ).data), repeat)
+                        fast_ms, fast_content = self.measure(lambda: renderer.render(fast_serializer.serialize(
+                            list(fast_serializer.values(queryset)[:page_size])
+                        )), repeat)
+                        self.stdout.write(
+                            f'{name:8} page={page_size:4}  drf {drf_ms:8.2f} ms  fast {fast_ms:8.2f} ms  '
+                            f'speedup x{drf_ms / fast_ms:5.2f}  identical={drf_content == fast_content}'
+                        )
+                raise Rollback
+        except Rollback:
+            pass
@@ -0,0 +1,45 @@
+import time
+import tracemalloc
+
+from django.core.management import BaseCommand
+
+from books.profiling import summarize
+from books.seeding import LibrarySeeder
+from books.suggest import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = 'Measure typeahead latency and memory of the suggest index on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=10_000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Titles only, the index is built in memory and the database is not touched.
+        seeder = LibrarySeeder(seed=options['seed'], vocabulary=50_000)
+        titles = [seeder.title(max_words=6) for _ in range(options['books'])]
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = PrefixIndex()
+        index.load(('book', book_id, title) for book_id, title in enumerate(titles, start=1))
+        build_time = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        samples = []
+        for _ in range(options['queries']):
+            word = seeder.rng.choice(seeder.words)
+            prefix = word[:seeder.rng.randint(1, len(word))]
+            started = time.perf_counter()
+            index.complete(prefix, options['limit'])
+            samples.append((time.perf_counter() - started) * 1000)
+
+        self.stdout.write(f"books: {options['books']}, entries: {len(index.entries)}")
+        self.stdout.write(f'build: {build_time:.2f}s, memory: {memory / 1024 / 1024:.1f} MiB')
+        summary = summarize(samples)
+        self.stdout.write(f"p50: {summary['p50']:.4f} ms, p95: {summary['p95']:.4f} ms, "
+                          f"p99: {summary['p99']:.4f} ms, max: {summary['max']:.4f} ms")
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from Django_final.emailing import reserve_message
+from books.models import Reserve
+from books.outbox import enqueue
+
+
+class Command(BaseCommand):
+    help = 'Close every overdue active reservation with set-based UPDATEs and queue the notices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Width of the id range closed per UPDATE')
+        parser.add_argument('--no-notify', action='store_true', help='Do not queue notification emails')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the overdue reservations')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        started = time.perf_counter()
+        cutoff = timezone.now()
+        overdue = Reserve.objects.filter(status=True, due_date__lt=cutoff)
+        bounds = overdue.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write('No overdue reservations')
+            return
+        if options['dry_run']:
+            self.stdout.write(f'{overdue.count()} overdue reservations')
+            return
+
+        expired = notified = batches = 0
+        for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+            with transaction.atomic():
+                rows = Reserve.close_matching(
+                    overdue.filter(id__gte=start, id__lt=start + batch_size),
+                    'user__email', 'user__first_name', 'book__title',
+                )
+                if rows and not options['no_notify']:
+                    queued = enqueue(
+                        [reserve_message(email, name, reserve_id, title)
+                         for reserve_id, _, email, name, title in rows],
+                        [f'reserve-due:{reserve_id}' for reserve_id, *_ in rows],
+                    )
+                    notified += sum(queued)
+            expired += len(rows)
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'ids {start}..{start + batch_size - 1}: {len(rows)} expired')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Expired {expired} reservations in {batches} batches, queued {notified} notices in {elapsed:.2f}s'
+        ))
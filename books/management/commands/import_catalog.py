@@ -0,0 +1,220 @@
+import csv
+import json
+import sys
+import time
+from datetime import date
+from itertools import islice
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from books.bulk import bulk_create_books
+from books.models import Author, Book, Genre
+from books.signals import post_bulk_create
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def split_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [part.strip() for part in str(value).split(';') if part.strip()]
+
+
+def author_key(value):
+    """
+    Natural key of an author: {"name": ..., "surname": ...}, "Surname, Name"
+    or "Name Surname". Without a comma the last word is the surname, so
+    multi-word surnames ("García Márquez, Gabriel") need the comma form.
+    """
+    if isinstance(value, dict):
+        name, surname = value.get('name'), value.get('surname') or None
+    elif ',' in str(value):
+        surname, _, name = str(value).partition(',')
+        surname = surname.strip() or None
+    else:
+        name, _, surname = str(value).strip().rpartition(' ')
+        if not name:
+            name, surname = surname, None
+    if not name:
+        raise InvalidRow(f'invalid author {value!r}')
+    return name.strip(), surname
+
+
+def check_length(model, field, value):
+    max_length = model._meta.get_field(field).max_length
+    if value is not None and len(value) > max_length:
+        raise InvalidRow(f'{model.__name__}.{field} longer than {max_length}: {value!r}')
+    return value
+
+
+class NaturalKeyCache:
+    """
+    Maps natural keys to primary keys, creating missing rows in bulk. Every
+    key is looked up in the database at most once per import.
+    """
+    lookup_chunk_size = 500
+
+    def __init__(self, model, key_fields):
+        self.model = model
+        self.key_fields = key_fields
+        self.ids = {}
+        self.created = 0
+
+    def find(self, keys):
+        """
+        Looks up the ids of existing rows for the `keys` not seen yet and
+        returns the keys that have no row.
+        """
+        missing = {key for key in keys if key not in self.ids}
+        if not missing:
+            return missing
+        first_field = self.key_fields[0]
+        first_values = list({key[0] for key in missing})
+        for start in range(0, len(first_values), self.lookup_chunk_size):
+            existing = self.model.objects.filter(
+                **{f'{first_field}__in': first_values[start:start + self.lookup_chunk_size]}
+            ).values_list('id', *self.key_fields)
+            for object_id, *key in existing:
+                key = tuple(key)
+                if key in missing:
+                    self.ids.setdefault(key, object_id)
+        return {key for key in missing if key not in self.ids}
+
+    def resolve(self, keys):
+        to_create = [dict(zip(self.key_fields, key)) for key in self.find(keys)]
+        if to_create:
+            instances = self.model.objects.bulk_create([self.model(**fields) for fields in to_create])
+            post_bulk_create.send(sender=self.model, instances=instances)
+            for fields, instance in zip(to_create, instances):
+                self.ids[tuple(fields[field] for field in self.key_fields)] = instance.id
+            self.created += len(instances)
+
+
+class Command(BaseCommand):
+    help = ('Stream books from an NDJSON or CSV file into the catalog, committing in chunks. '
+            'Books already in the catalog or earlier in the file (same title and release date) '
+            'are skipped. Authors are "Surname, Name" or "Name Surname", split at the last space.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, "-" for stdin')
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Input format, guessed from the file extension by default')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per transaction')
+        parser.add_argument('--strict', action='store_true', help='Abort on the first invalid row')
+
+    def read_rows(self, stream, input_format):
+        if input_format == 'csv':
+            for line_number, row in enumerate(csv.DictReader(stream), start=2):
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, InvalidRow(f'invalid JSON: {e}')
+
+    def parse_row(self, row):
+        if isinstance(row, InvalidRow):
+            raise row
+        title = (row.get('title') or '').strip()
+        if not title:
+            raise InvalidRow('missing title')
+        release_date = row.get('release_date') or None
+        try:
+            stock = int(row.get('stock') or 0)
+            if release_date:
+                release_date = date.fromisoformat(release_date)
+        except (TypeError, ValueError) as e:
+            raise InvalidRow(str(e))
+        if stock < 0:
+            raise InvalidRow('negative stock')
+
+        authors = []
+        for value in split_list(row.get('authors')):
+            name, surname = author_key(value)
+            authors.append((check_length(Author, 'name', name), check_length(Author, 'surname', surname)))
+        genres = [(check_length(Genre, 'name', str(name).strip()),) for name in split_list(row.get('genres'))]
+        return {
+            'title': check_length(Book, 'title', title),
+            'release_date': release_date,
+            'stock': stock,
+            'authors': authors,
+            'genres': genres,
+        }
+
+    def import_chunk(self, rows, authors, genres):
+        """
+        Imports the rows whose book is new and returns how many that were. Books
+        are looked up per chunk, earlier chunks are committed by then, so memory
+        does not grow with the file as it does for the author and genre caches.
+        """
+        with transaction.atomic():
+            missing = NaturalKeyCache(Book, ('title', 'release_date')).find(
+                {(row['title'], row['release_date']) for row in rows})
+            new_rows = {}
+            for row in rows:
+                key = (row['title'], row['release_date'])
+                if key in missing:
+                    new_rows.setdefault(key, row)
+            rows = list(new_rows.values())
+            authors.resolve({key for row in rows for key in row['authors']})
+            genres.resolve({key for row in rows for key in row['genres']})
+            for row in rows:
+                row['authors'] = [authors.ids[key] for key in row['authors']]
+                row['genres'] = [genres.ids[key] for key in row['genres']]
+            bulk_create_books(rows)
+        return len(rows)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        authors = NaturalKeyCache(Author, ('name', 'surname'))
+        genres = NaturalKeyCache(Genre, ('name',))
+        imported = skipped = duplicates = 0
+        started = time.perf_counter()
+
+        try:
+            rows = self.read_rows(stream, input_format)
+            while True:
+                chunk = []
+                read = 0
+                for line_number, row in islice(rows, chunk_size):
+                    read += 1
+                    try:
+                        chunk.append(self.parse_row(row))
+                    except InvalidRow as e:
+                        if options['strict']:
+                            raise CommandError(f'line {line_number}: {e}')
+                        skipped += 1
+                        self.stderr.write(f'line {line_number}: skipped, {e}')
+                if not read:
+                    break
+                if not chunk:
+                    continue
+                created = self.import_chunk(chunk, authors, genres)
+                imported += created
+                duplicates += len(chunk) - created
+                elapsed = time.perf_counter() - started
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{imported} rows, {imported / elapsed:.0f} rows/s')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} books ({skipped} skipped, {duplicates} duplicates), created {authors.created} authors and '
+            f'{genres.created} genres in {elapsed:.2f}s ({imported / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
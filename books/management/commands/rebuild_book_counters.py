@@ -0,0 +1,47 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from books.models import Book, Borrow, Reserve
+
+
+def active_count_subquery(model):
+    counts = model.objects.filter(**{model.active_field: model.active_value}, book=OuterRef('pk'))
+    counts = counts.order_by().values('book')
+    counts = counts.annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the denormalized active_borrows / active_reserves counters on Book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report books whose counters drifted, do not write anything')
+
+    def handle(self, *args, **options):
+        queryset = Book.objects.annotate(
+            real_borrows=active_count_subquery(Borrow),
+            real_reserves=active_count_subquery(Reserve),
+        )
+
+        if options['check']:
+            drifted = list(queryset.filter(
+                ~Q(active_borrows=F('real_borrows')) | ~Q(active_reserves=F('real_reserves'))
+            ).only('id', 'title', 'active_borrows', 'active_reserves'))
+            for book in drifted:
+                self.stdout.write(f'{book.id} "{book.title}": borrows {book.active_borrows} != {book.real_borrows}, '
+                                  f'reserves {book.active_reserves} != {book.real_reserves}')
+            if drifted:
+                self.stdout.write(self.style.WARNING(f'{len(drifted)} books have drifted counters'))
+            else:
+                self.stdout.write(self.style.SUCCESS('All book counters are consistent'))
+            return
+
+        with transaction.atomic():
+            updated = Book.objects.update(
+                active_borrows=active_count_subquery(Borrow),
+                active_reserves=active_count_subquery(Reserve),
+            )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt counters for {updated} books'))
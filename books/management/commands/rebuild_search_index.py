@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from books.search import get_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the book full-text search index from the catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        index = get_search_index()
+        index.rebuild(chunk_size=options['chunk_size'])
+        elapsed = (timezone.now() - started) / timedelta(seconds=1)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {type(index).__name__} in {elapsed:.2f}s'))
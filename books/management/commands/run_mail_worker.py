@@ -0,0 +1,53 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from books.outbox import claim, deliver, queue_metrics
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails from the outbox in batches, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails claimed per batch')
+        parser.add_argument('--concurrency', type=int, default=4, help='Parallel mail connections')
+        parser.add_argument('--poll-interval', type=float, default=5, help='Seconds to sleep when nothing is due')
+        parser.add_argument('--metrics-interval', type=float, default=60,
+                            help='Seconds between queue depth reports')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due instead of polling')
+
+    def report(self):
+        metrics = queue_metrics()
+        self.stdout.write(
+            f"outbox pending={metrics['pending']} due={metrics['due']} sent={metrics['sent']} "
+            f"failed={metrics['failed']} oldest_pending={metrics['oldest_pending_seconds']:.0f}s"
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--batch-size and --concurrency must be positive')
+
+        total_sent = total_failed = 0
+        last_report = time.monotonic()
+        try:
+            while True:
+                emails = claim(options['batch_size'])
+                if emails:
+                    sent, failed = deliver(emails, options['concurrency'])
+                    total_sent += sent
+                    total_failed += failed
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'batch of {len(emails)}: {sent} sent, {failed} failed')
+                elif options['once']:
+                    break
+
+                if time.monotonic() - last_report >= options['metrics_interval']:
+                    self.report()
+                    last_report = time.monotonic()
+                if not emails:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.report()
+        self.stdout.write(self.style.SUCCESS(f'Sent {total_sent} emails, {total_failed} failed attempts'))
@@ -0,0 +1,49 @@
+from django.core.management import BaseCommand, CommandError
+
+from books.seeding import LibrarySeeder
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a synthetic library: Zipf distributed popularity, late returns and '
+            'reservation churn, reproducible for a given --seed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10_000)
+        parser.add_argument('--authors', type=int, default=None, help='Defaults to a fifth of --books')
+        parser.add_argument('--genres', type=int, default=40)
+        parser.add_argument('--users', type=int, default=5_000, help='Student accounts')
+        parser.add_argument('--borrows', type=int, default=100_000)
+        parser.add_argument('--reserves', type=int, default=None, help='Defaults to a fifth of --borrows')
+        parser.add_argument('--days', type=int, default=365, help='Length of the generated history')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of book popularity')
+        parser.add_argument('--late-rate', type=float, default=0.12, help='Share of borrows returned late')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=10_000, help='Rows per insert transaction')
+        parser.add_argument('--skip-rollups', action='store_true',
+                            help='Do not rebuild the statistics rollups (run rollup_statistics --rebuild later)')
+
+    def handle(self, *args, **options):
+        for name in ('books', 'genres', 'users', 'borrows', 'days', 'chunk_size'):
+            if options[name] < 0 or (name in ('days', 'chunk_size') and options[name] == 0):
+                raise CommandError(f'--{name.replace("_", "-")} must be positive')
+        if not 0 <= options['late_rate'] <= 1:
+            raise CommandError('--late-rate must be between 0 and 1')
+
+        seeder = LibrarySeeder(seed=options['seed'], chunk_size=options['chunk_size'], zipf=options['zipf'],
+                               late_rate=options['late_rate'], days=options['days'],
+                               log=lambda message: self.stdout.write(message) if options['verbosity'] > 1 else None)
+        try:
+            seeder.seed(
+                books=options['books'],
+                authors=options['authors'] if options['authors'] is not None else max(1, options['books'] // 5),
+                genres=options['genres'],
+                users=options['users'],
+                borrows=options['borrows'],
+                reserves=options['reserves'] if options['reserves'] is not None else options['borrows'] // 5,
+                rollups=not options['skip_rollups'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {options['books']} books, {options['users']} users, {options['borrows']} borrows"
+        ))
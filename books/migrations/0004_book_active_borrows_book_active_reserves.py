@@ -0,0 +1,40 @@
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_active_counters(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Borrow = apps.get_model('books', 'Borrow')
+    Reserve = apps.get_model('books', 'Reserve')
+
+    def active_count(model, **active_filter):
+        counts = model.objects.filter(book=OuterRef('pk'), **active_filter).order_by().values('book')
+        counts = counts.annotate(total=Count('id')).values('total')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    Book.objects.update(
+        active_borrows=active_count(Borrow, returned=False),
+        active_reserves=active_count(Reserve, status=True),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0003_alter_author_options_alter_book_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="active_borrows",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Active Borrows"),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="active_reserves",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Active Reserves"),
+        ),
+        migrations.RunPython(populate_active_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.6 on 2026-10-17 14:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_active_borrows_book_active_reserves'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLateStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('late_returns', models.PositiveIntegerField(default=0, verbose_name='Late Returns')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='late_stats', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BorrowDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('borrows', models.PositiveIntegerField(default=0, verbose_name='Borrows')),
+                ('late_returns', models.PositiveIntegerField(default=0, verbose_name='Late Returns')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='books.book', verbose_name='Book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='borrow_daily_stats_day')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='borrowdailystats',
+            constraint=models.UniqueConstraint(fields=('book', 'day'), name='borrow_daily_stats_book_day'),
+        ),
+        migrations.AddIndex(
+            model_name='userlatestats',
+            index=models.Index(fields=['day'], name='user_late_stats_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='userlatestats',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='user_late_stats_user_day'),
+        ),
+    ]
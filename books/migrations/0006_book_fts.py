@@ -0,0 +1,46 @@
+from django.db import migrations, OperationalError
+
+FTS_TABLE = 'books_book_fts'
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"title, authors, genres, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+    except OperationalError:
+        # SQLite built without FTS5, books.search falls back to the in-memory index.
+        return
+
+    Book = apps.get_model('books', 'Book')
+    insert = f'INSERT INTO {FTS_TABLE} (rowid, title, authors, genres) VALUES (%s, %s, %s, %s)'
+    rows = []
+    with schema_editor.connection.cursor() as cursor:
+        for book in Book.objects.prefetch_related('authors', 'genres').iterator(chunk_size=2000):
+            authors = ' '.join(f'{author.name} {author.surname}' if author.surname else author.name
+                               for author in book.authors.all())
+            genres = ' '.join(genre.name for genre in book.genres.all())
+            rows.append((book.id, book.title, authors, genres))
+            if len(rows) >= 2000:
+                cursor.executemany(insert, rows)
+                rows = []
+        cursor.executemany(insert, rows)
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0005_borrowdailystats_userlatestats"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
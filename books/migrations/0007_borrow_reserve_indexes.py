@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-17 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_book_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['user', 'book', 'returned'], name='borrow_user_book_returned'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['due_date', 'id'], name='borrow_due_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(condition=models.Q(('returned', False)), fields=['due_date'], name='borrow_active_due_date'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['borrowed_at'], name='borrow_borrowed_at'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['returned_at'], name='borrow_returned_at'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['user', 'book', 'status'], name='reserve_user_book_status'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['due_date', 'id'], name='reserve_due_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['status', 'due_date'], name='reserve_status_due_date'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-17 14:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_borrow_reserve_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Subject')),
+                ('body', models.TextField(verbose_name='Body')),
+                ('from_email', models.CharField(max_length=255, verbose_name='From')),
+                ('to', models.JSONField(verbose_name='To')),
+                ('dedup_key', models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='Dedup Key')),
+                ('status', models.IntegerField(choices=[(1, 'pending'), (2, 'sent'), (3, 'failed')], default=1, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next Attempt At')),
+                ('claim_token', models.UUIDField(blank=True, null=True, verbose_name='Claim Token')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent At')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='email_outbox_status_next'), models.Index(fields=['claim_token'], name='email_outbox_claim_token')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.0.6 on 2026-10-17 14:47
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def populate_change_seq(apps, schema_editor):
+    ChangeSequence = apps.get_model('books', 'ChangeSequence')
+    Borrow = apps.get_model('books', 'Borrow')
+    Reserve = apps.get_model('books', 'Reserve')
+
+    # Existing rows are numbered by id; only the order within each table matters to the feeds.
+    Borrow.objects.update(change_seq=F('id'))
+    Reserve.objects.update(change_seq=F('id'))
+    last = max(Borrow.objects.aggregate(last=Max('id'))['last'] or 0,
+               Reserve.objects.aggregate(last=Max('id'))['last'] or 0)
+    ChangeSequence.objects.create(name='loans', value=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Name')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='Value')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='borrow',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Change Sequence'),
+        ),
+        migrations.AddField(
+            model_name='reserve',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Change Sequence'),
+        ),
+        migrations.RunPython(populate_change_seq, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['change_seq', 'id'], name='borrow_change_seq_id'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['change_seq', 'id'], name='reserve_change_seq_id'),
+        ),
+    ]
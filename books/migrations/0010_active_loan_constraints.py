@@ -0,0 +1,60 @@
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+
+def close_duplicates(apps, schema_editor):
+    """
+    Closes all but the newest open borrow / reserve of each (user, book), left
+    behind by concurrent creates before the constraints existed, and takes
+    them off the book counters and reports them to the change feeds.
+    """
+    Book = apps.get_model('books', 'Book')
+    ChangeSequence = apps.get_model('books', 'ChangeSequence')
+    now = timezone.now()
+    for model_name, active, closed, counter_field in (
+        ('Borrow', {'returned': False}, {'returned': True, 'returned_at': now}, 'active_borrows'),
+        ('Reserve', {'status': True}, {'status': False, 'due_date': now}, 'active_reserves'),
+    ):
+        model = apps.get_model('books', model_name)
+        duplicates = model.objects.filter(**active).values('user', 'book').annotate(
+            rows=Count('id')).filter(rows__gt=1)
+        stale = []
+        for pair in duplicates:
+            ids = model.objects.filter(user=pair['user'], book=pair['book'], **active).order_by('-id') \
+                .values_list('id', flat=True)
+            stale.extend(ids[1:])
+        if not stale:
+            continue
+        books = Counter(model.objects.filter(id__in=stale).values_list('book_id', flat=True))
+        # A new change number, so change feed clients see the rows closed.
+        sequence, _ = ChangeSequence.objects.get_or_create(name='loans')
+        ChangeSequence.objects.filter(pk=sequence.pk).update(value=F('value') + 1)
+        sequence.refresh_from_db()
+        model.objects.filter(id__in=stale).update(**closed, change_seq=sequence.value)
+        for book_id, count in books.items():
+            Book.objects.filter(id=book_id, **{f'{counter_field}__gte': count}).update(
+                **{counter_field: F(counter_field) - count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_change_seq'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='borrow',
+            constraint=models.UniqueConstraint(condition=Q(returned=False), fields=('user', 'book'),
+                                               name='borrow_one_active_per_user_book'),
+        ),
+        migrations.AddConstraint(
+            model_name='reserve',
+            constraint=models.UniqueConstraint(condition=Q(status=True), fields=('user', 'book'),
+                                               name='reserve_one_open_per_user_book'),
+        ),
+    ]
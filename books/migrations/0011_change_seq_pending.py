@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_active_loan_constraints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='borrow',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=None, editable=False, null=True, verbose_name='Change Sequence'),
+        ),
+        migrations.AlterField(
+            model_name='reserve',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=None, editable=False, null=True, verbose_name='Change Sequence'),
+        ),
+    ]
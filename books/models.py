@@ -1,10 +1,14 @@
-from django.db import models
+from collections import Counter, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from users.models import CustomUser
 from django.conf import settings
 from django.utils import timezone
+from books.choices import EmailStatusChoices
 from users.choices import UserTypeChoices
-from django.db.models import Q
+from django.db.models import Q, F
 
 
 class Author(models.Model):
@@ -29,21 +33,165 @@ class Genre(models.Model):
         ordering = ['name']
 
 
+# Books with a copy that is neither borrowed nor reserved.
+FREE_COPY = Q(stock__gt=F('active_borrows') + F('active_reserves'))
+
+
 class Book(models.Model):
     authors = models.ManyToManyField(Author, related_name='books', verbose_name=_('Authors'))
     genres = models.ManyToManyField(Genre, related_name='books', verbose_name=_('Genres'))
     title = models.CharField(max_length=50, verbose_name=_('Title'))
     release_date = models.DateField(verbose_name=_('Release Date'), blank=True, null=True)
     stock = models.PositiveIntegerField(verbose_name=_('Stock'), default=0)
+    active_borrows = models.PositiveIntegerField(verbose_name=_('Active Borrows'), default=0, editable=False)
+    active_reserves = models.PositiveIntegerField(verbose_name=_('Active Reserves'), default=0, editable=False)
 
     def __str__(self):
         return self.title
 
+    @property
+    def available_to_borrow(self):
+        return self.stock > self.active_borrows + self.active_reserves if self.stock > 0 else False
+
+    @classmethod
+    def take_copy(cls, book_id, field):
+        """
+        Counts one more active borrow or reserve in `field`, unless every copy
+        is already out. A single conditional UPDATE, so two requests for the last
+        copy cannot both get it. Returns whether a copy was free.
+        """
+        return bool(cls.objects.filter(FREE_COPY, pk=book_id).update(**{field: F(field) + 1}))
+
+    @classmethod
+    def adjust_counter(cls, book_id, field, delta):
+        queryset = cls.objects.filter(pk=book_id)
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        queryset.update(**{field: F(field) + delta})
+
     class Meta:
         ordering = ['id']
 
 
-class Borrow(models.Model):
+class OutOfStock(Exception):
+    pass
+
+
+class ActiveCounterMixin:
+    """
+    Keeps Book.active_borrows / Book.active_reserves in sync with the rows
+    that are currently active, using a conditional UPDATE on every transition.
+    A row only becomes active if a copy is free (borrows and reserves both hold
+    one), otherwise save() raises OutOfStock and the row is not written.
+
+    The transition is taken from the row as stored, locked for the rest of the
+    transaction, not from the instance: two saves of copies loaded before either
+    committed must not both release the copy.
+    """
+    counter_field = None
+    # A row is active while `active_field` holds `active_value`.
+    active_field = None
+    active_value = None
+
+    def is_active(self):
+        return getattr(self, self.active_field) == self.active_value
+
+    def clean(self):
+        # A friendly form error for the admin; save() still has the final say under concurrency.
+        super().clean()
+        new_state = self.counter_state()
+        if (self.book_id is not None and new_state[1] and new_state != self.stored_state()
+                and not Book.objects.filter(FREE_COPY, pk=self.book_id).exists()):
+            raise ValidationError({'book': _('No copy of this book is available.')})
+
+    def counter_state(self):
+        return self.book_id, self.is_active()
+
+    def stored_state(self, lock=False):
+        """
+        The counter state of the saved row, None for a new one. `lock` holds the
+        row until the transaction ends (a no-op on SQLite, which has one writer).
+        """
+        if self._state.adding or self.pk is None:
+            return None
+        queryset = type(self)._base_manager.filter(pk=self.pk)
+        if lock:
+            queryset = queryset.select_for_update()
+        row = queryset.values_list('book_id', self.active_field).first()
+        return (row[0], row[1] == self.active_value) if row else None
+
+    def sync_counter(self, old_state, new_state):
+        if old_state == new_state:
+            return
+        if old_state and old_state[1]:
+            Book.adjust_counter(old_state[0], self.counter_field, -1)
+        if new_state and new_state[1] and not Book.take_copy(new_state[0], self.counter_field):
+            raise OutOfStock(new_state[0])
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            old_state = self.stored_state(lock=True)
+            super().save(*args, **kwargs)
+            self.sync_counter(old_state, self.counter_state())
+
+
+class ChangeSequence(models.Model):
+    """
+    Named monotonic counters. The row stays locked by the UPDATE until the
+    allocating transaction ends, so numbers commit in the order they are handed
+    out; keep those transactions short (see ChangeTracked.stamp_changes).
+    """
+    name = models.CharField(max_length=50, unique=True, verbose_name=_('Name'))
+    value = models.PositiveBigIntegerField(default=0, verbose_name=_('Value'))
+
+    @classmethod
+    def allocate(cls, name):
+        with transaction.atomic(savepoint=False):
+            if not cls.objects.filter(name=name).update(value=F('value') + 1):
+                cls.objects.get_or_create(name=name)
+                cls.objects.filter(name=name).update(value=F('value') + 1)
+            return cls.objects.get(name=name).value
+
+
+class ChangeTracked(models.Model):
+    """
+    Rows carry the number of the last change feed batch they changed in, so
+    clients can fetch rows changed after the last one they saw (see the change
+    feed views). Writes only clear `change_seq`; stamp_changes() numbers the
+    pending rows before each feed read, outside the writers' transactions.
+    Code that writes with QuerySet.update() must clear `change_seq` itself.
+    """
+    change_seq = models.PositiveBigIntegerField(null=True, default=None, editable=False,
+                                                verbose_name=_('Change Sequence'))
+
+    change_sequence = 'loans'
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.change_seq = None
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'change_seq'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def stamp_changes(cls):
+        """
+        Gives every committed row with a cleared `change_seq` the next number of
+        the sequence, in a transaction of its own. Writers never wait for the
+        counter, and as numbers are only handed to committed rows and commit in
+        order, a reader past number N never misses a row numbered N or lower.
+        Rows still locked by a writer are left for the next call.
+        """
+        with transaction.atomic():
+            ids = list(cls._base_manager.select_for_update(skip_locked=True).filter(change_seq=None)
+                       .values_list('id', flat=True))
+            if ids:
+                cls._base_manager.filter(id__in=ids).update(change_seq=ChangeSequence.allocate(cls.change_sequence))
+
+
+class Borrow(ActiveCounterMixin, ChangeTracked):
     user = models.ForeignKey(CustomUser, related_name="borrows",
                              limit_choices_to=Q(user_type=UserTypeChoices.STUDENT) | Q(user_type=UserTypeChoices.SYSTEMS),
                              on_delete=models.CASCADE,
@@ -57,9 +205,27 @@ class Borrow(models.Model):
     returned_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Returned At'))
     returned = models.BooleanField(default=False, verbose_name=_('Returned'))
 
+    counter_field = 'active_borrows'
+    active_field = 'returned'
+    active_value = False
+
     def __str__(self):
         return f"{self.user.username} borrowed {self.book.title}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'book', 'returned'], name='borrow_user_book_returned'),
+            models.Index(fields=['due_date', 'id'], name='borrow_due_date_id'),
+            models.Index(fields=['due_date'], condition=Q(returned=False), name='borrow_active_due_date'),
+            models.Index(fields=['borrowed_at'], name='borrow_borrowed_at'),
+            models.Index(fields=['returned_at'], name='borrow_returned_at'),
+            models.Index(fields=['change_seq', 'id'], name='borrow_change_seq_id'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], condition=Q(returned=False),
+                                    name='borrow_one_active_per_user_book'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.id:
             self.due_date = timezone.now() + settings.BORROW_TIME_LIMIT
@@ -68,7 +234,7 @@ class Borrow(models.Model):
         super().save(*args, **kwargs)
 
 
-class Reserve(models.Model):
+class Reserve(ActiveCounterMixin, ChangeTracked):
     user = models.ForeignKey(CustomUser, related_name="reserves",
                              limit_choices_to=Q(user_type=UserTypeChoices.STUDENT) | Q(user_type=UserTypeChoices.SYSTEMS),
                              on_delete=models.CASCADE,
@@ -81,12 +247,128 @@ class Reserve(models.Model):
     due_date = models.DateTimeField(verbose_name=_('Due Date'))
     status = models.BooleanField(default=True, verbose_name=_('Status'))
 
+    counter_field = 'active_reserves'
+    active_field = 'status'
+    active_value = True
+
     def __str__(self):
         return f"{self.user.username} borrowed {self.book.title}"
 
+    @classmethod
+    def close(cls, ids):
+        """
+        Closes the open reservations among `ids`, the bulk equivalent of setting
+        status=False and saving each one. Returns the ids that were actually closed.
+        """
+        return [row[0] for row in cls.close_matching(cls.objects.filter(id__in=ids))]
+
+    @classmethod
+    def close_matching(cls, queryset, *fields):
+        """
+        Closes the open reservations in `queryset` with a single UPDATE and keeps
+        Book.active_reserves in sync. Returns the closed rows as
+        (id, book_id, *fields) tuples.
+        """
+        with transaction.atomic():
+            queryset = queryset.select_for_update(of=('self',)).filter(status=True)
+            rows = list(queryset.values_list('id', 'book_id', *fields))
+            if not rows:
+                return rows
+            cls.objects.filter(id__in=[row[0] for row in rows]).update(
+                status=False, due_date=timezone.now(), change_seq=None,
+            )
+            # One UPDATE per distinct decrement rather than per book; almost every book has count 1.
+            books_by_count = defaultdict(list)
+            for book_id, count in Counter(row[1] for row in rows).items():
+                books_by_count[count].append(book_id)
+            for count, book_ids in books_by_count.items():
+                Book.objects.filter(id__in=book_ids, **{f'{cls.counter_field}__gte': count}).update(
+                    **{cls.counter_field: F(cls.counter_field) - count}
+                )
+        return rows
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'book', 'status'], name='reserve_user_book_status'),
+            models.Index(fields=['due_date', 'id'], name='reserve_due_date_id'),
+            models.Index(fields=['status', 'due_date'], name='reserve_status_due_date'),
+            models.Index(fields=['change_seq', 'id'], name='reserve_change_seq_id'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], condition=Q(status=True),
+                                    name='reserve_one_open_per_user_book'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.id:
             self.due_date = timezone.now() + settings.RESERVE_TIME_LIMIT
         if not self.status:
             self.due_date = timezone.now()
         super().save(*args, **kwargs)
+
+
+class BorrowDailyStats(models.Model):
+    """
+    Per-book, per-day rollup of the Borrow table maintained by the
+    `rollup_statistics` command. `borrows` is counted on the borrow day,
+    `late_returns` on the day the late book came back.
+    """
+    book = models.ForeignKey(Book, related_name="daily_stats", on_delete=models.CASCADE, verbose_name=_('Book'))
+    day = models.DateField(verbose_name=_('Day'))
+    borrows = models.PositiveIntegerField(default=0, verbose_name=_('Borrows'))
+    late_returns = models.PositiveIntegerField(default=0, verbose_name=_('Late Returns'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='borrow_daily_stats_book_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='borrow_daily_stats_day'),
+        ]
+
+
+class UserLateStats(models.Model):
+    """
+    Per-user, per-day count of late returns, maintained by `rollup_statistics`.
+    """
+    user = models.ForeignKey(CustomUser, related_name="late_stats", on_delete=models.CASCADE, verbose_name=_('User'))
+    day = models.DateField(verbose_name=_('Day'))
+    late_returns = models.PositiveIntegerField(default=0, verbose_name=_('Late Returns'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='user_late_stats_user_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='user_late_stats_day'),
+        ]
+
+
+class EmailOutbox(models.Model):
+    """
+    Outbound email written in the same transaction as the change that triggers
+    it and delivered later by the `run_mail_worker` command. `dedup_key` makes
+    enqueueing the same notice twice a no-op.
+    """
+    subject = models.CharField(max_length=255, verbose_name=_('Subject'))
+    body = models.TextField(verbose_name=_('Body'))
+    from_email = models.CharField(max_length=255, verbose_name=_('From'))
+    to = models.JSONField(verbose_name=_('To'))
+    dedup_key = models.CharField(max_length=255, unique=True, blank=True, null=True, verbose_name=_('Dedup Key'))
+    status = models.IntegerField(choices=EmailStatusChoices.choices, default=EmailStatusChoices.PENDING,
+                                 verbose_name=_('Status'))
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_('Attempts'))
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name=_('Next Attempt At'))
+    claim_token = models.UUIDField(blank=True, null=True, verbose_name=_('Claim Token'))
+    last_error = models.TextField(blank=True, default='', verbose_name=_('Last Error'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name=_('Sent At'))
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_outbox_status_next'),
+            models.Index(fields=['claim_token'], name='email_outbox_claim_token'),
+        ]
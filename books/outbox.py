@@ -0,0 +1,126 @@
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from Django_final.emailing import send_messages
+from books.choices import EmailStatusChoices
+from books.models import EmailOutbox
+
+
+def enqueue(datatuples, dedup_keys=None):
+    """
+    Queues (subject, message, from_email, recipient_list) tuples for the mail
+    worker. Call it inside the transaction that makes the triggering change, so
+    the mail is queued if and only if that change commits.
+
+    Returns one boolean per tuple: False when its dedup key was already queued,
+    including by a concurrent enqueue that inserted it first.
+    """
+    datatuples = list(datatuples)
+    dedup_keys = list(dedup_keys) if dedup_keys is not None else [None] * len(datatuples)
+
+    # The rows of this call carry `token` until claim() leases them, which tells
+    # them apart from rows with the same dedup key that won the insert conflict.
+    token = uuid.uuid4()
+    seen = set()
+    emails = []
+    for (subject, message, from_email, recipient_list), dedup_key in zip(datatuples, dedup_keys):
+        if dedup_key in seen:
+            continue
+        if dedup_key:
+            seen.add(dedup_key)
+        emails.append(EmailOutbox(subject=subject, body=message, from_email=from_email,
+                                  to=list(recipient_list), dedup_key=dedup_key, claim_token=token))
+    EmailOutbox.objects.bulk_create(emails, batch_size=500, ignore_conflicts=True)
+    inserted = set(EmailOutbox.objects.filter(claim_token=token, dedup_key__in=seen)
+                   .values_list('dedup_key', flat=True)) if seen else set()
+
+    queued = []
+    for dedup_key in dedup_keys:
+        queued.append(not dedup_key or dedup_key in inserted)
+        inserted.discard(dedup_key)
+    return queued
+
+
+def claim(batch_size):
+    """
+    Leases up to `batch_size` due emails to the caller. A lease that is not
+    settled within EMAIL_OUTBOX_LEASE (e.g. the worker died) expires and the
+    emails become due again.
+    """
+    now = timezone.now()
+    due = EmailOutbox.objects.filter(status=EmailStatusChoices.PENDING, next_attempt_at__lte=now)
+    ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4()
+    due.filter(id__in=ids).update(claim_token=token, next_attempt_at=now + settings.EMAIL_OUTBOX_LEASE)
+    return list(EmailOutbox.objects.filter(claim_token=token).order_by('id'))
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff with +/-20% jitter so failed emails do not retry in lockstep.
+    """
+    seconds = min(settings.EMAIL_OUTBOX_RETRY_BASE.total_seconds() * 2 ** (attempts - 1),
+                  settings.EMAIL_OUTBOX_RETRY_MAX.total_seconds())
+    return timedelta(seconds=seconds * random.uniform(0.8, 1.2))
+
+
+def deliver(emails, concurrency=1):
+    """
+    Sends claimed emails over `concurrency` connections in parallel and records
+    the outcome of each. Returns (sent, failed) counts.
+    """
+    slices = [emails[start::concurrency] for start in range(concurrency)]
+    slices = [part for part in slices if part]
+    with ThreadPoolExecutor(max_workers=max(len(slices), 1)) as executor:
+        results = executor.map(
+            lambda part: send_messages([(email.subject, email.body, email.from_email, email.to) for email in part]),
+            slices,
+        )
+        errors = {email.id: error for part, part_errors in zip(slices, results)
+                  for email, error in zip(part, part_errors)}
+
+    now = timezone.now()
+    sent = [email_id for email_id, error in errors.items() if error is None]
+    EmailOutbox.objects.filter(id__in=sent).update(
+        status=EmailStatusChoices.SENT, sent_at=now, attempts=F('attempts') + 1, claim_token=None, last_error='',
+    )
+
+    failed = []
+    for email in emails:
+        if errors[email.id] is None:
+            continue
+        email.attempts += 1
+        email.last_error = errors[email.id]
+        email.claim_token = None
+        if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            email.status = EmailStatusChoices.FAILED
+        else:
+            email.next_attempt_at = now + retry_delay(email.attempts)
+        failed.append(email)
+    EmailOutbox.objects.bulk_update(failed, ['attempts', 'last_error', 'claim_token', 'status', 'next_attempt_at'])
+    return len(sent), len(failed)
+
+
+def queue_metrics():
+    """
+    Queue depth per status, emails due right now and the age of the oldest pending email.
+    """
+    counts = dict(EmailOutbox.objects.order_by().values_list('status').annotate(count=Count('id')))
+    pending = EmailOutbox.objects.filter(status=EmailStatusChoices.PENDING)
+    now = timezone.now()
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'pending': counts.get(EmailStatusChoices.PENDING, 0),
+        'due': pending.filter(next_attempt_at__lte=now).count(),
+        'sent': counts.get(EmailStatusChoices.SENT, 0),
+        'failed': counts.get(EmailStatusChoices.FAILED, 0),
+        'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0,
+    }
@@ -1,7 +1,232 @@
+import base64
+import json
+
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the values of the last row seen.
+
+    `ordering` must end with a unique, non-null field (usually `id`) so every
+    row has a distinct position. Each page costs one indexed range query, no
+    matter how deep the client has paged.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering, page_size):
+        self.ordering = list(ordering)
+        self.page_size = page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values, reverse = cursor['v'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, row, reverse):
+        values = []
+        for name in self.ordering:
+            field_name = name.lstrip('-')
+            value = row[field_name] if isinstance(row, dict) else getattr(row, field_name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        encoded = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(encoded.encode('utf-8')).decode('ascii')
+
+    def position_filter(self, model, values, reverse):
+        """
+        Builds the lexicographic "after this row" condition:
+        (a > x) | (a = x & b > y) | ...
+        """
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, values):
+            descending = name.startswith('-')
+            field_name = name.lstrip('-')
+            value = model._meta.get_field(field_name).to_python(value)
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{field_name}__{lookup}': value})
+            equal &= Q(**{field_name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        values, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.position_filter(queryset.model, values, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else values is not None
+        self.page = rows
+        return rows
+
+    def get_link(self, row, reverse):
+        if row is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(row, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return replace_query_param(self.base_url, self.cursor_query_param, '')
+        return self.get_link(self.page[0], True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
 
 class CustomPageNumberPagination(PageNumberPagination):
+    """
+    Page-number pagination with two opt-in modes:
+
+    * `?cursor=` switches to keyset pagination on the view's `cursor_ordering`;
+    * `?count=false` skips the COUNT(*) query and only reports next/previous.
+    """
     page_size = settings.DEFAULT_PAGE_SIZE
     max_page_size = settings.MAX_PAGE_SIZE
     page_size_query_param = 'page_size'
+    cursor_query_param = KeysetPagination.cursor_query_param
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        self.without_count = False
+        cursor_ordering = getattr(view, 'cursor_ordering', None)
+
+        if self.cursor_query_param in request.query_params and cursor_ordering:
+            page_size = self.get_page_size(request)
+            if not page_size:
+                return None
+            self.keyset = KeysetPagination(cursor_ordering, page_size)
+            return self.keyset.paginate_queryset(queryset, request, view)
+
+        if request.query_params.get(self.count_query_param, '').lower() == 'false':
+            return self.paginate_queryset_without_count(queryset, request)
+
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_queryset_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            page_number = 0
+        if page_number < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message='Invalid page.'))
+
+        offset = (page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+
+        self.request = request
+        self.without_count = True
+        self.page_number = page_number
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        if self.without_count:
+            return Response({
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            })
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if not self.without_count:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if not self.without_count:
+            return super().get_previous_link()
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+
+class ChangeFeedPagination(KeysetPagination):
+    """
+    Keyset pagination over (change_seq, id) for incremental feeds. Unlike a
+    list page, `next` is always returned: once the feed is drained it points
+    at the last row seen, so polling it returns only rows changed since. An
+    empty first page points at the newest change in the table instead.
+    """
+    ordering = ['change_seq', 'id']
+    page_size_query_param = 'limit'
+
+    def __init__(self):
+        super().__init__(self.ordering, settings.CHANGE_FEED_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        self.page_size = max(1, min(page_size, settings.CHANGE_FEED_MAX_PAGE_SIZE))
+        rows = super().paginate_queryset(queryset, request, view)
+
+        self.high_water = None
+        if not rows and not request.query_params.get(self.cursor_query_param):
+            self.high_water = queryset.model.objects.filter(change_seq__isnull=False).order_by(
+                '-change_seq', '-id').values('change_seq', 'id').first() or {'change_seq': 0, 'id': 0}
+        return rows
+
+    def get_next_link(self):
+        if self.page:
+            return self.get_link(self.page[-1], False)
+        if self.high_water is not None:
+            return self.get_link(self.high_water, False)
+        return self.base_url
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'has_more': self.has_next,
+            'results': data,
+        })
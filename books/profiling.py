@@ -0,0 +1,215 @@
+"""
+Per-request profiling.
+
+`ProfilingMiddleware` counts and times every SQL statement of a request,
+keeps the slowest ones, and adds the totals as a `Server-Timing` header
+(visible in the browser dev tools). Requests slower than `SLOW_REQUEST_MS`
+are written, sampled, to the `books.slow_requests` logger as NDJSON
+(`SLOW_REQUEST_LOG` points it at a file). Every request also feeds the
+per-route samples behind `route_stats()`, served by ProfilingStatsView.
+
+Samples are kept per process, each worker reports its own traffic.
+"""
+import heapq
+import json
+import logging
+import random
+import statistics
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+slow_request_logger = logging.getLogger('books.slow_requests')
+
+_current = ContextVar('request_profile', default=None)
+
+# (method, route) -> recent (total_ms, db_ms, serialize_ms, queries) samples.
+_samples = defaultdict(lambda: deque(maxlen=settings.PROFILING_SAMPLES_PER_ROUTE))
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.sections = defaultdict(float)
+        self.slowest = []
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        entry = (duration, self.queries, sql)
+        if len(self.slowest) < settings.PROFILING_SLOW_QUERIES:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def slowest_queries(self):
+        return [{'ms': round(duration * 1000, 2), 'sql': sql[:1000]}
+                for duration, _, sql in sorted(self.slowest, reverse=True)]
+
+
+def profile_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection (see books/signals.py), it
+    times queries for the request profile of the current context, if any.
+    Connections are per thread, so a wrapper entered around the request would
+    miss the queries async views run through sync_to_async. The context
+    variable reaches those threads.
+    """
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, time.perf_counter() - started)
+
+
+@contextmanager
+def timed(section):
+    """
+    Adds the time spent in the block to `section` of the current request's profile.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[section] += time.perf_counter() - started
+
+
+class TimedJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def server_timing(profile, total):
+    metrics = [f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"']
+    metrics += [f'{name};dur={duration * 1000:.1f}' for name, duration in profile.sections.items()]
+    metrics.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(metrics)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples, fractions=(0.50, 0.95, 0.99)):
+    """
+    Mean, the percentiles at `fractions` keyed p50, p95, ... and max of `samples`.
+    """
+    summary = {'mean': statistics.fmean(samples)}
+    summary.update((f'p{round(fraction * 100)}', percentile(samples, fraction)) for fraction in fractions)
+    summary['max'] = max(samples)
+    return summary
+
+
+def route_stats():
+    def percentiles(values):
+        return summarize(values, (0.50, 0.90, 0.99))
+
+    routes = []
+    for (method, route), samples in list(_samples.items()):
+        samples = list(samples)
+        if not samples:
+            continue
+        total, db, serialize, queries = zip(*samples)
+        routes.append({
+            'method': method, 'route': route, 'count': len(samples),
+            'total_ms': percentiles(total), 'db_ms': percentiles(db),
+            'serialize_ms': percentiles(serialize), 'queries': percentiles(queries),
+        })
+    return sorted(routes, key=lambda route: route['total_ms']['p99'], reverse=True)
+
+
+def reset_route_stats():
+    _samples.clear()
+
+
+class ProfilingMiddleware:
+    """
+    Profiles every request when PROFILING_ENABLED is set. Works in both sync
+    and async chains, so it does not force the async views onto a thread.
+    Streaming responses are measured until the response object is returned,
+    not until the last chunk is sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.PROFILING_ENABLED:
+            return self.get_response(request)
+
+        with self.profiled() as profile:
+            response = self.get_response(request)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not settings.PROFILING_ENABLED:
+            return await self.get_response(request)
+
+        with self.profiled() as profile:
+            response = await self.get_response(request)
+        return self.finish(request, response, profile)
+
+    @contextmanager
+    def profiled(self):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            yield profile
+        finally:
+            _current.reset(token)
+
+    def finish(self, request, response, profile):
+        total = time.perf_counter() - profile.started
+        response['Server-Timing'] = server_timing(profile, total)
+        self.record(request, response, profile, total)
+        return response
+
+    def record(self, request, response, profile, total):
+        match = request.resolver_match
+        if match is None:
+            return
+        route = match.route or match.view_name
+        total_ms = total * 1000
+        db_ms = profile.db_time * 1000
+        serialize_ms = profile.sections['serialize'] * 1000
+        _samples[request.method, route].append((total_ms, db_ms, serialize_ms, profile.queries))
+
+        if (total_ms >= settings.SLOW_REQUEST_MS and slow_request_logger.isEnabledFor(logging.INFO)
+                and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE):
+            slow_request_logger.info(json.dumps({
+                'time': timezone.now().isoformat(),
+                'method': request.method,
+                'route': route,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'total_ms': round(total_ms, 2),
+                'db_ms': round(db_ms, 2),
+                'serialize_ms': round(serialize_ms, 2),
+                'queries': profile.queries,
+                'slowest': profile.slowest_queries(),
+            }))
@@ -0,0 +1,271 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db import connection, OperationalError, transaction
+
+from books.models import Book
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+FTS_TABLE = 'books_book_fts'
+
+# Relative weight of each indexed column when ranking results.
+FIELD_WEIGHTS = {'title': 10.0, 'authors': 5.0, 'genres': 1.0}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def book_documents(book_ids):
+    """
+    Text indexed for each of `book_ids` as {book_id: {field: text}}, built from
+    three `.values_list()` queries rather than model instances.
+    """
+    documents = {
+        book_id: {'title': title, 'authors': [], 'genres': []}
+        for book_id, title in Book.objects.filter(id__in=book_ids).values_list('id', 'title')
+    }
+    authors = Book.authors.through.objects.filter(book_id__in=book_ids).values_list(
+        'book_id', 'author__name', 'author__surname'
+    )
+    for book_id, name, surname in authors:
+        documents[book_id]['authors'].append(f'{name} {surname}' if surname else name)
+    genres = Book.genres.through.objects.filter(book_id__in=book_ids).values_list('book_id', 'genre__name')
+    for book_id, name in genres:
+        documents[book_id]['genres'].append(name)
+
+    for document in documents.values():
+        document['authors'] = ' '.join(document['authors'])
+        document['genres'] = ' '.join(document['genres'])
+    return documents
+
+
+def all_book_documents(chunk_size):
+    chunk = []
+    for book_id in Book.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size):
+        chunk.append(book_id)
+        if len(chunk) >= chunk_size:
+            yield book_documents(chunk)
+            chunk = []
+    if chunk:
+        yield book_documents(chunk)
+
+
+# Database alias -> whether the FTS5 table exists, see FTS5SearchIndex.is_supported().
+_fts5_supported = {}
+
+
+class FTS5SearchIndex:
+    """
+    Inverted index kept in an SQLite FTS5 virtual table, rowid is the book id.
+    """
+
+    @staticmethod
+    def is_supported():
+        """
+        Whether the FTS5 table exists. Checked once per database alias, since it
+        is asked on every search and index update; migrations reset the answer.
+        """
+        if connection.alias not in _fts5_supported:
+            _fts5_supported[connection.alias] = FTS5SearchIndex.table_exists()
+        return _fts5_supported[connection.alias]
+
+    @staticmethod
+    def table_exists():
+        if connection.vendor != 'sqlite':
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                return cursor.fetchone() is not None
+        except OperationalError:
+            return False
+
+    def update(self, documents):
+        rows = [(book_id, document['title'], document['authors'], document['genres'])
+                for book_id, document in documents.items()]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, authors, genres) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove(self, book_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(book_id,) for book_id in book_ids])
+
+    def rebuild(self, chunk_size=2000):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            for documents in all_book_documents(chunk_size):
+                self.update(documents)
+
+    def search(self, query, limit=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Every token is a quoted prefix query, FTS5 ANDs them together.
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS.values())
+        sql = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}, {weights})'
+        params = [match]
+        if limit:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PythonSearchIndex:
+    """
+    Process-local inverted index used when FTS5 is not available. Built lazily
+    from the database on first use and kept current by the same signals as the
+    FTS5 table.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings = None
+        self.documents = {}
+        self.sorted_terms = []
+
+    def ensure_loaded(self):
+        if self.postings is None:
+            self.rebuild()
+
+    def _add(self, book_id, document, keep_sorted=True):
+        terms = {}
+        for field, text in document.items():
+            for token in tokenize(text):
+                terms[token] = terms.get(token, 0.0) + FIELD_WEIGHTS[field]
+        self.documents[book_id] = terms
+        for token, weight in terms.items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                if keep_sorted:
+                    self.sorted_terms.insert(bisect_left(self.sorted_terms, token), token)
+            self.postings[token][book_id] = weight
+
+    def _remove(self, book_id):
+        for token in self.documents.pop(book_id, {}):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(book_id, None)
+            if not postings:
+                del self.postings[token]
+                del self.sorted_terms[bisect_left(self.sorted_terms, token)]
+
+    def update(self, documents):
+        with self.lock:
+            if self.postings is None:
+                return
+            for book_id, document in documents.items():
+                self._remove(book_id)
+                self._add(book_id, document)
+
+    def remove(self, book_ids):
+        with self.lock:
+            if self.postings is None:
+                return
+            for book_id in book_ids:
+                self._remove(book_id)
+
+    def rebuild(self, chunk_size=2000):
+        with self.lock:
+            self.postings = {}
+            self.documents = {}
+            self.sorted_terms = []
+            for documents in all_book_documents(chunk_size):
+                for book_id, document in documents.items():
+                    self._add(book_id, document, keep_sorted=False)
+            self.sorted_terms = sorted(self.postings)
+
+    def prefix_matches(self, prefix):
+        scores = defaultdict(float)
+        position = bisect_left(self.sorted_terms, prefix)
+        while position < len(self.sorted_terms) and self.sorted_terms[position].startswith(prefix):
+            for book_id, weight in self.postings[self.sorted_terms[position]].items():
+                scores[book_id] += weight
+            position += 1
+        return scores
+
+    def search(self, query, limit=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self.lock:
+            self.ensure_loaded()
+            scores = None
+            for token in tokens:
+                matches = self.prefix_matches(token)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {book_id: score + matches[book_id] for book_id, score in scores.items()
+                              if book_id in matches}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if limit:
+            ranked = ranked[:limit]
+        return [book_id for book_id, score in ranked]
+
+
+fts5_index = FTS5SearchIndex()
+python_index = PythonSearchIndex()
+
+
+def reset_search_backend():
+    _fts5_supported.clear()
+
+
+def get_search_index():
+    return fts5_index if FTS5SearchIndex.is_supported() else python_index
+
+
+def search_books(query, limit=None):
+    """
+    Returns ids of books matching every word of `query` (as a prefix) in the
+    title, author names or genre names, best matches first.
+    """
+    return get_search_index().search(query, limit=limit)
+
+
+def ranked_books(queryset, book_ids):
+    """
+    Loads the books of `queryset` whose ids are in `book_ids`, keeping the ranking order.
+    """
+    books = queryset.in_bulk(book_ids)
+    return [books[book_id] for book_id in book_ids if book_id in books]
+
+
+def reindex_books(book_ids, chunk_size=1000):
+    if not book_ids:
+        return
+    index = get_search_index()
+
+    def update():
+        for start in range(0, len(book_ids), chunk_size):
+            index.update(book_documents(book_ids[start:start + chunk_size]))
+
+    if index is python_index:
+        # The in-memory index cannot roll back, only apply committed changes.
+        transaction.on_commit(update)
+    else:
+        update()
+
+
+def remove_books(book_ids):
+    index = get_search_index()
+    if index is python_index:
+        transaction.on_commit(lambda: index.remove(book_ids))
+    else:
+        index.remove(book_ids)
@@ -0,0 +1,248 @@
+"""
+Synthetic library data for benchmarks and capacity tests.
+
+Everything is generated from a seeded `random.Random`, so the same sizes and
+seed always produce the same rows, and inserted in chunks, one transaction per
+chunk. Catalog rows go through bulk_create. Borrows and reserves, which run
+into the millions, are written with a plain executemany INSERT: bulk_create
+spends most of its time compiling every value separately, the raw insert
+makes seeding about three times faster overall. Neither path
+runs Model.save(), so the denormalized book counters and the statistics
+rollups are rebuilt once at the end instead of per row.
+
+The shape follows a real library rather than uniform noise:
+
+* book and reader popularity are Zipf distributed, a few titles and readers
+  account for most loans;
+* loans are spread over the last `days`, in id order like real inserts; a
+  `late_rate` share is returned late, a few of those are still out;
+* reservations churn: each one is fulfilled, cancelled or expires within
+  RESERVE_TIME_LIMIT, only the recent ones are still open;
+* a reader never holds two open borrows (or reserves) of the same book, and
+  open borrows and reserves together never exceed a book's stock.
+"""
+import io
+import itertools
+import random
+import string
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from books.bulk import bulk_create_books
+from books.models import Author, Book, Borrow, Genre, Reserve
+from users.choices import UserTypeChoices
+from users.models import CustomUser
+
+FIRST_NAMES = ['Nino', 'Giorgi', 'Mariam', 'Luka', 'Ana', 'Davit', 'Elene', 'Nika', 'Tamar', 'Levan']
+LAST_NAMES = ['Beridze', 'Kapanadze', 'Gelashvili', 'Maisuradze', 'Lomidze', 'Tsiklauri', 'Kiknadze']
+WORDS = ['river', 'night', 'stone', 'garden', 'winter', 'silent', 'empire', 'letters', 'mountain', 'glass',
+         'journey', 'shadow', 'city', 'last', 'golden', 'house', 'war', 'memory', 'sea', 'light']
+
+# The systems user benchmarks authenticate as, see LibrarySeeder.seed_actor().
+ACTOR_EMAIL = 'benchmark@seed.library'
+ACTOR_PASSWORD = 'benchmark'
+
+
+def chunks(total, chunk_size):
+    for start in range(0, total, chunk_size):
+        yield start, min(chunk_size, total - start)
+
+
+def insert_rows(model, fields, rows):
+    """
+    INSERTs `rows`, tuples of already adapted values for `fields`, with one executemany.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+class Popularity:
+    """
+    Draws ids with Zipf weights 1 / rank ** exponent. Ranks are assigned in a
+    random order, so popularity is not correlated with id.
+    """
+
+    def __init__(self, ids, exponent, rng):
+        self.ids = list(ids)
+        rng.shuffle(self.ids)
+        self.cum_weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, len(self.ids) + 1)))
+        self.rng = rng
+
+    def draw(self, k):
+        return self.rng.choices(self.ids, cum_weights=self.cum_weights, k=k)
+
+
+class LibrarySeeder:
+    """
+    Adds `books`, `authors`, `genres`, student `users`, `borrows` and `reserves`
+    to whatever the database already holds. `log` receives progress lines.
+    Titles are drawn from WORDS, or from `vocabulary` random words when given.
+    """
+
+    def __init__(self, seed=42, chunk_size=10_000, zipf=1.1, late_rate=0.12, days=365, log=None,
+                 vocabulary=None):
+        self.rng = random.Random(seed)
+        self.words = WORDS if vocabulary is None else [
+            ''.join(self.rng.choices(string.ascii_lowercase, k=self.rng.randint(3, 10))) for _ in range(vocabulary)
+        ]
+        self.chunk_size = chunk_size
+        self.zipf = zipf
+        self.late_rate = late_rate
+        self.days = days
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+        self.active_borrows = set()
+        self.active_reserves = set()
+        self.lent = {}
+        self.stock = {}
+
+    def title(self, max_words=4):
+        return ' '.join(self.rng.choices(self.words, k=self.rng.randint(1, max_words))).capitalize()[:50]
+
+    @staticmethod
+    def seed_actor():
+        actor = CustomUser.objects.filter(email=ACTOR_EMAIL).first()
+        if actor is None:
+            actor = CustomUser.objects.create_user(
+                email=ACTOR_EMAIL, password=ACTOR_PASSWORD, first_name='Bench', last_name='Mark',
+                personal_number='B0000000001', birth_date='1990-01-01', user_type=UserTypeChoices.SYSTEMS,
+            )
+        return actor
+
+    def seed_authors(self, count):
+        authors = Author.objects.bulk_create([
+            Author(name=self.rng.choice(FIRST_NAMES), surname=self.rng.choice(LAST_NAMES)) for _ in range(count)
+        ], batch_size=self.chunk_size)
+        return [author.id for author in authors]
+
+    def seed_genres(self, count):
+        genres = Genre.objects.bulk_create([Genre(name=f'Genre {i}') for i in range(count)],
+                                           batch_size=self.chunk_size)
+        return [genre.id for genre in genres]
+
+    def seed_books(self, count, author_ids, genre_ids):
+        book_ids = []
+        for _, size in chunks(count, self.chunk_size):
+            with transaction.atomic():
+                books = bulk_create_books([{
+                    'title': self.title(),
+                    'stock': self.rng.randint(1, 10),
+                    'release_date': (self.now - timedelta(days=self.rng.randint(0, 365 * 80))).date(),
+                    'authors': self.rng.sample(author_ids, min(len(author_ids), self.rng.randint(1, 2))),
+                    'genres': self.rng.sample(genre_ids, min(len(genre_ids), self.rng.randint(1, 2))),
+                } for _ in range(size)], batch_size=self.chunk_size)
+            book_ids.extend(book.id for book in books)
+            self.log(f'books: {len(book_ids)}/{count}')
+        return book_ids
+
+    def seed_users(self, count):
+        # One hash for every seeded reader, hashing per row would dominate the run.
+        password = make_password('library')
+        first = (CustomUser.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        user_ids = []
+        for start, size in chunks(count, self.chunk_size):
+            users = CustomUser.objects.bulk_create([CustomUser(
+                email=f'reader{number}@seed.library', password=password,
+                first_name=self.rng.choice(FIRST_NAMES), last_name=self.rng.choice(LAST_NAMES),
+                personal_number=f'S{number:010d}', birth_date='1990-01-01', user_type=UserTypeChoices.STUDENT,
+            ) for number in range(first + start, first + start + size)], batch_size=self.chunk_size)
+            user_ids.extend(user.id for user in users)
+        return user_ids
+
+    def timestamps(self, start, size, total):
+        """
+        Sorted creation times of rows start..start+size out of `total`, spread
+        evenly over the last `days` so that ids grow with time.
+        """
+        span = self.days * 86400
+        first, last = span * start / total, span * (start + size) / total
+        offsets = sorted(self.rng.uniform(first, last) for _ in range(size))
+        origin = self.now - timedelta(days=self.days)
+        return [origin + timedelta(seconds=offset) for offset in offsets]
+
+    def take_copy(self, book_id):
+        # Open borrows and open reserves both hold a copy, like Book.take_copy.
+        if self.lent.get(book_id, 0) >= self.stock[book_id]:
+            return False
+        self.lent[book_id] = self.lent.get(book_id, 0) + 1
+        return True
+
+    borrow_fields = ('user', 'book', 'borrowed_at', 'due_date', 'returned_at', 'returned', 'change_seq')
+
+    def borrow(self, user_id, book_id, borrowed_at):
+        due_date = borrowed_at + settings.BORROW_TIME_LIMIT
+        if self.rng.random() < self.late_rate:
+            returned_at = due_date + timedelta(hours=self.rng.expovariate(1 / 72))
+        else:
+            returned_at = borrowed_at + (due_date - borrowed_at) * self.rng.random()
+
+        adapt = connection.ops.adapt_datetimefield_value
+        if returned_at < self.now or (user_id, book_id) in self.active_borrows or not self.take_copy(book_id):
+            returned_at = min(returned_at, self.now)
+            return user_id, book_id, adapt(borrowed_at), adapt(due_date), adapt(returned_at), True, 0
+
+        self.active_borrows.add((user_id, book_id))
+        return user_id, book_id, adapt(borrowed_at), adapt(due_date), None, False, 0
+
+    reserve_fields = ('user', 'book', 'borrowed_at', 'due_date', 'status', 'change_seq')
+
+    def reserve(self, user_id, book_id, reserved_at):
+        expires_at = reserved_at + settings.RESERVE_TIME_LIMIT
+        # Fulfilled or cancelled early, or left to expire. Closing sets due_date to the closing time.
+        closed_at = reserved_at + (expires_at - reserved_at) * self.rng.random() if self.rng.random() < 0.7 \
+            else expires_at
+
+        adapt = connection.ops.adapt_datetimefield_value
+        if closed_at < self.now or (user_id, book_id) in self.active_reserves or not self.take_copy(book_id):
+            return user_id, book_id, adapt(reserved_at), adapt(min(closed_at, self.now)), False, 0
+
+        self.active_reserves.add((user_id, book_id))
+        return user_id, book_id, adapt(reserved_at), adapt(expires_at), True, 0
+
+    def seed_loans(self, model, fields, count, make, books, readers):
+        for start, size in chunks(count, self.chunk_size):
+            rows = [make(user_id, book_id, created_at) for user_id, book_id, created_at in zip(
+                readers.draw(size), books.draw(size), self.timestamps(start, size, count)
+            )]
+            with transaction.atomic():
+                insert_rows(model, fields, rows)
+            self.log(f'{model.__name__.lower()}s: {start + size}/{count}')
+
+    def seed(self, books=1000, authors=200, genres=30, users=500, borrows=10_000, reserves=2_000, rollups=True):
+        started = time.perf_counter()
+        author_ids = self.seed_authors(authors) or list(Author.objects.values_list('id', flat=True))
+        genre_ids = self.seed_genres(genres) or list(Genre.objects.values_list('id', flat=True))
+        self.seed_books(books, author_ids, genre_ids)
+        self.seed_users(users)
+        if not (borrows or reserves):
+            self.log(f'seeded in {time.perf_counter() - started:.1f}s')
+            return
+
+        self.stock = dict(Book.objects.values_list('id', 'stock'))
+        self.lent = {book_id: borrows + reserves for book_id, borrows, reserves
+                     in Book.objects.values_list('id', 'active_borrows', 'active_reserves') if borrows + reserves}
+        self.active_borrows = set(Borrow.objects.filter(returned=False).values_list('user_id', 'book_id'))
+        self.active_reserves = set(Reserve.objects.filter(status=True).values_list('user_id', 'book_id'))
+        reader_ids = list(CustomUser.objects.filter(user_type=UserTypeChoices.STUDENT).values_list('id', flat=True))
+        if not self.stock or not reader_ids:
+            raise ValueError('Seeding borrows and reserves needs books and student users')
+        book_popularity = Popularity(self.stock, self.zipf, self.rng)
+        # Readers are less skewed than titles, heavy readers borrow a lot but not most of everything.
+        reader_popularity = Popularity(reader_ids, self.zipf / 2, self.rng)
+
+        self.seed_loans(Borrow, self.borrow_fields, borrows, self.borrow, book_popularity, reader_popularity)
+        self.seed_loans(Reserve, self.reserve_fields, reserves, self.reserve, book_popularity, reader_popularity)
+        call_command('rebuild_book_counters', stdout=io.StringIO())
+        if rollups:
+            call_command('rollup_statistics', rebuild=True, stdout=io.StringIO())
+        self.log(f'seeded in {time.perf_counter() - started:.1f}s')
@@ -1,9 +1,33 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from books.models import Author, Genre, Book, Borrow, Reserve
+from books.bulk import bulk_create_books
+from books.signals import post_bulk_create
 from users.models import CustomUser
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 
+def existing_ids(model, ids, chunk_size=1000):
+    ids = list(ids)
+    found = set()
+    for start in range(0, len(ids), chunk_size):
+        found.update(model.objects.filter(pk__in=ids[start:start + chunk_size]).values_list('pk', flat=True))
+    return found
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """
+    Creates all validated items with bulk_create instead of one INSERT per item.
+    """
+    batch_size = 1000
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        instances = model.objects.bulk_create([model(**item) for item in validated_data], batch_size=self.batch_size)
+        post_bulk_create.send(sender=model, instances=instances)
+        return instances
+
+
 class CustomUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
@@ -16,6 +40,7 @@ class AuthorSerializer(serializers.ModelSerializer):
         model = Author
         fields = ['id', 'name', 'surname', 'birth_date']
         depth = 1
+        list_serializer_class = BulkCreateListSerializer
 
 
 
@@ -24,6 +49,7 @@ class GenreSerializer(serializers.ModelSerializer):
         model = Genre
         fields = ['id', 'name']
         depth = 1
+        list_serializer_class = BulkCreateListSerializer
 
 
 class BookSerializerSimple(serializers.ModelSerializer):
@@ -44,6 +70,16 @@ class BorrowSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'book', 'borrowed_at', 'due_date', 'returned_at', 'returned']
         depth = 1
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('user', 'book').prefetch_related(
+            'book__authors', 'book__genres'
+        ).only(
+            'id', 'borrowed_at', 'due_date', 'returned_at', 'returned',
+            'user', 'user__id', 'user__email', 'user__first_name', 'user__last_name',
+            'book', 'book__id', 'book__title', 'book__release_date', 'book__stock',
+        )
+
 
 class CreateBookSerializer(serializers.ModelSerializer):
     authors = serializers.PrimaryKeyRelatedField(queryset=Author.objects.all(), many=True, write_only=True)
@@ -62,6 +98,45 @@ class CreateBookSerializer(serializers.ModelSerializer):
         return book
 
 
+class BookBulkCreateListSerializer(BulkCreateListSerializer):
+    """
+    Validates every author/genre id of the batch with one query per relation
+    and inserts books and their m2m rows with bulk_create.
+    """
+    relations = {'authors': Author, 'genres': Genre}
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+
+        missing = {}
+        for field, model in self.relations.items():
+            ids = {pk for item in items for pk in item[field]}
+            missing[field] = ids - existing_ids(model, ids)
+
+        errors = []
+        for item in items:
+            item_errors = {}
+            for field in self.relations:
+                invalid = [pk for pk in item[field] if pk in missing[field]]
+                if invalid:
+                    item_errors[field] = [f'Invalid pk "{pk}" - object does not exist.' for pk in invalid]
+            errors.append(item_errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def create(self, validated_data):
+        return bulk_create_books(validated_data, batch_size=self.batch_size)
+
+
+class BookBatchCreateSerializer(CreateBookSerializer):
+    authors = serializers.ListField(child=serializers.IntegerField(), write_only=True)
+    genres = serializers.ListField(child=serializers.IntegerField(), write_only=True)
+
+    class Meta(CreateBookSerializer.Meta):
+        list_serializer_class = BookBulkCreateListSerializer
+
+
 class BookSerializer(serializers.ModelSerializer):
     authors = AuthorSerializer(many=True, required=False)
     genres = GenreSerializer(many=True, required=False)
@@ -71,9 +146,12 @@ class BookSerializer(serializers.ModelSerializer):
         model = Book
         fields = ['authors', 'genres', 'id', 'title', 'release_date', 'stock', 'available_to_borrow']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related('authors', 'genres')
+
     def get_available_to_borrow(self, obj):
-        # print(obj.stock, obj.borrows_count)
-        return obj.stock > obj.borrows_count + obj.reserves_count if obj.stock > 0 else False
+        return obj.available_to_borrow
 
 
 class TopBookSerializer(serializers.ModelSerializer):
@@ -83,6 +161,13 @@ class TopBookSerializer(serializers.ModelSerializer):
         model = Book
         fields = ['id', 'title', 'authors', 'genres', 'release_date', 'stock', 'borrows_count']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(
+            Prefetch('authors', queryset=Author.objects.only('id')),
+            Prefetch('genres', queryset=Genre.objects.only('id')),
+        )
+
     def get_borrows_count(self, obj):
         # print(obj.stock, obj.borrows_count)
         return obj.borrows_count
@@ -138,7 +223,17 @@ class ReserveSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Reserve
-        fields = ['user', 'book', 'borrowed_at', 'due_date', 'status']
+        fields = ['id', 'user', 'book', 'borrowed_at', 'due_date', 'status']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('user', 'book').prefetch_related(
+            'book__authors', 'book__genres'
+        ).only(
+            'id', 'borrowed_at', 'due_date', 'status',
+            'user', 'user__id', 'user__email', 'user__first_name', 'user__last_name',
+            'book', 'book__id', 'book__title', 'book__release_date', 'book__stock',
+        )
 
 
 class ReserveStatusUpdateSerializer(serializers.ModelSerializer):
@@ -157,12 +252,16 @@ class BorrowCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Borrow
         fields = ['user', 'book', 'due_date']
+        # The partial unique constraint is checked by the insert itself, see LoanCreateAPIView.
+        validators = []
 
 
 class ReserveCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reserve
         fields = ['user', 'book']
+        # The partial unique constraint is checked by the insert itself, see LoanCreateAPIView.
+        validators = []
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -180,16 +279,18 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 
 class CustomBorrowSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     user_email = serializers.EmailField(source='user.email')
     user_name = serializers.CharField(source='user.first_name')
     book_title = serializers.CharField(source='book.title')
 
     class Meta:
         model = Borrow
-        fields = ['user_email', 'user_name', 'book_title', 'due_date']
+        fields = ['user_email', 'user_name', 'book_title', 'due_date', 'id']
 
 
 class CustomReserveSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField()
     user_email = serializers.EmailField(source='user.email')
     user_name = serializers.CharField(source='user.first_name')
     book_title = serializers.CharField(source='book.title')
@@ -197,3 +298,9 @@ class CustomReserveSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reserve
         fields = ['user_email', 'user_name', 'book_title', 'due_date', 'status', 'id']
+
+
+class BorrowChangeSerializer(CustomBorrowSerializer):
+
+    class Meta(CustomBorrowSerializer.Meta):
+        fields = CustomBorrowSerializer.Meta.fields + ['returned']
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver, Signal
+
+from books.cache import statistics_cache
+from books.models import Author, Book, Borrow, Genre, Reserve
+from books.profiling import profile_query
+from books.search import reindex_books, remove_books, reset_search_backend
+from books.suggest import update_suggestion, update_suggestions
+from users.models import CustomUser
+
+# Sent after bulk_create, which skips post_save/m2m_changed, with `instances` holding the new rows.
+post_bulk_create = Signal()
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Tunes every new SQLite connection with SQLITE_PRAGMAS: busy_timeout makes
+    writers wait for the lock instead of failing with "database is locked".
+    SQLITE_JOURNAL_MODE, when set, switches the journal mode too (WAL lets
+    readers run alongside the writer); it is written to the database file, so
+    it is never changed unless asked for.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if settings.SQLITE_JOURNAL_MODE:
+            cursor.execute(f'PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE}')
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def install_query_profiler(sender, connection, **kwargs):
+    # At the bottom of the stack: execute_wrapper() pops the last wrapper on exit.
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, profile_query)
+
+
+@receiver(post_delete, sender=Borrow)
+@receiver(post_delete, sender=Reserve)
+def release_active_counter(sender, instance, **kwargs):
+    instance.sync_counter(instance.counter_state(), None)
+
+
+# Loans only reach the statistics through the rollups, which rollup_statistics invalidates itself.
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_statistics(sender, **kwargs):
+    transaction.on_commit(statistics_cache.invalidate)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_statistics(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(statistics_cache.invalidate)
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    reindex_books([instance.id])
+
+
+@receiver(post_migrate)
+def forget_search_backend(sender, **kwargs):
+    # Migrations create or drop the FTS5 table.
+    reset_search_backend()
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    remove_books([instance.id])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def reindex_related_books(sender, instance, created, **kwargs):
+    if not created:
+        reindex_books(list(instance.books.values_list('id', flat=True)))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def collect_related_books(sender, instance, **kwargs):
+    instance._deleted_book_ids = list(instance.books.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def reindex_books_after_delete(sender, instance, **kwargs):
+    reindex_books(getattr(instance, '_deleted_book_ids', []))
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def reindex_book_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            reindex_books([instance.id])
+    elif action == 'pre_clear':
+        instance._cleared_book_ids = list(instance.books.values_list('id', flat=True))
+    elif action == 'post_clear':
+        reindex_books(getattr(instance, '_cleared_book_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        reindex_books(list(pk_set))
+
+
+@receiver(post_save, sender=Book)
+def update_book_suggestion(sender, instance, **kwargs):
+    update_suggestion('book', instance.id, instance.title)
+
+
+@receiver(post_save, sender=Author)
+def update_author_suggestion(sender, instance, **kwargs):
+    update_suggestion('author', instance.id, str(instance))
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_suggestion(sender, instance, **kwargs):
+    update_suggestion('book', instance.id, None)
+
+
+@receiver(post_delete, sender=Author)
+def remove_author_suggestion(sender, instance, **kwargs):
+    update_suggestion('author', instance.id, None)
+
+
+@receiver(post_bulk_create, sender=Book)
+def books_bulk_created(sender, instances, **kwargs):
+    reindex_books([book.id for book in instances])
+    update_suggestions(('book', book.id, book.title) for book in instances)
+    transaction.on_commit(statistics_cache.invalidate)
+
+
+@receiver(post_bulk_create, sender=Author)
+def authors_bulk_created(sender, instances, **kwargs):
+    update_suggestions(('author', author.id, str(author)) for author in instances)
@@ -0,0 +1,183 @@
+import heapq
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Sum
+
+from books.models import Author, Book, BorrowDailyStats
+from books.search import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Only the first few words of a label get their own entry, which bounds memory per label.
+MAX_WORDS_PER_LABEL = 6
+
+# Prefixes matching more entries than this keep their ranked results until the index changes,
+# so one or two letter prefixes do not rank a large share of the catalog on every keystroke.
+RANKED_CACHE_THRESHOLD = 1000
+
+
+def label_keys(label):
+    words = tokenize(label)[:MAX_WORDS_PER_LABEL]
+    return [' '.join(words[position:]) for position in range(len(words))]
+
+
+class PrefixIndex:
+    """
+    Process-local typeahead index: a sorted array of (key, kind, id, label)
+    entries. Every word start of a label is a key, so "pea" completes
+    "War and Peace". A lookup bisects to the matching entries and returns the
+    `limit` most popular, by the (kind, id) weights given to load().
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = None
+        self.keys = {}
+        self.weights = {}
+        self.ranked = {}
+
+    def ensure_loaded(self, labels, weights):
+        """
+        Loads the index from the `labels` and `weights` callables unless it is
+        loaded already; concurrent first callers wait for a single load.
+        """
+        if self.entries is not None:
+            return
+        with self.lock:
+            if self.entries is None:
+                self.load(labels(), weights())
+
+    def add(self, kind, object_id, label):
+        keys = label_keys(label)
+        self.keys[kind, object_id] = (keys, label)
+        for key in keys:
+            insort(self.entries, (key, kind, object_id, label))
+
+    def remove(self, kind, object_id):
+        keys, label = self.keys.pop((kind, object_id), ((), None))
+        for key in keys:
+            position = bisect_left(self.entries, (key, kind, object_id, label))
+            if position < len(self.entries) and self.entries[position] == (key, kind, object_id, label):
+                del self.entries[position]
+
+    def load(self, labels, weights=None):
+        """
+        Replaces the index with `labels`, an iterable of (kind, id, label),
+        ranked by `weights`, {(kind, id): popularity}.
+        """
+        with self.lock:
+            self.weights = weights or {}
+            self.ranked = {}
+            entries = []
+            self.keys = {}
+            for kind, object_id, label in labels:
+                keys = label_keys(label)
+                self.keys[kind, object_id] = (keys, label)
+                entries.extend((key, kind, object_id, label) for key in keys)
+            entries.sort()
+            self.entries = entries
+
+    def update(self, kind, object_id, label):
+        with self.lock:
+            if self.entries is None:
+                return
+            self.ranked = {}
+            self.remove(kind, object_id)
+            if label is not None:
+                self.add(kind, object_id, label)
+
+    def update_many(self, items):
+        """
+        Adds or replaces many (kind, id, label) items with a single re-sort
+        instead of one insort per entry.
+        """
+        with self.lock:
+            if self.entries is None:
+                return
+            self.ranked = {}
+            for kind, object_id, label in items:
+                self.remove(kind, object_id)
+            for kind, object_id, label in items:
+                keys = label_keys(label)
+                self.keys[kind, object_id] = (keys, label)
+                self.entries.extend((key, kind, object_id, label) for key in keys)
+            self.entries.sort()
+
+    def rank(self, start, end, limit):
+        # An object matching under several keys counts once, at its first key.
+        matches = {}
+        for position in range(start, end):
+            key, kind, object_id, label = self.entries[position]
+            matches.setdefault((kind, object_id), (position, label))
+        ranked = heapq.nsmallest(limit, matches.items(),
+                                 key=lambda item: (-self.weights.get(item[0], 0), item[1][0]))
+        return [{'type': kind, 'id': object_id, 'label': label} for (kind, object_id), (_, label) in ranked]
+
+    def complete(self, prefix, limit):
+        prefix = ' '.join(tokenize(prefix))
+        if not prefix:
+            return []
+        with self.lock:
+            start = bisect_left(self.entries, (prefix,))
+            end = bisect_left(self.entries, (prefix + '\U0010ffff',), start)
+            if end - start <= RANKED_CACHE_THRESHOLD:
+                return self.rank(start, end, limit)
+            ranked = self.ranked.get(prefix)
+            if ranked is None or len(ranked) < limit:
+                ranked = self.ranked[prefix] = self.rank(start, end, max(limit, settings.SUGGEST_MAX_LIMIT))
+            return ranked[:limit]
+
+
+def catalog_labels():
+    for book_id, title in Book.objects.values_list('id', 'title').iterator(chunk_size=5000):
+        yield 'book', book_id, title
+    for author in Author.objects.only('id', 'name', 'surname').iterator(chunk_size=5000):
+        yield 'author', author.id, str(author)
+
+
+def catalog_popularity():
+    """
+    Borrows per book from the statistics rollups, authors count the borrows of their books.
+    """
+    books = dict(BorrowDailyStats.objects.values('book_id').annotate(total=Sum('borrows'))
+                 .values_list('book_id', 'total').order_by())
+    weights = {('book', book_id): total for book_id, total in books.items()}
+    authors = Counter()
+    for author_id, book_id in Book.authors.through.objects.filter(book_id__in=books).values_list(
+            'author_id', 'book_id').iterator(chunk_size=5000):
+        authors[author_id] += books[book_id]
+    weights.update((('author', author_id), total) for author_id, total in authors.items())
+    return weights
+
+
+suggest_index = PrefixIndex()
+
+
+def suggest(prefix, limit):
+    suggest_index.ensure_loaded(catalog_labels, catalog_popularity)
+    return suggest_index.complete(prefix, limit)
+
+
+def preload_suggestions():
+    """
+    Loads the index at server start instead of on the first request. A database
+    that is not migrated yet leaves it to the first request.
+    """
+    try:
+        suggest_index.ensure_loaded(catalog_labels, catalog_popularity)
+    except DatabaseError as e:
+        logger.warning('Suggestion index not preloaded: %s', e)
+
+
+def update_suggestion(kind, object_id, label):
+    transaction.on_commit(lambda: suggest_index.update(kind, object_id, label))
+
+
+def update_suggestions(items):
+    items = list(items)
+    transaction.on_commit(lambda: suggest_index.update_many(items))
@@ -1,3 +1,1249 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import importlib
+import io
+import json
+import os
+import random
+import smtplib
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Count, F, Q
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from Django_final.database import database_config
+from Django_final.routers import check_pin_cache
+from books import search
+from books.benchmarks import SCENARIOS, ClientDriver, Fixture, run_suite
+from books.cache import statistics_cache
+from books.choices import EmailStatusChoices
+from books.filters import BOOK_FILTERS
+from books.forms import BorrowAdminForm
+from books import suggest as suggestions
+from books.models import Author, Genre, Book, Borrow, BorrowDailyStats, Reserve, EmailOutbox, OutOfStock
+from books.outbox import enqueue, queue_metrics
+from books.profiling import ProfilingMiddleware, reset_route_stats, summarize
+from books.search import FTS5SearchIndex, python_index, search_books
+from books.seeding import LibrarySeeder
+from books.suggest import PrefixIndex, suggest, suggest_index
+from users.choices import UserTypeChoices
+from users.models import CustomUser
+
+
+class LibraryTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email='librarian@mail.com', password='password', first_name='Libra', last_name='Rian',
+            personal_number='00000000001', birth_date='1990-01-01', user_type=UserTypeChoices.LIBRARIAN,
+        )
+        authors = [Author.objects.create(name=f'Author {i}') for i in range(3)]
+        genres = [Genre.objects.create(name=f'Genre {i}') for i in range(3)]
+        for i in range(30):
+            book = Book.objects.create(title=f'Book {i}', stock=3)
+            book.authors.set(authors[:1 + i % 3])
+            book.genres.set(genres[:1 + i % 2])
+            Borrow.objects.create(user=cls.user, book=book)
+            Reserve.objects.create(user=cls.user, book=book)
+        cls.book = book
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class QueryBudgetTests(LibraryTestCase):
+    """
+    Every list/detail endpoint must issue a constant number of queries,
+    no matter how many rows the page holds.
+    """
+
+    def count_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context.captured_queries)
+
+    def assertQueryBudget(self, url, budget):
+        small = self.count_queries(url, page_size=2)
+        large = self.count_queries(url, page_size=25)
+        self.assertEqual(small, large, f'{url} query count depends on page size')
+        self.assertLessEqual(large, budget, f'{url} issues {large} queries, budget is {budget}')
+
+    def test_book_list(self):
+        # count, page, authors, genres
+        self.assertQueryBudget(reverse('books:book-list'), 4)
+
+    def test_borrow_list(self):
+        # count, page with user and book, authors, genres
+        self.assertQueryBudget(reverse('books:borrow-list'), 4)
+
+    def test_reserve_list(self):
+        self.assertQueryBudget(reverse('books:reserve-list'), 4)
+
+    def test_author_and_genre_lists(self):
+        self.assertQueryBudget(reverse('books:author-list'), 2)
+        self.assertQueryBudget(reverse('books:genre-list'), 2)
+
+    def test_statistics(self):
+        self.assertQueryBudget(reverse('books:top-books'), 4)
+        self.assertQueryBudget(reverse('books:top-books-borrows'), 4)
+
+    def test_book_detail(self):
+        self.assertLessEqual(self.count_queries(reverse('books:book-detail', args=[self.book.id])), 3)
+
+    def test_borrow_and_reserve_detail(self):
+        borrow = Borrow.objects.filter(book=self.book).first()
+        reserve = Reserve.objects.filter(book=self.book).first()
+        self.assertLessEqual(self.count_queries(reverse('books:borrow-detail', args=[borrow.id])), 3)
+        self.assertLessEqual(self.count_queries(reverse('books:reserve-detail', args=[reserve.id])), 3)
+
+
+class ActiveCounterTests(LibraryTestCase):
+
+    def assertCountersMatch(self):
+        for book in Book.objects.all():
+            self.assertEqual((book.active_borrows, book.active_reserves),
+                             (book.borrows.filter(returned=False).count(), book.reserves.filter(status=True).count()),
+                             book.title)
+        output = io.StringIO()
+        call_command('rebuild_book_counters', check=True, stdout=output)
+        self.assertIn('consistent', output.getvalue())
+
+    def test_transitions(self):
+        book = Book.objects.create(title='Counted', stock=5)
+        borrow = Borrow.objects.create(user=self.user, book=book)
+        reserve = Reserve.objects.create(user=self.user, book=book)
+        self.assertCountersMatch()
+
+        borrow.returned = True
+        borrow.save()
+        reserve.status = False
+        reserve.save()
+        self.assertCountersMatch()
+
+        borrow.returned = False
+        borrow.save()
+        borrow.book = Book.objects.create(title='Moved to', stock=1)
+        borrow.save()
+        self.assertCountersMatch()
+
+        borrow.delete()
+        Reserve.objects.filter(book=book).delete()
+        self.assertCountersMatch()
+
+    def test_stale_copies(self):
+        book = Book.objects.create(title='Raced', stock=2)
+        borrow = Borrow.objects.create(user=self.user, book=book)
+        Borrow.objects.create(user=CustomUser.objects.create_user(
+            email='other@mail.com', password='password', first_name='Ot', last_name='Her',
+            personal_number='00000000009', birth_date='1990-01-01', user_type=UserTypeChoices.STUDENT,
+        ), book=book)
+        # Two requests load the same borrow before either returns it.
+        first, second = Borrow.objects.get(pk=borrow.pk), Borrow.objects.get(pk=borrow.pk)
+        first.returned = second.returned = True
+        first.save()
+        second.save()
+        self.assertCountersMatch()
+        self.assertEqual(Book.objects.get(pk=book.pk).active_borrows, 1)
+
+        reserve = Reserve.objects.create(user=self.user, book=book)
+        stale = Reserve.objects.get(pk=reserve.pk)
+        Reserve.close([reserve.pk])
+        stale.status = False
+        stale.save()
+        self.assertCountersMatch()
+
+        # A reloaded instance reopens the borrow as usual.
+        borrow.refresh_from_db()
+        borrow.returned = False
+        borrow.save()
+        self.assertEqual(Book.objects.get(pk=book.pk).active_borrows, 2)
+        with self.assertRaises(OutOfStock):
+            Reserve.objects.create(user=self.user, book=book)
+        self.assertCountersMatch()
+
+    def test_deferred_loads(self):
+        borrow = Borrow.objects.filter(returned=False).first()
+        with self.assertNumQueries(1):
+            self.assertEqual(Borrow.objects.only('id', 'due_date').get(pk=borrow.pk).due_date, borrow.due_date)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(Reserve.objects.only('id')[:5]), 5)
+
+        deferred = Borrow.objects.defer('returned').get(pk=borrow.pk)
+        deferred.returned = True
+        deferred.save()
+        self.assertCountersMatch()
+
+    def test_bulk_paths(self):
+        Reserve.close(list(Reserve.objects.values_list('id', flat=True)[:10]))
+        self.assertCountersMatch()
+        Reserve.objects.filter(status=True).update(due_date=timezone.now() - timedelta(hours=1))
+        call_command('expire_reserves', stdout=io.StringIO())
+        Borrow.objects.filter(book__title__startswith='Book 1').delete()
+        self.assertCountersMatch()
+
+        Book.objects.update(active_borrows=0)
+        call_command('rebuild_book_counters', stdout=io.StringIO())
+        self.assertCountersMatch()
+
+
+class FastSerializationTests(LibraryTestCase):
+    """
+    The `.values()` fast path must render exactly what the DRF serializers render.
+    """
+
+    def assertSameResponse(self, url, **params):
+        fast = self.client.get(url, params)
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_identical_output(self):
+        Borrow.objects.filter(book=self.book).update(returned=True)
+        Borrow.objects.get(book=self.book).save()
+        for name in ['books:book-list', 'books:borrow-list', 'books:reserve-list']:
+            self.assertSameResponse(reverse(name))
+            self.assertSameResponse(reverse(name), page_size=100)
+            self.assertSameResponse(reverse(name), cursor='', page_size=7)
+
+
+class PaginationTests(LibraryTestCase):
+
+    def walk(self, url, direction):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([item['id'] for item in response.json()['results']])
+            url = response.json()[direction]
+        return pages
+
+    def test_cursor_pages_forward_and_back(self):
+        # Ties on due_date are broken by id.
+        Borrow.objects.filter(id__lte=Borrow.objects.order_by('id')[14].id).update(due_date=timezone.now())
+        expected = list(Borrow.objects.order_by('due_date', 'id').values_list('id', flat=True))
+
+        pages = self.walk(replace_query_param(reverse('books:borrow-list'), 'page_size', 7) + '&cursor=', 'next')
+        self.assertEqual([len(page) for page in pages], [7, 7, 7, 7, 2])
+        self.assertEqual(sum(pages, []), expected)
+
+        last = self.client.get(reverse('books:borrow-list'), {'cursor': '', 'page_size': 7})
+        for _ in range(4):
+            last = self.client.get(last.json()['next'])
+        back = self.walk(last.json()['previous'], 'previous')
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_invalid_cursor(self):
+        forged = base64.urlsafe_b64encode(json.dumps({'v': [1], 'r': 0}).encode()).decode()
+        for cursor in ['garbage', forged]:
+            response = self.client.get(reverse('books:borrow-list'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_without_count(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('books:book-list'), {'count': 'false', 'page_size': 10, 'page': 2})
+        self.assertFalse(any('COUNT(' in query['sql'] for query in context.captured_queries))
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 10)
+        self.assertIn('page=3', data['next'])
+        self.assertNotIn('page=', data['previous'])
+        self.assertIsNone(self.client.get(reverse('books:book-list'),
+                                          {'count': 'false', 'page_size': 10, 'page': 3}).json()['next'])
+
+
+class SearchTests(TestCase):
+    """
+    Runs against the FTS5 table and the in-memory fallback alike.
+    """
+
+    def setUp(self):
+        self.author = Author.objects.create(name='Jeanette', surname='Winterson')
+        self.genre = Genre.objects.create(name='Winterfolk')
+        self.title_match = Book.objects.create(title='Winter garden', stock=1)
+        self.author_match = Book.objects.create(title='Stone', stock=1)
+        self.author_match.authors.add(self.author)
+        self.genre_match = Book.objects.create(title='Letters', stock=1)
+        self.genre_match.genres.add(self.genre)
+        self.addCleanup(setattr, python_index, 'postings', None)
+
+    def backends(self):
+        for name, fts5 in [('fts5', True), ('python', False)]:
+            with self.subTest(name), mock.patch.dict(search._fts5_supported, {'default': fts5}):
+                python_index.rebuild()
+                yield
+
+    def test_ranking(self):
+        for _ in self.backends():
+            self.assertEqual(search_books('winter'),
+                             [self.title_match.id, self.author_match.id, self.genre_match.id])
+            self.assertEqual(search_books('winter', limit=1), [self.title_match.id])
+
+    def test_every_word_is_a_prefix(self):
+        for _ in self.backends():
+            self.assertEqual(search_books('gar wint'), [self.title_match.id])
+            self.assertEqual(search_books('jeanette stone'), [self.author_match.id])
+            # Words match from their start only, not anywhere inside.
+            self.assertEqual(search_books('inter'), [])
+            self.assertEqual(search_books('!!'), [])
+
+    def test_reindex_after_rename(self):
+        for _ in self.backends():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.author.surname = 'Summers'
+                self.author.save()
+                self.genre.name = 'Poetry'
+                self.genre.save()
+            self.assertEqual(search_books('winter'), [self.title_match.id])
+            self.assertEqual(search_books('summers'), [self.author_match.id])
+            self.assertEqual(search_books('poetry'), [self.genre_match.id])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.author.surname = 'Winterson'
+                self.author.save()
+                self.genre.name = 'Winterfolk'
+                self.genre.save()
+
+    def test_support_check_is_memoized(self):
+        search.reset_search_backend()
+        self.assertTrue(FTS5SearchIndex.is_supported())
+        with self.assertNumQueries(0):
+            self.assertTrue(FTS5SearchIndex.is_supported())
+
+
+class SuggestTests(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name='Frank', surname='Herbert')
+        self.dune = Book.objects.create(title='Dune', stock=1)
+        self.messiah = Book.objects.create(title='Dune Messiah', stock=1)
+        self.messiah.authors.add(self.author)
+        today = timezone.localdate()
+        BorrowDailyStats.objects.create(book=self.dune, day=today, borrows=2)
+        BorrowDailyStats.objects.create(book=self.messiah, day=today, borrows=5)
+        suggest_index.entries = None
+        self.addCleanup(setattr, suggest_index, 'entries', None)
+
+    def labels(self, results):
+        return [result['label'] for result in results]
+
+    def test_ranked_by_popularity(self):
+        self.assertEqual(self.labels(suggest('du', 10)), ['Dune Messiah', 'Dune'])
+        self.assertEqual(self.labels(suggest('du', 1)), ['Dune Messiah'])
+        # Authors rank by the borrows of their books, and "her" completes the surname.
+        self.assertEqual(suggest('her', 10), [{'type': 'author', 'id': self.author.id, 'label': 'Frank Herbert'}])
+        self.assertEqual(suggest('mess', 10)[0]['id'], self.messiah.id)
+
+    def test_ranked_results_follow_updates(self):
+        with mock.patch.object(suggestions, 'RANKED_CACHE_THRESHOLD', 0):
+            self.assertEqual(self.labels(suggest('du', 10)), ['Dune Messiah', 'Dune'])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.messiah.title = 'Children of Dune'
+                self.messiah.save()
+            self.assertEqual(self.labels(suggest('du', 10)), ['Children of Dune', 'Dune'])
+            self.assertEqual(self.labels(suggest('chi', 10)), ['Children of Dune'])
+
+    def test_concurrent_first_requests_load_once(self):
+        index = PrefixIndex()
+        loads = []
+        started = threading.Barrier(4)
+
+        def labels():
+            loads.append(1)
+            time.sleep(0.05)
+            return [('book', 1, 'Dune')]
+
+        def lookup():
+            started.wait()
+            index.ensure_loaded(labels, dict)
+            self.assertEqual(self.labels(index.complete('du', 5)), ['Dune'])
+
+        threads = [threading.Thread(target=lookup) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+
+    def test_preloaded(self):
+        suggestions.preload_suggestions()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels(suggest('dune m', 10)), ['Dune Messiah'])
+
+
+class BatchCreateTests(LibraryTestCase):
+
+    def test_book_batch_create(self):
+        author, genre = Author.objects.first(), Genre.objects.first()
+        payload = [{'title': f'New {i}', 'authors': [author.id, author.id], 'genres': [genre.id], 'stock': 1}
+                   for i in range(50)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('books:book-create-batch'), payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertLess(len(context.captured_queries), 20)
+        book = Book.objects.get(title='New 49')
+        self.assertEqual(list(book.authors.all()), [author])
+        self.assertEqual(list(book.genres.all()), [genre])
+
+    def test_book_batch_create_rejects_unknown_ids(self):
+        payload = [{'title': 'Ok', 'authors': [], 'genres': []},
+                   {'title': 'Bad', 'authors': [999999], 'genres': []}]
+        response = self.client.post(reverse('books:book-create-batch'), payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [{}, {'authors': ['Invalid pk "999999" - object does not exist.']}])
+        self.assertFalse(Book.objects.filter(title='Ok').exists())
+
+    def test_author_batch_create(self):
+        response = self.client.post(reverse('books:author-create-batch'),
+                                    [{'name': 'Batch', 'surname': str(i)} for i in range(20)], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Author.objects.filter(name='Batch').count(), 20)
+
+
+class ExportTests(LibraryTestCase):
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    @override_settings(EXPORT_CHUNK_SIZE=7)
+    def test_ndjson_matches_list(self):
+        for export_name, list_name in [('books:borrow-export', 'books:borrow-list'),
+                                       ('books:reserve-export', 'books:reserve-list')]:
+            rows = [json.loads(line) for line in self.export(export_name).splitlines()]
+            self.assertEqual(rows, self.client.get(reverse(list_name), {'page_size': 100}).json()['results'])
+
+    def test_csv_honors_filters(self):
+        filters = json.dumps([{'field': 'book', 'sub_field': 'title', 'value': 'Book 1', 'condition': 'startswith'}])
+        rows = list(csv.DictReader(io.StringIO(self.export('books:borrow-export', export_format='csv', filters=filters))))
+        self.assertEqual(len(rows), 11)
+        self.assertTrue(all(row['book.title'].startswith('Book 1') for row in rows))
+        self.assertEqual(rows[0]['book.authors'], 'Author 0; Author 1')
+
+    def test_csv_rows_have_ids(self):
+        for name, model in [('books:borrow-export', Borrow), ('books:reserve-export', Reserve)]:
+            rows = csv.DictReader(io.StringIO(self.export(name, export_format='csv')))
+            self.assertEqual(sorted(int(row['id']) for row in rows), sorted(model.objects.values_list('id', flat=True)))
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('books:borrow-export'), {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FilterCompilerTests(LibraryTestCase):
+
+    def get(self, name, filters, **params):
+        return self.client.get(reverse(name), {'filters': json.dumps(filters), **params})
+
+    def test_applies_whitelisted_filters(self):
+        response = self.get('books:book-list', [{'field': 'id', 'condition': 'in', 'value': [self.book.pk]},
+                                                {'field': 'genres', 'sub_field': 'name', 'value': 'Genre 0'}])
+        self.assertEqual([book['id'] for book in response.json()['results']], [self.book.pk])
+
+    def test_rejects_unlisted_and_expensive_filters(self):
+        title = {'field': 'book', 'sub_field': 'title', 'condition': 'icontains', 'value': 'Book'}
+        for name, filters in [
+            ('books:book-list', [{'field': 'title', 'condition': 'regex', 'value': '^(a+)+$'}]),
+            ('books:borrow-list', [{'field': 'user', 'sub_field': 'password', 'condition': 'startswith', 'value': 'x'}]),
+            ('books:borrow-list', [{'field': 'book', 'sub_field': 'authors__books__title', 'value': 'Book 1'}]),
+            ('books:reserve-list', [title, {**title, 'value': 'Book 1'}, {**title, 'value': 'Book 2'}]),
+            ('books:borrow-list', [{'field': 'id', 'condition': 'in', 'value': {'a': 1}}]),
+        ]:
+            response = self.get(name, filters)
+            self.assertEqual(response.status_code, 400, filters)
+            self.assertIn('filters', response.json())
+        self.assertEqual(self.get('books:book-list', [], late='true').status_code, 400)
+
+    def test_equivalent_filters_share_compiled_form(self):
+        first = [{'field': 'title', 'condition': 'startswith', 'value': 'Book'}, {'field': 'stock', 'value': 3}]
+        second = [first[1], first[0], first[1]]
+        self.assertIs(BOOK_FILTERS.compile(json.dumps(first)), BOOK_FILTERS.compile(json.dumps(second)))
+        self.assertEqual(self.get('books:book-list', second).json()['count'], 30)
+
+
+class AdviseIndexesTests(TestCase):
+
+    def advise(self, entries):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', encoding='utf-8', delete=False) as f:
+            f.write('not json\n')
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        self.addCleanup(os.unlink, f.name)
+        output = io.StringIO()
+        call_command('advise_indexes', log=f.name, stdout=output)
+        return output.getvalue()
+
+    def test_reports_unindexed_filters(self):
+        stock = {'view': 'BookListAPIView', 'filters': [{'field': 'stock', 'condition': 'gte', 'value': 1}]}
+        by_id = {'view': 'BookListAPIView', 'filters': [{'field': 'id', 'condition': 'gte', 'value': 1}]}
+        output = self.advise([stock, {**stock, 'filters': [{**stock['filters'][0], 'value': 5}]}, by_id])
+
+        self.assertIn("FULL SCAN BookListAPIView x2 filters=[('stock', '', 'gte')]", output)
+        self.assertIn('SCAN books_book', output)
+        self.assertNotIn("('id', '', 'gte')", output)
+        self.assertIn('1 of 2 filter shapes scan whole tables', output)
+
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reset_route_stats()
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('books:book-list'))
+        metrics = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertIn('queries', metrics['db'])
+        self.assertIn('serialize', metrics)
+        self.assertIn('total', metrics)
+
+    def test_slow_request_log(self):
+        with override_settings(SLOW_REQUEST_MS=0), self.assertLogs('books.slow_requests', 'INFO') as logs:
+            self.client.get(reverse('books:borrow-list'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['route'], entry['status']), ('api/borrows/', 200))
+        self.assertGreater(entry['queries'], 0)
+        self.assertTrue(entry['slowest'][0]['sql'])
+
+    def test_route_stats(self):
+        for _ in range(3):
+            self.client.get(reverse('books:book-list'))
+        self.assertEqual(self.client.get(reverse('books:profiling-stats')).status_code, 403)
+
+        system_user = CustomUser.objects.create_user(
+            email='system@mail.com', password='password', first_name='Sys', last_name='Tem',
+            personal_number='00000000009', birth_date='1990-01-01', user_type=UserTypeChoices.SYSTEMS,
+        )
+        self.client.force_authenticate(system_user)
+        routes = self.client.get(reverse('books:profiling-stats')).json()['routes']
+        books = next(route for route in routes if route['route'] == 'api/books/')
+        self.assertEqual((books['method'], books['count']), ('GET', 3))
+        self.assertLessEqual(books['total_ms']['p50'], books['total_ms']['max'])
+
+    async def test_async_chain_stays_async(self):
+        async def view(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(ProfilingMiddleware(view)))
+        token = str(RefreshToken.for_user(self.user).access_token)
+        response = await AsyncClient().get(reverse('books:async-book-list'),
+                                           headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+
+    def test_disabled(self):
+        with override_settings(PROFILING_ENABLED=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('books:book-list')))
+
+
+@override_settings(PROFILING_ENABLED=True)
+class BenchmarkSuiteTests(TestCase):
+
+    def test_seed_and_run_every_api_scenario(self):
+        LibrarySeeder(seed=1, chunk_size=40).seed(books=60, authors=5, genres=3, users=10, borrows=100, reserves=30)
+        self.assertEqual((Book.objects.count(), Borrow.objects.count(), Reserve.objects.count()), (60, 100, 30))
+        self.assertEqual(sum(Book.objects.values_list('active_borrows', flat=True)),
+                         Borrow.objects.filter(returned=False).count())
+
+        fixture = Fixture(random.Random(1))
+        names = {scenario.name for scenario in SCENARIOS if not scenario.session}
+        with self.assertLogs('django.request', 'WARNING'):
+            results = run_suite(ClientDriver(fixture), fixture, rounds=2, warmup=0, names=names)
+        self.assertEqual({result['name'] for result in results}, names)
+        for result in results:
+            self.assertTrue(all(status < 500 for status in result['statuses']), result)
+            self.assertIsNotNone(result['queries'], result['name'])
+
+    def test_summarize(self):
+        self.assertEqual(summarize(range(1, 101)), {'mean': 50.5, 'p50': 51, 'p95': 96, 'p99': 100, 'max': 100})
+        self.assertEqual(summarize([3, 1, 2], (0.9,)), {'mean': 2, 'p90': 3, 'max': 3})
+
+
+class SeedLibraryTests(TestCase):
+
+    def test_seeded_library_is_consistent(self):
+        call_command('seed_library', books=50, authors=5, genres=3, users=20, borrows=400, reserves=150,
+                     days=30, late_rate=0.3, seed=7, chunk_size=64, stdout=io.StringIO())
+        self.assertEqual((Book.objects.count(), Borrow.objects.count(), Reserve.objects.count()), (50, 400, 150))
+
+        active = list(Borrow.objects.filter(returned=False).values_list('user_id', 'book_id'))
+        self.assertEqual(len(active), len(set(active)))
+        open_reserves = list(Reserve.objects.filter(status=True).values_list('user_id', 'book_id'))
+        self.assertEqual(len(open_reserves), len(set(open_reserves)))
+        self.assertTrue(Reserve.objects.filter(status=True).exists())
+        for book in Book.objects.all():
+            self.assertLessEqual(book.active_borrows + book.active_reserves, book.stock)
+        self.assertTrue(Borrow.objects.filter(returned_at__gt=F('due_date')).exists())
+        self.assertFalse(Borrow.objects.filter(borrowed_at__gt=timezone.now()).exists())
+
+    def test_same_seed_same_rows(self):
+        def loans():
+            # Ids and reader emails move with the sequences, titles and outcomes must not.
+            return list(Borrow.objects.order_by('id').values_list('book__title', 'returned'))
+
+        LibrarySeeder(seed=3).seed(books=20, authors=3, genres=2, users=5, borrows=60, reserves=0)
+        first = loans()
+        Borrow.objects.all().delete()
+        Book.objects.all().delete()
+        CustomUser.objects.all().delete()
+        LibrarySeeder(seed=3).seed(books=20, authors=3, genres=2, users=5, borrows=60, reserves=0)
+        self.assertEqual(loans(), first)
+
+    def test_loans_need_readers(self):
+        with self.assertRaises(CommandError):
+            call_command('seed_library', books=5, users=0, borrows=10, stdout=io.StringIO())
+
+
+class ImportCatalogTests(TestCase):
+
+    def import_file(self, content, suffix='.ndjson', **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+        output = io.StringIO()
+        call_command('import_catalog', f.name, stdout=output, stderr=io.StringIO(), **options)
+        return output.getvalue()
+
+    def test_dedup_across_chunks(self):
+        Author.objects.create(name='Ursula', surname='Le Guin')
+        rows = [
+            {'title': 'The Dispossessed', 'authors': ['Le Guin, Ursula'], 'genres': ['Fiction'], 'stock': 2},
+            {'title': 'Lathe of Heaven', 'authors': [{'name': 'Ursula', 'surname': 'Le Guin'}],
+             'genres': ['Fiction', 'Classics']},
+            {'title': 'Dune', 'authors': ['Frank Herbert'], 'genres': ['Classics']},
+            {'title': 'The Dispossessed', 'authors': ['Le Guin, Ursula'], 'genres': ['Fiction']},
+            {'title': 'Dune', 'release_date': '1965-08-01', 'authors': ['Frank Herbert']},
+        ]
+        output = self.import_file(''.join(json.dumps(row) + '\n' for row in rows), chunk_size=2)
+        self.assertIn('Imported 4 books (0 skipped, 1 duplicates), created 1 authors and 2 genres', output)
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(sorted(Genre.objects.values_list('name', flat=True)), ['Classics', 'Fiction'])
+        self.assertEqual(Book.objects.filter(title='The Dispossessed').count(), 1)
+        self.assertEqual(Book.objects.filter(title='Dune').count(), 2)
+        self.assertEqual(Book.objects.get(title='Lathe of Heaven').authors.get().surname, 'Le Guin')
+
+        # A second run finds every book in the catalog.
+        output = self.import_file(''.join(json.dumps(row) + '\n' for row in rows), chunk_size=2)
+        self.assertIn('Imported 0 books (0 skipped, 5 duplicates), created 0 authors and 0 genres', output)
+        self.assertEqual(Book.objects.count(), 4)
+
+    def test_author_names(self):
+        self.import_file(
+            'title,authors,stock\n'
+            'Solitude,"García Márquez, Gabriel; Ursula K. Le Guin",1\n'
+            'Republic,Plato,1\n',
+            suffix='.csv',
+        )
+        self.assertEqual(
+            sorted(Author.objects.values_list('name', 'surname')),
+            [('Gabriel', 'García Márquez'), ('Plato', None), ('Ursula K. Le', 'Guin')],
+        )
+
+    def test_strict_aborts_on_bad_row(self):
+        content = '{"title": "Dune"}\n{"title": "Emma", "stock": -1}\nnot json\n'
+        with self.assertRaisesMessage(CommandError, 'line 2: negative stock'):
+            self.import_file(content, strict=True, chunk_size=1)
+        # Chunks before the bad row stay committed.
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['Dune'])
+
+        Book.objects.all().delete()
+        output = self.import_file(content)
+        self.assertIn('Imported 1 books (2 skipped, 0 duplicates)', output)
+
+
+class StatisticsCacheTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        statistics_cache.invalidate()
+        self.url = reverse('books:top-books-borrows')
+
+    def test_hit_and_miss(self):
+        before = statistics_cache.stats()
+        first = self.client.get(self.url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.client.get(self.url, {'page': 2})['X-Cache'], 'MISS')
+        stats = statistics_cache.stats()
+        self.assertEqual((stats['hits'] - before['hits'], stats['misses'] - before['misses']), (1, 2))
+
+    @override_settings(ALLOWED_HOSTS=['a.example', 'b.example'])
+    def test_keyed_by_host(self):
+        first = self.client.get(self.url, HTTP_HOST='a.example')
+        self.assertTrue(first.json()['next'].startswith('http://a.example/'))
+        second = self.client.get(self.url, HTTP_HOST='b.example')
+        self.assertEqual(second['X-Cache'], 'MISS')
+        self.assertTrue(second.json()['next'].startswith('http://b.example/'))
+        self.assertEqual(self.client.get(self.url, HTTP_HOST='a.example')['X-Cache'], 'HIT')
+
+    def test_rollups_invalidate(self):
+        self.client.get(self.url)
+        generation = statistics_cache.generation()
+        borrow = Borrow.objects.filter(user=self.user).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            borrow.returned = True
+            borrow.save()
+        # The views read the rollups only, a borrow changes nothing they show.
+        self.assertEqual(statistics_cache.generation(), generation)
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rollup_statistics', stdout=io.StringIO())
+        self.assertNotEqual(statistics_cache.generation(), generation)
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+
+class StatisticsRollupTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        statistics_cache.invalidate()
+        self.students = [CustomUser.objects.create_user(
+            email=f'reader{i}@mail.com', password='password', first_name='Rea', last_name='Der',
+            personal_number=f'2000000000{i}', birth_date='1995-01-01', user_type=UserTypeChoices.STUDENT,
+        ) for i in range(2)]
+
+    def history(self, book, user, days_ago, late):
+        borrow = Borrow.objects.create(user=user, book=book)
+        borrow.returned = True
+        borrow.save()
+        borrowed_at = timezone.now() - timedelta(days=days_ago, hours=3)
+        Borrow.objects.filter(pk=borrow.pk).update(
+            borrowed_at=borrowed_at, due_date=borrowed_at + timedelta(hours=1),
+            returned_at=borrowed_at + timedelta(hours=2 if late else 0.5),
+        )
+
+    def ranking(self, name):
+        return [(row['id'], row['borrows_count'])
+                for row in self.client.get(reverse(name), {'page_size': 100}).json()['results']]
+
+    def test_rollups_match_raw_data(self):
+        books = list(Book.objects.order_by('id')[:6])
+        for i, book in enumerate(books):
+            for n in range(i):
+                self.history(book, self.students[n % 2], days_ago=n + 1, late=n % 2 == 0)
+        call_command('rollup_statistics', stdout=io.StringIO())
+        # The second run re-aggregates the last, possibly partial, day instead of adding to it.
+        self.history(books[0], self.students[1], days_ago=0, late=True)
+        Borrow.objects.create(user=self.students[0], book=books[1])
+        call_command('rollup_statistics', stdout=io.StringIO())
+
+        late = Q(returned_at__gt=F('due_date'))
+        top_books = Book.objects.annotate(total=Count('borrows')).order_by('-total', 'id')
+        self.assertEqual(self.ranking('books:top-books'), list(top_books.values_list('id', 'total')[:10]))
+        late_books = Book.objects.annotate(total=Count('borrows', filter=Q(borrows__in=Borrow.objects.filter(late))))
+        self.assertEqual(self.ranking('books:late-returns'),
+                         list(late_books.order_by('-total', 'id').values_list('id', 'total')[:100]))
+        late_users = CustomUser.objects.annotate(
+            total=Count('borrows', filter=Q(borrows__in=Borrow.objects.filter(late))))
+        self.assertEqual(self.ranking('books:top-worst-users'),
+                         list(late_users.order_by('-total', 'id').values_list('id', 'total')[:100]))
+        self.assertEqual(dict(self.ranking('books:top-worst-users'))[self.students[0].pk], 9)
+
+
+class DueNotificationTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        system_user = CustomUser.objects.create_user(
+            email='system@mail.com', password='password', first_name='Sys', last_name='Tem',
+            personal_number='00000000002', birth_date='1990-01-01', user_type=UserTypeChoices.SYSTEMS,
+        )
+        self.client.force_authenticate(system_user)
+
+    def due_items(self, name):
+        return self.client.get(reverse(name), {'start_time': '2000-01-01T00:00:00+00:00',
+                                               'end_time': '2100-01-01T00:00:00+00:00'}).json()
+
+    def test_borrow_batch(self):
+        items = self.due_items('books:borrow-due')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('books:borrow-due'), items + [{'user_email': 'bad'}], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['queued'], 30)
+        self.assertEqual(response.json()['results'][-1]['status'], 'invalid')
+        self.assertLess(len(context.captured_queries), 8)
+        self.assertEqual(len(mail.outbox), 0)
+
+        response = self.client.post(reverse('books:borrow-due'), items, format='json')
+        self.assertEqual(response.json()['duplicates'], 30)
+
+        call_command('run_mail_worker', once=True, concurrency=3, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 30)
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailStatusChoices.SENT).count(), 30)
+
+    def test_reserve_batch_closes_reservations(self):
+        items = self.due_items('books:reserve-due')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('books:reserve-due'), items, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertLess(len(context.captured_queries), 12)
+        self.assertEqual(EmailOutbox.objects.count(), 30)
+        self.assertFalse(Reserve.objects.filter(status=True).exists())
+        self.assertFalse(Book.objects.filter(active_reserves__gt=0).exists())
+
+    def test_reserve_notice_needs_an_open_reservation(self):
+        items = self.due_items('books:reserve-due')[:3]
+        Reserve.close([items[0]['id']])
+        Reserve.objects.filter(id=items[1]['id']).delete()
+        response = self.client.post(reverse('books:reserve-due'), items, format='json')
+        self.assertEqual(response.status_code, 207, response.content)
+        self.assertEqual((response.json()['queued'], response.json()['skipped']), (1, 2))
+        self.assertEqual([result['status'] for result in response.json()['results']], ['skipped', 'skipped', 'queued'])
+        self.assertEqual(list(EmailOutbox.objects.values_list('dedup_key', flat=True)),
+                         [f"reserve-due:{items[2]['id']}"])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected('connection refused')
+
+
+class MailWorkerTests(TestCase):
+
+    def setUp(self):
+        enqueue([('Subject', 'Body', 'library@mail.com', [f'user{i}@mail.com']) for i in range(5)],
+                [f'test:{i}' for i in range(5)])
+
+    @override_settings(EMAIL_BACKEND='books.tests.FailingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_retry_with_backoff(self):
+        call_command('run_mail_worker', once=True, stdout=io.StringIO())
+        email = EmailOutbox.objects.first()
+        self.assertEqual((email.status, email.attempts), (EmailStatusChoices.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(email.last_error, 'connection refused')
+
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        call_command('run_mail_worker', once=True, stdout=io.StringIO())
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailStatusChoices.FAILED, attempts=2).count(), 5)
+
+    def test_enqueue_reports_duplicates(self):
+        message = ('Subject', 'Body', 'library@mail.com', ['late@mail.com'])
+        bulk_create = EmailOutbox.objects.bulk_create
+
+        def lose_race(emails, **kwargs):
+            # A concurrent enqueue commits test:race between the dedup check and the insert.
+            EmailOutbox.objects.create(subject='Other', body='', from_email='', to=[], dedup_key='test:race')
+            return bulk_create(emails, **kwargs)
+
+        with mock.patch.object(EmailOutbox.objects, 'bulk_create', side_effect=lose_race):
+            queued = enqueue([message] * 4, ['test:0', 'test:race', 'test:new', None])
+        self.assertEqual(queued, [False, False, True, True])
+        self.assertEqual(enqueue([message] * 2, ['test:more', 'test:more']), [True, False])
+        self.assertEqual(EmailOutbox.objects.get(dedup_key='test:race').subject, 'Other')
+
+    def test_metrics(self):
+        self.assertEqual(queue_metrics()['due'], 5)
+        call_command('run_mail_worker', once=True, stdout=io.StringIO())
+        self.assertEqual(queue_metrics()['sent'], 5)
+        self.assertEqual(queue_metrics()['pending'], 0)
+
+
+class ChangeFeedTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(CustomUser.objects.create_user(
+            email='system@mail.com', password='password', first_name='Sys', last_name='Tem',
+            personal_number='00000000002', birth_date='1990-01-01', user_type=UserTypeChoices.SYSTEMS,
+        ))
+
+    def drain(self, url):
+        results = []
+        url = replace_query_param(url, 'limit', 12)
+        while True:
+            data = self.client.get(url).json()
+            results += data['results']
+            url = data['next']
+            if not data['has_more']:
+                return results, url
+
+    def test_borrow_feed(self):
+        Borrow.objects.filter(book=self.book).update(returned=True)
+        snapshot, url = self.drain(reverse('books:borrow-changes'))
+        self.assertEqual(len([item for item in snapshot if not item['returned']]), 29)
+        self.assertEqual(self.drain(url)[0], [])
+
+        borrow = Borrow.objects.order_by('id').first()
+        with CaptureQueriesContext(connection) as context:
+            borrow.returned = True
+            borrow.save()
+            Borrow.objects.create(user=self.user, book=self.book)
+        # Writers leave the numbering to the feed and never lock the sequence row.
+        self.assertFalse([query for query in context.captured_queries if 'changesequence' in query['sql']])
+        with CaptureQueriesContext(connection) as context:
+            changes, url = self.drain(url)
+        self.assertEqual([(item['id'], item['returned']) for item in changes],
+                         [(borrow.id, True), (Borrow.objects.latest('id').id, False)])
+        queries = len(context.captured_queries)
+
+        # Numbering the pending rows and reading the page cost the same for any number of changes.
+        borrows = list(Borrow.objects.filter(returned=False)[:10])
+        for item in borrows:
+            item.returned = True
+            item.save()
+        with CaptureQueriesContext(connection) as context:
+            changes, url = self.drain(url)
+        self.assertEqual(len(changes), 10)
+        self.assertEqual(len(context.captured_queries), queries)
+
+    def test_reserve_feed_sees_bulk_close(self):
+        _, url = self.drain(reverse('books:reserve-changes'))
+        closed = Reserve.close(list(Reserve.objects.values_list('id', flat=True)[:5]))
+        changes, _ = self.drain(url)
+        self.assertEqual(sorted(item['id'] for item in changes), sorted(closed))
+        self.assertFalse(any(item['status'] for item in changes))
+
+    def test_empty_first_poll_has_a_cursor(self):
+        Reserve.close(list(Reserve.objects.values_list('id', flat=True)))
+        snapshot, url = self.drain(reverse('books:reserve-changes'))
+        self.assertEqual(snapshot, [])
+        self.assertIn('cursor=', url)
+        self.assertEqual(self.drain(url)[0], [])
+
+        # Opened and closed between two polls: only a cursor sees it at all.
+        reserve = Reserve.objects.create(user=self.user, book=Book.objects.create(title='New', stock=1))
+        Reserve.close([reserve.id])
+        changes, _ = self.drain(url)
+        self.assertEqual([(item['id'], item['status']) for item in changes], [(reserve.id, False)])
+
+
+class ExpireReservesTests(LibraryTestCase):
+
+    def test_expire_reserves(self):
+        overdue = list(Reserve.objects.order_by('id').values_list('id', flat=True)[:10])
+        Reserve.objects.filter(id__in=overdue).update(due_date=timezone.now() - timedelta(hours=1))
+        with CaptureQueriesContext(connection) as context:
+            call_command('expire_reserves', batch_size=4, stdout=io.StringIO())
+        self.assertLess(len(context.captured_queries), 40)
+        self.assertEqual(set(Reserve.objects.filter(status=False).values_list('id', flat=True)), set(overdue))
+        self.assertEqual(Book.objects.filter(active_reserves=0).count(), 10)
+        self.assertEqual(EmailOutbox.objects.count(), 10)
+
+        call_command('expire_reserves', stdout=io.StringIO())
+        self.assertEqual(EmailOutbox.objects.count(), 10)
+
+
+class AsyncViewTests(LibraryTestCase):
+
+    def setUp(self):
+        self.client = AsyncClient()
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    async def get(self, name, **params):
+        return await self.client.get(reverse(name), params, headers={'Authorization': f'Bearer {self.token}'})
+
+    async def test_book_list_matches_sync(self):
+        filters = json.dumps([{'field': 'title', 'value': 'Book 1', 'condition': 'startswith'}])
+        for params in [{}, {'page': 2, 'page_size': 7}, {'filters': filters}]:
+            response = await self.get('books:async-book-list', **params)
+            self.assertEqual(response.status_code, 200, response.content)
+            expected = await self.client.get(reverse('books:book-list'), params,
+                                             headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual(response.content.replace(b'/api/async/books/', b'/api/books/'), expected.content)
+
+    async def test_search(self):
+        response = await self.get('books:async-book-search', query='book 2')
+        self.assertIn('Book 2', response.json()['results'])
+
+    async def test_permissions(self):
+        self.assertEqual((await self.client.get(reverse('books:async-book-list'))).status_code, 401)
+        self.assertEqual((await self.get('books:async-borrow-due')).status_code, 403)
+        self.token = 'invalid'
+        self.assertEqual((await self.get('books:async-book-list')).status_code, 401)
+
+
+class StockAllocationTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.students = [CustomUser.objects.create_user(
+            email=f'student{i}@mail.com', password='password', first_name='Stu', last_name='Dent',
+            personal_number=f'1000000000{i}', birth_date='1995-01-01', user_type=UserTypeChoices.STUDENT,
+        ) for i in range(3)]
+        self.last_copy = Book.objects.create(title='Last copy', stock=1)
+
+    def create(self, name, student, book=None):
+        return self.client.post(reverse(name), {'user': student.pk, 'book': (book or self.last_copy).pk})
+
+    def test_last_copy_goes_once(self):
+        self.assertEqual(self.create('books:borrow-create', self.students[0]).status_code, 201)
+        self.assertEqual(self.create('books:borrow-create', self.students[1]).status_code, 409)
+        self.assertEqual(self.create('books:reserve-create', self.students[1]).status_code, 409)
+        self.last_copy.refresh_from_db()
+        self.assertEqual((self.last_copy.active_borrows, self.last_copy.active_reserves), (1, 0))
+
+        borrow = Borrow.objects.get(book=self.last_copy)
+        borrow.returned = True
+        borrow.save()
+        self.assertEqual(self.create('books:borrow-create', self.students[1]).status_code, 201)
+
+    def test_duplicates_are_rejected(self):
+        book = Book.objects.create(title='Plenty', stock=10)
+        self.assertEqual(self.create('books:borrow-create', self.students[0], book).status_code, 201)
+        response = self.create('books:borrow-create', self.students[0], book)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'There is already an active borrow on this book.'})
+        self.assertEqual(self.create('books:reserve-create', self.students[0], book).status_code, 201)
+        self.assertEqual(self.create('books:reserve-create', self.students[0], book).status_code, 400)
+        book.refresh_from_db()
+        self.assertEqual((book.active_borrows, book.active_reserves), (1, 1))
+
+        # Whatever slips past the views is stopped by the constraint.
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Borrow.objects.create(user=self.students[0], book=book)
+
+    def test_borrow_takes_own_reserved_copy(self):
+        self.assertEqual(self.create('books:reserve-create', self.students[0]).status_code, 201)
+        self.assertEqual(self.create('books:borrow-create', self.students[1]).status_code, 409)
+        self.assertEqual(self.create('books:borrow-create', self.students[0]).status_code, 201)
+        self.assertFalse(Reserve.objects.get(book=self.last_copy).status)
+        self.last_copy.refresh_from_db()
+        self.assertEqual((self.last_copy.active_borrows, self.last_copy.active_reserves), (1, 0))
+
+    def test_reopening_takes_a_copy(self):
+        self.assertEqual(self.create('books:borrow-create', self.students[0]).status_code, 201)
+        borrow = Borrow.objects.get(book=self.last_copy)
+        self.client.patch(reverse('books:borrow-detail', args=[borrow.pk]), {'returned': True})
+        self.assertEqual(self.create('books:borrow-create', self.students[1]).status_code, 201)
+
+        response = self.client.patch(reverse('books:borrow-detail', args=[borrow.pk]), {'returned': False})
+        self.assertEqual(response.status_code, 409)
+        borrow.refresh_from_db()
+        self.assertTrue(borrow.returned)
+
+        book = Book.objects.create(title='Plenty', stock=10)
+        self.assertEqual(self.create('books:reserve-create', self.students[0], book).status_code, 201)
+        reserve = Reserve.objects.get(book=book)
+        self.client.patch(reverse('books:reserve-detail', args=[reserve.pk]), {'status': False})
+        self.assertEqual(self.create('books:reserve-create', self.students[0], book).status_code, 201)
+        response = self.client.patch(reverse('books:reserve-detail', args=[reserve.pk]), {'status': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'There is already an active reservation on this book.'})
+        book.refresh_from_db()
+        self.assertEqual(book.active_reserves, 1)
+
+    def test_admin_form_reports_refusals(self):
+        Borrow.objects.create(user=self.students[0], book=self.last_copy)
+        data = {'user': self.students[1].pk, 'book': self.last_copy.pk, 'due_date': '2100-01-01 00:00:00'}
+        form = BorrowAdminForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('book', form.errors)
+
+        self.last_copy.stock = 5
+        self.last_copy.save()
+        form = BorrowAdminForm({**data, 'user': self.students[0].pk})
+        self.assertFalse(form.is_valid())
+        self.assertTrue(BorrowAdminForm(data).is_valid())
+
+    def test_stale_availability_does_not_overbook(self):
+        # Both requests saw a free copy before either wrote.
+        self.assertTrue(self.last_copy.available_to_borrow)
+        Borrow.objects.create(user=self.students[0], book=self.last_copy)
+        with self.assertRaises(OutOfStock):
+            Borrow.objects.create(user=self.students[1], book=self.last_copy)
+        self.assertEqual(Borrow.objects.filter(book=self.last_copy).count(), 1)
+
+
+class DatabaseConfigTests(TestCase):
+
+    def config(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return database_config(Path('/srv/library'))
+
+    def test_sqlite_default(self):
+        database = self.config()
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['NAME'], str(Path('/srv/library') / 'db.sqlite3'))
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+
+    def test_postgresql_behind_pgbouncer(self):
+        database = self.config(DB_ENGINE='postgresql', DB_HOST='db', DB_POOL='pgbouncer', DB_CONN_MAX_AGE='none')
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertIsNone(database['CONN_MAX_AGE'])
+        self.assertTrue(database['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_invalid_engine(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.config(DB_ENGINE='oracle')
+
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    def journal_mode(self, **overrides):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        scratch = connection.copy()
+        scratch.settings_dict = {**connection.settings_dict, 'NAME': os.path.join(directory.name, 'scratch.sqlite3')}
+        try:
+            with override_settings(**overrides), scratch.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                return cursor.fetchone()[0]
+        finally:
+            scratch.close()
+
+    def test_journal_mode_left_alone_by_default(self):
+        self.assertEqual(self.journal_mode(SQLITE_JOURNAL_MODE=''), 'delete')
+
+    def test_journal_mode_setting(self):
+        self.assertEqual(self.journal_mode(SQLITE_JOURNAL_MODE='wal'), 'wal')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    The replica is a second SQLite database, brought up to date with the
+    SQLite backup API whenever the test calls `replicate()`.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings['replica'] = {**connections.settings['default'],
+                                           'NAME': os.path.join(directory.name, 'replica.sqlite3')}
+        self.addCleanup(connections.settings.pop, 'replica')
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.addCleanup(lambda: connections['replica'].close())
+        cache.clear()
+
+        self.user = CustomUser.objects.create_user(
+            email='librarian@mail.com', password='password', first_name='Libra', last_name='Rian',
+            personal_number='00000000001', birth_date='1990-01-01', user_type=UserTypeChoices.LIBRARIAN,
+        )
+        self.student = CustomUser.objects.create_user(
+            email='student@mail.com', password='password', first_name='Stu', last_name='Dent',
+            personal_number='00000000002', birth_date='1995-01-01', user_type=UserTypeChoices.STUDENT,
+        )
+        self.book = Book.objects.create(title='Replicated', stock=3)
+        self.replicate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def replicate(self):
+        for alias in ['default', 'replica']:
+            connections[alias].ensure_connection()
+        connections['default'].connection.backup(connections['replica'].connection)
+
+    def test_lists_read_from_replica(self):
+        Book.objects.create(title='Not replicated yet', stock=1)
+        with CaptureQueriesContext(connections['default']) as primary:
+            response = self.client.get(reverse('books:book-list'))
+            self.assertEqual(self.client.get(reverse('books:top-books')).status_code, 200)
+        self.assertEqual([book['title'] for book in response.json()['results']], ['Replicated'])
+        self.assertEqual(len(primary), 0)
+
+        self.replicate()
+        self.assertEqual(self.client.get(reverse('books:book-list')).json()['count'], 2)
+
+    def test_own_borrow_is_read_from_primary(self):
+        response = self.client.post(reverse('books:borrow-create'), {'user': self.student.pk, 'book': self.book.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Borrow.objects.using('replica').count(), 0)
+        self.assertEqual(self.client.get(reverse('books:borrow-list')).json()['count'], 1)
+
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('books:borrow-list')).json()['count'], 0)
+
+    def test_pins_need_a_shared_cache(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'REPLICA_PIN_CACHE'):
+            check_pin_cache()
+        shared = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}
+        with override_settings(CACHES={**settings.CACHES, 'pins': shared}, REPLICA_PIN_CACHE='pins'):
+            check_pin_cache()
+        with override_settings(DATABASE_REPLICAS=[]):
+            check_pin_cache()
+
+
+class PipelineTests(SimpleTestCase):
+    """
+    The microservices.py notice pipeline, without the API: items are pushed
+    the way the change feed delivers them.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            with mock.patch.dict(os.environ, {'SYSTEM_PASSWORD': 'test'}):
+                cls.microservices = importlib.import_module('microservices')
+        except ImportError as e:
+            raise unittest.SkipTest(f'microservices.py needs {e.name}')
+        super().setUpClass()
+
+    def setUp(self):
+        self.pipeline = self.microservices.Pipeline('borrow', tokens=None)
+
+    def item(self, pk, minutes, returned=False):
+        due_date = timezone.now() + timedelta(minutes=minutes)
+        return {'id': pk, 'due_date': due_date.isoformat(), 'returned': returned}
+
+    def pushed(self, *items):
+        for item in items:
+            self.pipeline.push(item)
+        return [item['id'] for item in self.pipeline.pop_due()]
+
+    def test_pops_due_items_in_due_date_order(self):
+        self.assertEqual(self.pushed(self.item(1, -1), self.item(2, 10), self.item(3, -3), self.item(4, 5)), [3, 1])
+        self.assertEqual(self.pushed(), [])
+        self.assertEqual(sorted(self.pipeline.items), [2, 4])
+
+    def test_change_supersedes_earlier_entry(self):
+        self.assertEqual(self.pushed(self.item(1, 10), self.item(1, -1)), [1])
+        self.assertEqual(self.pushed(self.item(2, -5), self.item(2, 10)), [])
+        self.assertEqual(list(self.pipeline.items), [2])
+
+    def test_inactive_item_is_removed(self):
+        self.assertEqual(self.pushed(self.item(1, -1), self.item(1, -1, returned=True)), [])
+        self.assertEqual(self.pipeline.items, {})
+
+    def test_dispatcher_sends_batches(self):
+        batch_size = self.microservices.BATCH_SIZE
+        items = [self.item(pk, -1) for pk in range(2 * batch_size + 1)]
+        batches = []
+
+        async def send(batch):
+            batches.append([item['id'] for item in batch])
+
+        async def dispatch():
+            for item in items:
+                self.pipeline.push(item)
+            dispatcher = asyncio.create_task(self.pipeline.run_dispatcher())
+            while self.pipeline.heap or self.pipeline.sending:
+                await asyncio.sleep(0)
+            dispatcher.cancel()
+
+        with mock.patch.object(self.pipeline, 'send', send):
+            asyncio.run(dispatch())
+        self.assertEqual([len(batch) for batch in batches], [batch_size, batch_size, 1])
+        self.assertEqual(sum(batches, []), [item['id'] for item in items])
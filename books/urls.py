@@ -15,6 +15,8 @@ from books.views.normal_views import (
 )
 from books.views.api_views import (
     BookListAPIView,
+    BookSearchView as BookSearchAPIView,
+    BookSuggestView,
     AuthorDetailAPIView,
     AuthorListAPIView,
     GenreDetailAPIView,
@@ -23,7 +25,9 @@ from books.views.api_views import (
     ReserveDetailView,
     BorrowDetailView,
     BorrowListAPIView,
+    BorrowExportAPIView,
     ReserveListAPIView,
+    ReserveExportAPIView,
     AuthorCreateView,
     GenreCreateView,
     BookCreateView,
@@ -37,8 +41,12 @@ from books.views.api_views import (
     StatisticsBookBorrowsListAPIView,
     StatisticsBookBorrowsLateBooksListAPIView,
     StatisticsBookBorrowsLateUsersListAPIView,
+    StatisticsCacheView,
+    ProfilingStatsView,
     BorrowDueView, ReserveDueView,
+    BorrowChangesView, ReserveChangesView,
 )
+from books.views.async_views import AsyncBookListView, AsyncBookSearchView, AsyncBorrowDueView
 
 app_name = 'books'
 
@@ -55,10 +63,14 @@ urlpatterns = [
     path('reserve', FilteredReservedBooksView.as_view(), name='reserve'),
 
     path('api/books/', BookListAPIView.as_view(), name='book-list'),
+    path('api/books/suggest/', BookSuggestView.as_view(), name='book-suggest'),
+    path('api/books/search/', BookSearchAPIView.as_view(), name='book-search'),
     path('api/authors/', AuthorListAPIView.as_view(), name='author-list'),
     path('api/genres/', GenreListAPIView.as_view(), name='genre-list'),
     path('api/borrows/', BorrowListAPIView.as_view(), name='borrow-list'),
     path('api/reserves/', ReserveListAPIView.as_view(), name='reserve-list'),
+    path('api/borrows/export', BorrowExportAPIView.as_view(), name='borrow-export'),
+    path('api/reserves/export', ReserveExportAPIView.as_view(), name='reserve-export'),
 
     path('api/books/<int:pk>/', BookDetailsAPIView.as_view(), name='book-detail'),
     path('api/authors/<int:pk>/', AuthorDetailAPIView.as_view(), name='author-detail'),
@@ -80,7 +92,15 @@ urlpatterns = [
     path('api/statistics/top-worst-users/', StatisticsBookBorrowsLateUsersListAPIView.as_view(), name='top-worst-users'),
     path('api/statistics/books_borrows/', StatisticsBookBorrowsListAPIView.as_view(), name='top-books-borrows'),
     path('api/statistics/late_returns', StatisticsBookBorrowsLateBooksListAPIView.as_view(), name='late-returns'),
+    path('api/statistics/cache/', StatisticsCacheView.as_view(), name='statistics-cache'),
+    path('api/statistics/profiling/', ProfilingStatsView.as_view(), name='profiling-stats'),
 
     path('api/borrow_due', BorrowDueView.as_view(), name='borrow-due'),
     path('api/reserve_due', ReserveDueView.as_view(), name='reserve-due'),
+    path('api/borrow_due/changes', BorrowChangesView.as_view(), name='borrow-changes'),
+    path('api/reserve_due/changes', ReserveChangesView.as_view(), name='reserve-changes'),
+
+    path('api/async/books/', AsyncBookListView.as_view(), name='async-book-list'),
+    path('api/async/books/search/', AsyncBookSearchView.as_view(), name='async-book-search'),
+    path('api/async/borrow_due', AsyncBorrowDueView.as_view(), name='async-borrow-due'),
 ]
@@ -1,12 +1,15 @@
 from datetime import timedelta
 import json
+import logging
 
-from django.db import transaction
-from django.db.models import Count, Case, When, IntegerField, F, Q
-from django.http import JsonResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.views.generic import View
-from rest_framework import generics, permissions, status
+from rest_framework import generics, permissions, serializers, status
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -15,10 +18,18 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 
 
 
-from Django_final.emailing import email_borrow, email_reserve
-from books.choices import filter_conditions
-from books.models import Author, Genre, Book, Borrow, Reserve
-from books.paginators import CustomPageNumberPagination
+from Django_final.emailing import borrow_message, reserve_message
+from Django_final.routers import pin_to_primary, replica_reads
+from books.cache import statistics_cache
+from books.exports import csv_stream, ndjson_stream, serialized_chunks
+from books.fast_serializers import FastBookSerializer, FastBorrowSerializer, FastReserveSerializer
+from books.filters import BOOK_FILTERS, BORROW_FILTERS, RESERVE_FILTERS, FilterSchema
+from books.models import Author, Genre, Book, Borrow, OutOfStock, Reserve
+from books.outbox import enqueue
+from books.paginators import ChangeFeedPagination, CustomPageNumberPagination
+from books.profiling import route_stats, timed
+from books.search import ranked_books, search_books
+from books.suggest import suggest
 from books.serializers import (BookSerializer,
                                AuthorSerializer,
                                GenreSerializer,
@@ -29,15 +40,20 @@ from books.serializers import (BookSerializer,
                                BorrowStatusUpdateSerializer,
                                BorrowSerializer,
                                CreateBookSerializer,
+                               BookBatchCreateSerializer,
                                BorrowCreateSerializer,
                                ReserveCreateSerializer, CustomTokenObtainPairSerializer, TopBookSerializer,
                                TopWorstUserSerializer, CustomBorrowSerializer, CustomReserveSerializer,
+                               BorrowChangeSerializer,
                                )
 from books.view_permissions import CreatePermissions, IsSystemUser
 from users.choices import UserTypeChoices
 from users.models import CustomUser
 
 
+filter_usage_logger = logging.getLogger('books.filter_usage')
+
+
 class AtomicCreateAPIView(generics.CreateAPIView):
     permission_classes = [CreatePermissions]
     authentication_classes = [SessionAuthentication, JWTAuthentication]
@@ -64,46 +80,119 @@ class AtomicRetrieveUpdateAPIView(generics.RetrieveUpdateAPIView):
         return super().patch(request, *args, **kwargs)
 
 
-class AuthListAPIView(generics.ListAPIView):
-    permission_classes = [CreatePermissions]
-    authentication_classes = [SessionAuthentication, JWTAuthentication]
-
-    filter_conditions = filter_conditions
+class FilterMixin:
+    """
+    The `?filters=` / `?late=` list filtering, shared by the DRF list views and
+    the async views (it only reads `request.GET`). Filters are checked against
+    `filter_schema`, see books/filters.py.
+    """
+    filter_schema = FilterSchema({})
 
     def apply_filters(self, queryset):
-        filters = self.request.query_params.get('filters', '[]')
-        late = self.request.query_params.get('late', None)
+        compiled = self.filter_schema.compile(self.request.GET.get('filters'), self.request.GET.get('late'))
 
-        try:
-            filters = json.loads(filters)
-        except json.JSONDecodeError:
-            filters = []
+        if filter_usage_logger.isEnabledFor(logging.INFO) and (compiled.conditions or compiled.late):
+            filters = [{'field': path, 'condition': condition, 'value': json.loads(value)}
+                       for path, condition, value in compiled.conditions]
+            filter_usage_logger.info(json.dumps({'view': type(self).__name__, 'filters': filters,
+                                                 'late': compiled.late or None}))
 
-        if late and json.loads(late.lower()):
-            queryset = queryset.filter(due_date__lt=F('returned_at'))
+        for q in compiled.q:
+            queryset = queryset.filter(q)
 
-        for filter in filters:
-            field = filter.get('field')
-            value = filter.get('value')
-            sub_field = filter.get('sub_field', '')
-            condition = filter.get('condition', 'exact')
-            condition = self.filter_conditions.get(condition, '__exact')
+        queryset = queryset.order_by('id')
+        return queryset
 
-            if not field or value is None:
-                continue
 
-            if isinstance(value, str) and value.lower() in ['true', 'false']:
-                value = value.lower() == 'true'
+class ReplicaReadMixin:
+    """
+    Runs GET requests against a read replica, unless the user is pinned to the
+    primary after borrowing or reserving. Streamed exports are read after the
+    view returns and stay on the primary.
+    """
 
-            if sub_field:
-                filter_expression = f"{field}__{sub_field}{condition}"
-            else:
-                filter_expression = f"{field}{condition}"
+    def get(self, request, *args, **kwargs):
+        with replica_reads(request.user.pk):
+            return super().get(request, *args, **kwargs)
 
-            queryset = queryset.filter(**{filter_expression: value})
 
-        queryset = queryset.order_by('id')
-        return queryset
+class AuthListAPIView(ReplicaReadMixin, FilterMixin, generics.ListAPIView):
+    permission_classes = [CreatePermissions]
+    authentication_classes = [SessionAuthentication, JWTAuthentication]
+
+    cursor_ordering = ['id']
+
+
+class CachedStatisticsMixin:
+    """
+    Serves list responses from `statistics_cache`, keyed by view name and
+    absolute URL: the pagination links in a cached body carry the host.
+    """
+
+    def list(self, request, *args, **kwargs):
+        key = statistics_cache.make_key(type(self).__name__, request.build_absolute_uri())
+        data = statistics_cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        response.data = statistics_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class FastListMixin:
+    """
+    Serves list pages from `.values()` rows through `fast_serializer` instead of
+    building model instances for the DRF serializer. The output is identical.
+    """
+    fast_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_LIST_SERIALIZATION or self.fast_serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.fast_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        with timed('serialize'):
+            data = self.fast_serializer.serialize(rows)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class ExportMixin:
+    """
+    Streams the whole filtered list as NDJSON (default) or CSV (`?export_format=csv`)
+    instead of paginating it. Rows are read with a server-side cursor and serialized
+    `export_chunk_size` at a time, so memory does not grow with the export.
+    """
+    export_formats = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+    export_columns = ()
+    export_name = None
+    export_chunk_size = None
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'ndjson').lower()
+        if export_format not in self.export_formats:
+            return Response({'detail': f'Unsupported export format "{export_format}".'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        chunk_size = self.export_chunk_size or settings.EXPORT_CHUNK_SIZE
+        chunks = serialized_chunks(self.fast_serializer, queryset, chunk_size)
+        if export_format == 'csv':
+            content = csv_stream(chunks, self.export_columns)
+        else:
+            content = ndjson_stream(chunks)
+
+        response = StreamingHttpResponse(content, content_type=self.export_formats[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{self.export_name}.{export_format}"'
+        return response
 
 
 class AuthorCreateView(AtomicCreateAPIView):
@@ -148,6 +237,11 @@ class BookBatchCreateView(AtomicCreateAPIView):
     queryset = Book.objects.all()
     serializer_class = CreateBookSerializer
 
+    def get_serializer_class(self):
+        if isinstance(self.request.data, list):
+            return BookBatchCreateSerializer
+        return CreateBookSerializer
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, many=isinstance(request.data, list))
         serializer.is_valid(raise_exception=True)
@@ -155,56 +249,21 @@ class BookBatchCreateView(AtomicCreateAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class BookListAPIView(AuthListAPIView):
+class BookListAPIView(FastListMixin, AuthListAPIView):
     serializer_class = BookSerializer
+    fast_serializer = FastBookSerializer
     pagination_class = CustomPageNumberPagination
+    filter_schema = BOOK_FILTERS
 
     def get_queryset(self):
-        queryset = Book.objects.prefetch_related(
-            'authors',
-            'genres',
-            'borrows',
-            'reserves'
-        ).annotate(
-            borrows_count=Count(
-                Case(
-                    When(borrows__returned=False, then=1),
-                    output_field=IntegerField()
-                )
-            ),
-            reserves_count=Count(
-                Case(
-                    When(reserves__status=True, then=1),
-                    output_field=IntegerField()
-                )
-            )
-        )
-
+        queryset = BookSerializer.setup_eager_loading(Book.objects.all())
         queryset = self.apply_filters(queryset)
         queryset.order_by('id')
         return queryset
 
 
 class BookDetailsAPIView(AtomicRetrieveUpdateAPIView):
-    queryset = Book.objects.prefetch_related(
-        'authors',
-        'genres',
-        'borrows',
-        'reserves'
-    ).annotate(
-        borrows_count=Count(
-            Case(
-                When(borrows__returned=False, then=1),
-                output_field=IntegerField()
-            )
-        ),
-        reserves_count=Count(
-            Case(
-                When(reserves__status=True, then=1),
-                output_field=IntegerField()
-            )
-        )
-    )
+    queryset = BookSerializer.setup_eager_loading(Book.objects.all())
     serializer_class = BookSerializer
 
 
@@ -215,7 +274,7 @@ class AuthorListAPIView(AuthListAPIView):
 
 
 class AuthorDetailAPIView(AtomicRetrieveUpdateAPIView):
-    queryset = Author.objects.prefetch_related('books').annotate(books_count=Count('books'))
+    queryset = Author.objects.annotate(books_count=Count('books'))
     serializer_class = AuthorDetailsSerializer
 
 
@@ -226,12 +285,46 @@ class GenreListAPIView(AuthListAPIView):
 
 
 class GenreDetailAPIView(AtomicRetrieveUpdateAPIView):
-    queryset = Genre.objects.prefetch_related('books').annotate(books_count=Count('books'))
+    queryset = Genre.objects.annotate(books_count=Count('books'))
     serializer_class = GenreDetailsSerializer
 
 
-class ReserveDetailView(AtomicRetrieveUpdateAPIView):
-    queryset = Reserve.objects.all().order_by('id')
+class LoanAllocationMixin:
+    """
+    Stock and the one open loan per (user, book) rule are enforced by the
+    database, by Book.take_copy and the partial unique constraints, so
+    concurrent requests can neither overbook nor duplicate. This turns the
+    refusals into 409 / 400 responses.
+    """
+    duplicate_error = None
+
+    def allocation_error(self, error, user_id, book_id):
+        if isinstance(error, OutOfStock):
+            return Response({"error": "No copy of this book is available."}, status=status.HTTP_409_CONFLICT)
+        model = self.get_queryset().model
+        if not model.objects.filter(user_id=user_id, book_id=book_id,
+                                    **{model.active_field: model.active_value}).exists():
+            raise error
+        return Response({"error": self.duplicate_error}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LoanDetailAPIView(LoanAllocationMixin, AtomicRetrieveUpdateAPIView):
+    """
+    Reopening a loan takes a copy again, like creating one.
+    """
+
+    def update(self, request, *args, **kwargs):
+        try:
+            with transaction.atomic():
+                return super().update(request, *args, **kwargs)
+        except (OutOfStock, IntegrityError) as e:
+            loan = self.get_object()
+            return self.allocation_error(e, loan.user_id, loan.book_id)
+
+
+class ReserveDetailView(LoanDetailAPIView):
+    queryset = Reserve.objects.select_related('user', 'book').prefetch_related('book__authors', 'book__genres')
+    duplicate_error = "There is already an active reservation on this book."
 
     def get_serializer_class(self):
         if self.request.method in ['PATCH', 'PUT']:
@@ -239,8 +332,9 @@ class ReserveDetailView(AtomicRetrieveUpdateAPIView):
         return ReserveSerializer
 
 
-class BorrowDetailView(AtomicRetrieveUpdateAPIView):
-    queryset = Borrow.objects.all()
+class BorrowDetailView(LoanDetailAPIView):
+    queryset = Borrow.objects.select_related('user', 'book').prefetch_related('book__authors', 'book__genres')
+    duplicate_error = "There is already an active borrow on this book."
 
     def get_serializer_class(self):
         if self.request.method in ['PATCH', 'PUT']:
@@ -248,77 +342,89 @@ class BorrowDetailView(AtomicRetrieveUpdateAPIView):
         return BorrowSerializer
 
 
-class BorrowListAPIView(AuthListAPIView):
+class BorrowListAPIView(FastListMixin, AuthListAPIView):
     serializer_class = BorrowSerializer
+    fast_serializer = FastBorrowSerializer
     pagination_class = CustomPageNumberPagination
+    filter_schema = BORROW_FILTERS
+    cursor_ordering = ['due_date', 'id']
 
     def get_queryset(self):
-        queryset = Borrow.objects.all().prefetch_related('user', 'book')
+        queryset = BorrowSerializer.setup_eager_loading(Borrow.objects.all())
         if self.request.user.user_type == str(UserTypeChoices.STUDENT):
             queryset = queryset.filter(user=self.request.user)
 
         queryset = self.apply_filters(queryset)
 
-        queryset = queryset.order_by('due_date')
+        queryset = queryset.order_by('due_date', 'id')
         return queryset
 
 
-class ReserveListAPIView(AuthListAPIView):
+class BorrowExportAPIView(ExportMixin, BorrowListAPIView):
+    export_name = 'borrows'
+    export_columns = ('id', 'user.id', 'user.email', 'user.first_name', 'user.last_name',
+                      'book.id', 'book.title', 'book.release_date', 'book.stock', 'book.authors', 'book.genres',
+                      'borrowed_at', 'due_date', 'returned_at', 'returned')
+
+
+class ReserveListAPIView(FastListMixin, AuthListAPIView):
     serializer_class = ReserveSerializer
+    fast_serializer = FastReserveSerializer
     pagination_class = CustomPageNumberPagination
+    filter_schema = RESERVE_FILTERS
     ordering_fields = ['due_date']
     ordering = ['-due_date']
+    cursor_ordering = ['due_date', 'id']
 
     def get_queryset(self):
-        queryset = Reserve.objects.all().prefetch_related('user', 'book')
+        queryset = ReserveSerializer.setup_eager_loading(Reserve.objects.all())
         if self.request.user.user_type == str(UserTypeChoices.STUDENT):
             queryset = queryset.filter(user=self.request.user)
 
         queryset = self.apply_filters(queryset)
 
-        queryset = queryset.order_by('due_date')
+        queryset = queryset.order_by('due_date', 'id')
         return queryset
 
 
-class BorrowCreateView(AtomicCreateAPIView):
-    queryset = Borrow.objects.all()
-    serializer_class = BorrowCreateSerializer
-
-    def create(self, request, *args, **kwargs):
-        user = request.data.get('user')
-        book = request.data.get('book')
+class ReserveExportAPIView(ExportMixin, ReserveListAPIView):
+    export_name = 'reserves'
+    export_columns = ('id', 'user.id', 'user.email', 'user.first_name', 'user.last_name',
+                      'book.id', 'book.title', 'book.release_date', 'book.stock', 'book.authors', 'book.genres',
+                      'borrowed_at', 'due_date', 'status')
 
-        active_borrow = Borrow.objects.filter(user=user, book=book, returned=False).first()
 
-        if active_borrow:
-            return Response({"error": "There is already an active borrow on this book."},
-                            status=status.HTTP_400_BAD_REQUEST)
+class LoanCreateAPIView(LoanAllocationMixin, AtomicCreateAPIView):
 
+    def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        try:
+            with transaction.atomic():
+                self.perform_create(serializer)
+        except (OutOfStock, IntegrityError) as e:
+            return self.allocation_error(e, serializer.validated_data['user'].pk, serializer.validated_data['book'].pk)
+        pin_to_primary(request.user.pk, serializer.instance.user_id)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class ReserveCreateView(AtomicCreateAPIView):
-    queryset = Reserve.objects.all()
-    serializer_class = ReserveCreateSerializer
-    permission_classes = []
-
-    def create(self, request, *args, **kwargs):
-        user = request.data.get('user')
-        book = request.data.get('book')
+class BorrowCreateView(LoanCreateAPIView):
+    queryset = Borrow.objects.all()
+    serializer_class = BorrowCreateSerializer
+    duplicate_error = "There is already an active borrow on this book."
 
-        active_reserve = Reserve.objects.filter(user=user, book=book, status=True).first()
+    def perform_create(self, serializer):
+        # Borrowing a book the reader has reserved takes the reserved copy.
+        Reserve.close_matching(Reserve.objects.filter(user=serializer.validated_data['user'],
+                                                      book=serializer.validated_data['book']))
+        super().perform_create(serializer)
 
-        if active_reserve:
-            return Response({"error": "There is already an active reservation on this book."},
-                            status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+class ReserveCreateView(LoanCreateAPIView):
+    queryset = Reserve.objects.all()
+    serializer_class = ReserveCreateSerializer
+    permission_classes = []
+    duplicate_error = "There is already an active reservation on this book."
 
 
 class BookSearchView(View):
@@ -327,89 +433,173 @@ class BookSearchView(View):
     def get(self, request, *args, **kwargs):
         query = request.GET.get('query', '')
 
-        search_results = Book.objects.filter(title__icontains=query)
+        if query:
+            book_ids = search_books(query, limit=settings.SEARCH_RESULTS_LIMIT)
+            search_results = ranked_books(Book.objects.only('id', 'title'), book_ids)
+        else:
+            search_results = Book.objects.only('id', 'title')[:settings.SEARCH_RESULTS_LIMIT]
 
         results_list = [book.title for book in search_results]
         return JsonResponse({'results': results_list})
 
 
-class StatisticsTopBookListAPIView(AuthListAPIView):
+class BookSuggestView(View):
+    authentication_classes = [SessionAuthentication, JWTAuthentication]
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('query', '')
+        try:
+            limit = int(request.GET.get('limit', settings.SUGGEST_DEFAULT_LIMIT))
+        except ValueError:
+            limit = settings.SUGGEST_DEFAULT_LIMIT
+        limit = max(1, min(limit, settings.SUGGEST_MAX_LIMIT))
+
+        return JsonResponse({'results': suggest(query, limit)})
+
+
+class StatisticsTopBookListAPIView(CachedStatisticsMixin, AuthListAPIView):
     serializer_class = TopBookSerializer
     pagination_class = CustomPageNumberPagination
+    cursor_ordering = None
 
     def get_queryset(self):
-        queryset = Book.objects.prefetch_related(
-            'borrows'
-        ).annotate(borrows_count=Count('borrows')).order_by('-borrows_count')
-
-        queryset = queryset.order_by('-borrows_count')[:10]
+        queryset = TopBookSerializer.setup_eager_loading(Book.objects.all()).annotate(
+            borrows_count=Coalesce(Sum('daily_stats__borrows'), 0)
+        ).order_by('-borrows_count', 'id')[:10]
 
         return queryset
 
 
-class StatisticsBookBorrowsListAPIView(AuthListAPIView):
+class StatisticsBookBorrowsListAPIView(CachedStatisticsMixin, AuthListAPIView):
     serializer_class = TopBookSerializer
     pagination_class = CustomPageNumberPagination
+    cursor_ordering = None
 
     def get_queryset(self):
-        delta = timezone.now() - timedelta(days=365)
-        queryset = Book.objects.prefetch_related(
-            'borrows'
-        ).annotate(
-            borrows_count=Count(
-                Case(
-                    When(borrows__borrowed_at__gte=delta, then=1),
-                    output_field=IntegerField()
-                )
-            )
-        )
+        delta = timezone.localdate() - timedelta(days=365)
+        queryset = TopBookSerializer.setup_eager_loading(Book.objects.all()).annotate(
+            borrows_count=Coalesce(Sum('daily_stats__borrows', filter=Q(daily_stats__day__gte=delta)), 0)
+        ).order_by('id')
 
         return queryset
 
 
-class StatisticsBookBorrowsLateBooksListAPIView(AuthListAPIView):
+class StatisticsBookBorrowsLateBooksListAPIView(CachedStatisticsMixin, AuthListAPIView):
     serializer_class = TopBookSerializer
     pagination_class = CustomPageNumberPagination
+    cursor_ordering = None
 
     def get_queryset(self):
-        queryset = Book.objects.prefetch_related(
-            'borrows'
-        ).annotate(
-            borrows_count=Count(
-                Case(
-                    When(borrows__returned_at__gt=F('borrows__due_date'), then=1),
-                    output_field=IntegerField()
-                )
-            )
+        queryset = TopBookSerializer.setup_eager_loading(Book.objects.all()).annotate(
+            borrows_count=Coalesce(Sum('daily_stats__late_returns'), 0)
         )
-        queryset = queryset.order_by('-borrows_count')[:100]
+        queryset = queryset.order_by('-borrows_count', 'id')[:100]
         return queryset
 
 
-class StatisticsBookBorrowsLateUsersListAPIView(AuthListAPIView):
+class StatisticsBookBorrowsLateUsersListAPIView(CachedStatisticsMixin, AuthListAPIView):
     serializer_class = TopWorstUserSerializer
     pagination_class = CustomPageNumberPagination
+    cursor_ordering = None
 
     def get_queryset(self):
-        delta = timezone.now() - timedelta(days=365)
-        queryset = CustomUser.objects.prefetch_related(
-            'borrows'
-        ).annotate(
-            borrows_count=Count(
-                Case(
-                    When(borrows__returned_at__gt=F('borrows__due_date'), then=1),
-                    output_field=IntegerField()
-                )
-            )
+        queryset = CustomUser.objects.annotate(
+            borrows_count=Coalesce(Sum('late_stats__late_returns'), 0)
         )
-        queryset = queryset.order_by('-borrows_count')[:100]
+        queryset = queryset.order_by('-borrows_count', 'id')[:100]
         return queryset
 
 
-class BorrowDueView(APIView):
+class StatisticsCacheView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsSystemUser]
+
+    def get(self, request):
+        return Response(statistics_cache.stats(), status=status.HTTP_200_OK)
+
+
+class ProfilingStatsView(APIView):
+    """
+    Per-route latency, database time, serializer time and query count
+    percentiles recorded by ProfilingMiddleware in this process.
+    """
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsSystemUser]
 
+    def get(self, request):
+        return Response({'routes': route_stats()}, status=status.HTTP_200_OK)
+
+
+class DueNotificationMixin:
+    """
+    POST handler shared by the due views: takes a list of items and queues a
+    notice in the email outbox for every valid one that `claim` accepts, in the
+    same transaction. Reports the outcome per item and responds 200 when every
+    item was queued or a duplicate, 207 otherwise.
+    """
+    notification_serializer = None
+    # Called as message_builder(email, first_name, item[message_detail], book_title).
+    message_builder = None
+    message_detail = None
+    # Reported for the items `claim` turns down.
+    skip_reason = None
+
+    def build_message(self, data):
+        return self.message_builder(data['user']['email'], data['user']['first_name'], data[self.message_detail],
+                                    data['book']['title'])
+
+    def dedup_key(self, data):
+        return None
+
+    def claim(self, items):
+        """
+        Applies the change the notices are about and returns the items it applied to.
+        """
+        return items
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response({"error": "Expected a list of items"}, status=status.HTTP_400_BAD_REQUEST)
+
+        child = self.notification_serializer()
+        results = []
+        valid = []
+        for index, item in enumerate(request.data):
+            try:
+                data = child.run_validation(item)
+            except serializers.ValidationError as e:
+                results.append({'index': index, 'status': 'invalid', 'errors': e.detail})
+                continue
+            result = {'index': index, 'id': data.get('id'), 'status': 'queued'}
+            results.append(result)
+            valid.append((data, result))
+
+        with transaction.atomic():
+            claimed = {id(data) for data in self.claim([data for data, _ in valid])}
+            for data, result in valid:
+                if id(data) not in claimed:
+                    result.update(status='skipped', errors=[self.skip_reason])
+            valid = [(data, result) for data, result in valid if id(data) in claimed]
+            queued = enqueue([self.build_message(data) for data, _ in valid],
+                             [self.dedup_key(data) for data, _ in valid])
+        for (_, result), is_new in zip(valid, queued):
+            if not is_new:
+                result['status'] = 'duplicate'
+
+        invalid = sum(1 for result in results if result['status'] == 'invalid')
+        skipped = len(results) - invalid - len(valid)
+        return Response({'queued': sum(queued), 'duplicates': len(queued) - sum(queued), 'invalid': invalid,
+                         'skipped': skipped, 'results': results},
+                        status=status.HTTP_207_MULTI_STATUS if invalid or skipped else status.HTTP_200_OK)
+
+
+class BorrowDueView(DueNotificationMixin, APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsSystemUser]
+    notification_serializer = CustomBorrowSerializer
+    message_builder = staticmethod(borrow_message)
+    message_detail = 'due_date'
+
     def get(self, request):
         start_time = request.query_params.get('start_time')
         end_time = request.query_params.get('end_time')
@@ -430,24 +620,19 @@ class BorrowDueView(APIView):
         serializer = CustomBorrowSerializer(borrows, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-    def post(self, request):
-        # print(request.data)
-        serializer = CustomBorrowSerializer(data=request.data, many=True)
-        # print(serializer.is_valid())
-        if serializer.is_valid():
-            validated_data = serializer.validated_data
-            # print(validated_data)
-            for data in validated_data:
-                email_borrow(request, data['user']['email'], data['user']['first_name'],
-                             data['due_date'],
-                             data['book']['title'])
-            return Response(validated_data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
-class ReserveDueView(APIView):
+    def dedup_key(self, data):
+        if data.get('id') is None:
+            return None
+        return f"borrow-due:{data['id']}:{data['due_date'].isoformat()}"
+
+
+class ReserveDueView(DueNotificationMixin, APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsSystemUser]
+    notification_serializer = CustomReserveSerializer
+    message_builder = staticmethod(reserve_message)
+    message_detail = 'id'
+    skip_reason = 'Reservation is not open.'
 
     def get(self, request):
         start_time = request.query_params.get('start_time')
@@ -469,16 +654,48 @@ class ReserveDueView(APIView):
         serializer = CustomReserveSerializer(reserves, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-    def post(self, request):
-        serializer = CustomReserveSerializer(data=request.data, many=True)
-        if serializer.is_valid():
-            validated_data = serializer.validated_data
-            for data in validated_data:
-                email_reserve(request, data['user']['email'], data['user']['first_name'],
-                              request.data[0]['id'],
-                              data['book']['title'])
-                reserve = Reserve.objects.get(pk=request.data[0]['id'], status=True)
-                reserve.status = False
-                reserve.save()
-            return Response(validated_data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    def dedup_key(self, data):
+        return f"reserve-due:{data['id']}"
+
+    def claim(self, items):
+        # Only reservations that were still open get a notice.
+        closed = set(Reserve.close([data['id'] for data in items]))
+        return [data for data in items if data['id'] in closed]
+
+
+class ChangeFeedView(generics.ListAPIView):
+    """
+    Rows changed after `?cursor=`, oldest change first. A request without a
+    cursor only returns active rows, since a new client has nothing to
+    reconcile; afterwards clients keep following `next`, so each poll costs in
+    proportion to what changed. Every poll first numbers the rows saved since
+    the previous one, see ChangeTracked.stamp_changes().
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsSystemUser]
+    pagination_class = ChangeFeedPagination
+    model = None
+    active_filter = {}
+
+    def list(self, request, *args, **kwargs):
+        self.model.stamp_changes()
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        # Rows saved after stamp_changes() ran wait for the next poll.
+        queryset = self.model.objects.select_related('user', 'book').filter(change_seq__isnull=False)
+        if not self.request.query_params.get(ChangeFeedPagination.cursor_query_param):
+            queryset = queryset.filter(**self.active_filter)
+        return queryset
+
+
+class BorrowChangesView(ChangeFeedView):
+    serializer_class = BorrowChangeSerializer
+    model = Borrow
+    active_filter = {'returned': False}
+
+
+class ReserveChangesView(ChangeFeedView):
+    serializer_class = CustomReserveSerializer
+    model = Reserve
+    active_filter = {'status': True}
@@ -0,0 +1,155 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.generic import View
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, PermissionDenied, ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from books.fast_serializers import FastBookSerializer
+from books.filters import BOOK_FILTERS
+from books.models import Book, Borrow
+from books.search import search_books
+from books.serializers import CustomBorrowSerializer
+from books.view_permissions import CreatePermissions, IsSystemUser
+from books.views.api_views import FilterMixin
+from users.models import CustomUser
+
+
+def json_response(data, status=200):
+    """
+    JsonResponse rendered like DRF's JSONRenderer (compact, UTF-8), so async and
+    sync endpoints return the same bytes.
+    """
+    return JsonResponse(data, status=status, safe=False,
+                        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False})
+
+
+async def authenticate(request):
+    """
+    Async equivalent of [JWTAuthentication, SessionAuthentication]. Validating
+    the token needs no database access, so only the user lookup is awaited.
+    """
+    jwt = JWTAuthentication()
+    header = jwt.get_header(request)
+    raw_token = jwt.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return await request.auser()
+
+    token = jwt.get_validated_token(raw_token)
+    user = await CustomUser.objects.filter(
+        **{api_settings.USER_ID_FIELD: token[api_settings.USER_ID_CLAIM]}, is_active=True
+    ).afirst()
+    if user is None:
+        raise AuthenticationFailed('User not found')
+    return user
+
+
+class AsyncAPIView(View):
+    """
+    Base for async read endpoints served without DRF's sync request cycle.
+    Reuses the DRF permission classes, which only look at `request.user`.
+    """
+    permission_classes = []
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.permission_classes:
+            try:
+                request.user = await authenticate(request)
+            except AuthenticationFailed as e:
+                return json_response({'detail': str(e.detail)}, status=401)
+            for permission_class in self.permission_classes:
+                if not permission_class().has_permission(request, self):
+                    error = PermissionDenied if request.user.is_authenticated else NotAuthenticated
+                    return json_response({'detail': error.default_detail}, status=error.status_code)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncBookListView(FilterMixin, AsyncAPIView):
+    """
+    Async BookListAPIView: same filters, page-number pagination and output.
+    """
+    permission_classes = [CreatePermissions]
+    filter_schema = BOOK_FILTERS
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get('page_size', settings.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.DEFAULT_PAGE_SIZE
+        return max(1, min(page_size, settings.MAX_PAGE_SIZE))
+
+    def get_link(self, page_number):
+        url = self.request.build_absolute_uri()
+        if page_number == 1:
+            return remove_query_param(url, 'page')
+        return replace_query_param(url, 'page', page_number)
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            queryset = FastBookSerializer.values(self.apply_filters(Book.objects.all()))
+        except ValidationError as e:
+            return json_response(e.detail, status=400)
+        page_size = self.get_page_size()
+        try:
+            page_number = int(request.GET.get('page', 1))
+        except ValueError:
+            page_number = 0
+
+        count = await queryset.acount()
+        page_count = max(1, -(-count // page_size))
+        if not 1 <= page_number <= page_count:
+            return json_response({'detail': 'Invalid page.'}, status=404)
+
+        offset = (page_number - 1) * page_size
+        rows = [row async for row in queryset[offset:offset + page_size]]
+        return json_response({
+            'count': count,
+            'next': self.get_link(page_number + 1) if page_number < page_count else None,
+            'previous': self.get_link(page_number - 1) if page_number > 1 else None,
+            'results': await FastBookSerializer.aserialize(rows),
+        })
+
+
+class AsyncBookSearchView(AsyncAPIView):
+
+    async def get(self, request, *args, **kwargs):
+        query = request.GET.get('query', '')
+        books = Book.objects.only('id', 'title')
+
+        if query:
+            # The index lookup is raw SQL (FTS5) or an in-memory structure, neither has an async API.
+            book_ids = await sync_to_async(search_books)(query, limit=settings.SEARCH_RESULTS_LIMIT)
+            found = await books.ain_bulk(book_ids)
+            search_results = [found[book_id] for book_id in book_ids if book_id in found]
+        else:
+            search_results = [book async for book in books[:settings.SEARCH_RESULTS_LIMIT]]
+
+        return json_response({'results': [book.title for book in search_results]})
+
+
+class AsyncBorrowDueView(AsyncAPIView):
+    permission_classes = [IsSystemUser]
+
+    async def get(self, request, *args, **kwargs):
+        start_time = request.GET.get('start_time')
+        end_time = request.GET.get('end_time')
+
+        if not start_time or not end_time:
+            return json_response({"error": "start_time and end_time are required"}, status=400)
+
+        try:
+            start_time = timezone.datetime.fromisoformat(start_time)
+            end_time = timezone.datetime.fromisoformat(end_time)
+        except ValueError:
+            return json_response({"error": "Invalid date format. Use ISO 8601 format."}, status=400)
+
+        borrows = Borrow.objects.filter(
+            Q(due_date__gte=start_time) & Q(due_date__lte=end_time) & Q(returned=False)
+        ).select_related('user', 'book')
+
+        borrows = [borrow async for borrow in borrows]
+        return json_response(CustomBorrowSerializer(borrows, many=True).data)
@@ -11,6 +11,7 @@ from Django_final.emailing import email
 from books.forms import BookForm, GenreForm
 from books.models import Book, Reserve, Borrow, Genre
 from books.paginators import CustomPageNumberPagination
+from books.search import ranked_books, search_books
 
 
 class MyListView(LoginRequiredMixin, ListView):
@@ -63,10 +64,11 @@ class BookSearchView(MyListView):
         genre_id = self.request.GET.get('genre', None)
         queryset = Book.objects.all()
 
-        if query:
-            queryset = queryset.filter(title__icontains=query)
         if genre_id:
             queryset = queryset.filter(genres__id=genre_id)
+        if query:
+            book_ids = search_books(query, limit=settings.SEARCH_RESULTS_LIMIT)
+            return ranked_books(queryset, book_ids)
 
         return queryset
 
@@ -83,9 +85,9 @@ class BookDetailView(LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         context['form'] = BookForm(self.request.GET)
         book = self.object
-        borrows_count = book.borrows.filter(returned=False).count()
-        reserves_count = book.reserves.filter(status=True).count()
-        available_to_borrow = book.stock > borrows_count + reserves_count if book.stock > 0 else False
+        borrows_count = book.active_borrows
+        reserves_count = book.active_reserves
+        available_to_borrow = book.available_to_borrow
         user = self.request.user
 
         user_reserved_book = Reserve.objects.filter(user=user, book=book, status=True).exists()
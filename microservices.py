@@ -1,148 +1,228 @@
+import asyncio
+import heapq
+import itertools
 import sys
-import threading
-import time
-import requests
-from datetime import datetime, timedelta
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 import pytz
+import requests
 from decouple import config
+from requests.adapters import HTTPAdapter
 
 base_urls = {'reserve': 'http://localhost:8000/api/reserve_due',
              'borrow': 'http://localhost:8000/api/borrow_due'}
+feed_urls = {'reserve': 'http://localhost:8000/api/reserve_due/changes',
+             'borrow': 'http://localhost:8000/api/borrow_due/changes'}
+# Whether a feed item still needs a notice; returned borrows and closed reserves drop out of the queue.
+is_active = {'reserve': lambda item: item['status'],
+             'borrow': lambda item: not item['returned']}
 token_url = "http://localhost:8000/api/token/"
 token_refresh = "http://localhost:8000/api/token/refresh/"
 
-FETCH_INTERVAL_MINUTES = 10
+# How long to wait before polling the change feed again once it is drained.
+FEED_POLL_SECONDS = 15
+# Items due at the same moment are POSTed together, at most BATCH_SIZE per request.
+BATCH_SIZE = 100
+# Upper bound on in-flight HTTP requests, which is also the size of the connection pool.
+CONCURRENCY = 8
+
+tz = pytz.timezone('Asia/Tbilisi')
 
 credentials = {
     "email": "system@mail.com",
     "password": config('SYSTEM_PASSWORD')
 }
 
-access_token = None
-refresh_token = None
-token_lock = threading.Lock()
 
-data_queue = deque()
-
-
-def authenticate():
-    global access_token, refresh_token
-    response = requests.post(token_url, json=credentials)
-    if response.status_code == 200:
+class HttpClient:
+    """
+    Pooled keep-alive HTTP client for coroutines. Requests run on a thread pool
+    sized like the connection pool, so at most CONCURRENCY are in flight.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def request(self, method, url, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: self.session.request(method, url, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+class TokenManager:
+    """
+    Holds the JWT pair. When many requests hit 401 at once, only the first one
+    refreshes the token; the others wait for it and reuse the new one.
+    """
+
+    def __init__(self, http):
+        self.http = http
+        self.access_token = None
+        self.refresh_token = None
+        self.lock = asyncio.Lock()
+
+    async def authenticate(self):
+        response = await self.http.request('POST', token_url, json=credentials)
+        if response.status_code != 200:
+            raise RuntimeError(f'Authentication failed: {response.status_code}')
         data = response.json()
-        with token_lock:
-            access_token = data.get("access")
-            refresh_token = data.get("refresh")
+        self.access_token = data.get("access")
+        self.refresh_token = data.get("refresh")
         print("Authentication successful")
-    else:
-        print("Authentication failed")
 
+    async def refresh(self, stale_token):
+        async with self.lock:
+            if self.access_token != stale_token:
+                return
+            response = await self.http.request('POST', token_refresh, json={"refresh": self.refresh_token})
+            if response.status_code == 200:
+                self.access_token = response.json().get("access")
+                print("Access token refreshed")
+            else:
+                print(f"Failed to refresh access token: {response.status_code}, authenticating again")
+                await self.authenticate()
+
+    async def request(self, method, url, **kwargs):
+        token = self.access_token
+        response = await self.http.request(method, url, headers={'Authorization': f'Bearer {token}'}, **kwargs)
+        if response.status_code == 401:
+            await self.refresh(token)
+            response = await self.http.request(
+                method, url, headers={'Authorization': f'Bearer {self.access_token}'}, **kwargs
+            )
+        return response
+
+
+class Pipeline:
+    """
+    Follows the change feed of `name` and POSTs each active item back to
+    `base_url` once its due date has passed.
+
+    Pending items live in a min-heap keyed on the due date, so the dispatcher
+    always waits for the earliest item, and sleeps until either that item is
+    due or the fetcher pushes a new one. A change to a queued item supersedes
+    its heap entry, which is then skipped when popped.
+    """
+
+    def __init__(self, name, tokens):
+        self.name = name
+        self.base_url = base_urls[name]
+        self.feed_url = feed_urls[name]
+        self.is_active = is_active[name]
+        self.tokens = tokens
+        self.heap = []
+        self.items = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(CONCURRENCY)
+        self.sending = set()
+
+    def push(self, item):
+        self.items.pop(item['id'], None)
+        if not self.is_active(item):
+            return
+        self.items[item['id']] = item
+        due_date = datetime.fromisoformat(item['due_date'])
+        heapq.heappush(self.heap, (due_date, next(self.counter), item))
+        self.wakeup.set()
+
+    async def run_fetcher(self):
+        url = self.feed_url
+        while True:
+            try:
+                response = await self.tokens.request('GET', url)
+            except requests.RequestException as e:
+                print(f'[{self.name}] Failed to fetch changes: {e}')
+                response = None
+            if response is None or response.status_code != 200:
+                if response is not None:
+                    print(f'[{self.name}] Failed to fetch changes: {response.status_code}')
+                await asyncio.sleep(FEED_POLL_SECONDS)
+                continue
 
-def refresh_access_token():
-    global access_token
-    with token_lock:
-        response = requests.post(token_refresh, json={"refresh": refresh_token})
-        if response.status_code == 200:
             data = response.json()
-            access_token = data.get("access")
-            print("Access token refreshed")
-        else:
-            print("Failed to refresh access token")
-
-
-def fetch_data(start_time, end_time):
-    global access_token
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-    }
-
-    params = {
-        'start_time': start_time.isoformat(),
-        'end_time': end_time.isoformat()
-    }
-
-    response = requests.get(base_url, headers=headers, params=params)
-    if response.status_code == 200:
-        return response.json()
-    elif response.status_code == 401:
-        refresh_access_token()
-        return fetch_data(start_time, end_time)
-    else:
-        print(f'Failed to fetch data: {response.status_code}')
-        return None
-
-
-def data_provider(data_queue):
-    tz = pytz.timezone('Asia/Tbilisi')
-    start_time = datetime.now(tz)
-    end_time = start_time + timedelta(minutes=FETCH_INTERVAL_MINUTES)
-
-    while True:
-        data = fetch_data(start_time, end_time)
-        print('data', data)
-        if data:
-            for item in data:
-                data_queue.append(item)
-        time.sleep(FETCH_INTERVAL_MINUTES * 60)
-        start_time = end_time
-        end_time = start_time + timedelta(minutes=FETCH_INTERVAL_MINUTES)
-
-
-def data_processor(data_queue):
-    while True:
-        if data_queue:
-            data = data_queue.popleft()
-            print(data)
-            tbilisi_tz = pytz.timezone('Asia/Tbilisi')
-            now = datetime.now(tz=tbilisi_tz)
-            due_date = datetime.fromisoformat(data['due_date'])
-
-            if now >= due_date:
-                headers = {
-                    'Authorization': f'Bearer {access_token}',
-                }
-                response = requests.post(base_url, headers=headers, json=[data])
-                if response.status_code == 200:
-                    print('Data sent successfully')
-                elif response.status_code == 401:
-                    refresh_access_token()
-                    headers = {
-                        'Authorization': f'Bearer {access_token}',
-                    }
-                    response = requests.post(base_url, headers=headers, json=[data])
-                    if response.status_code == 200:
-                        print('Data sent successfully after refreshing token')
-                    else:
-                        print(f'Failed to send data after refreshing token: {response.status_code}')
-                else:
-                    print(f'Failed to send data: {response.status_code}')
-            else:
-                sleep_time = (due_date - now).total_seconds()
-                data_queue.appendleft(data)
-                print(f"sleeping for {sleep_time} seconds")
-                time.sleep(sleep_time)
+            if data['results']:
+                print(f"[{self.name}] fetched {len(data['results'])} changes")
+            for item in data['results']:
+                self.push(item)
+            url = data['next']
+            if not data['has_more']:
+                await asyncio.sleep(FEED_POLL_SECONDS)
+
+    def pop_due(self):
+        now = datetime.now(tz)
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, item = heapq.heappop(self.heap)
+            if self.items.get(item['id']) is item:
+                del self.items[item['id']]
+                due.append(item)
+        return due
+
+    async def run_dispatcher(self):
+        while True:
+            self.wakeup.clear()
+            due = self.pop_due()
+            for start in range(0, len(due), BATCH_SIZE):
+                task = asyncio.create_task(self.send(due[start:start + BATCH_SIZE]))
+                self.sending.add(task)
+                task.add_done_callback(self.sending.discard)
+
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = (self.heap[0][0] - datetime.now(tz)).total_seconds()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def send(self, batch):
+        async with self.semaphore:
+            try:
+                response = await self.tokens.request('POST', self.base_url, json=batch)
+            except requests.RequestException as e:
+                print(f'[{self.name}] Failed to send {len(batch)} items: {e}')
+                return
+        if response.status_code == 200:
+            print(f'[{self.name}] Sent {len(batch)} items')
+        elif response.status_code == 207:
+            report = response.json()
+            print(f"[{self.name}] Sent {report['queued']} items, {report['invalid']} invalid")
         else:
-            time.sleep(1)
+            print(f'[{self.name}] Failed to send {len(batch)} items: {response.status_code}')
 
+    async def run(self):
+        await asyncio.gather(self.run_fetcher(), self.run_dispatcher())
 
-if __name__ == '__main__':
-    base_url = base_urls[sys.argv[1] if len(sys.argv) > 1 else 'borrow']
-    print("Base URL:", base_url)
+
+async def main(names):
+    http = HttpClient()
     try:
-        authenticate()
-
-        fetcher_thread = threading.Thread(target=data_provider, args=(data_queue,))
-        processor_thread = threading.Thread(target=data_processor, args=(data_queue,))
-        #
-        #
-        fetcher_thread.start()
-        processor_thread.start()
-        #
-        #
-        fetcher_thread.join()
-        processor_thread.join()
+        tokens = TokenManager(http)
+        await tokens.authenticate()
+        pipelines = [Pipeline(name, tokens) for name in names]
+        await asyncio.gather(*(pipeline.run() for pipeline in pipelines))
+    finally:
+        http.close()
+
 
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(base_urls)
+    unknown = set(names) - set(base_urls)
+    if unknown:
+        sys.exit(f"Unknown pipeline(s): {', '.join(sorted(unknown))}. Choose from {', '.join(base_urls)}")
+    print("Pipelines:", ', '.join(names))
+    try:
+        asyncio.run(main(names))
     except KeyboardInterrupt:
         print("Keyboard interrupt detected. Stopping the process...")
         sys.exit()